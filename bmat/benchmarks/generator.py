@@ -0,0 +1,82 @@
+'''Generates synthetic DSR files, named and formatted like the ones in bmat/data
+(Spotify_<plan>_<TERRITORY>_<CURRENCY>_<start>-<end>.tsv.gz), with as many rows as needed.
+
+Revenues follow a Pareto distribution: the smaller the skew, the more the revenue concentrates in a few DSPs (the
+default, 1.16, is the classic 80/20 split). Artists and ISRCs are drawn from pools, so that they repeat across rows as
+they do in real files.
+
+    python -m benchmarks.generator --rows 1000000 --territories ES:EUR,NO:NOK --months 3 --output /tmp/dsrs
+'''
+import argparse
+import gzip
+import os
+import random
+import string
+import sys
+from decimal import Decimal
+
+PLANS        = ('SpotifyFree', 'SpotifyDuo', 'SpotifyStudent', 'SpotifyFamilyPlan')
+TERRITORIES  = (('ES', 'EUR'), ('NO', 'NOK'), ('CH', 'CHF'), ('GB', 'GBP'))
+HEADER       = ('dsp_id', 'title', 'artists', 'isrc', 'usages', 'revenue')
+SKEW         = 1.16
+
+
+def dsr_file_name(plan, territory, currency, year, month):
+    '''Name of the DSR file of a plan, territory and month. Periods end on the 28th, like February'''
+    return f'Spotify_{plan}_{territory}_{currency}_{year}{month:02}01-{year}{month:02}28.tsv.gz'
+
+def _random_code(rng, alphabet, length):
+    return ''.join(rng.choices(alphabet, k=length))
+
+def random_rows(rows, skew=SKEW, seed=0):
+    '''Yields rows random DSR rows, as tuples of strings in the order of HEADER'''
+    rng      = random.Random(seed)
+    artists  = [f'{_random_code(rng, string.ascii_letters, 8)} {_random_code(rng, string.ascii_letters, 10)}' for _ in range(max(rows // 50, 1))]
+    isrcs    = [_random_code(rng, string.ascii_uppercase, 5) + _random_code(rng, string.digits, 7) for _ in range(max(rows // 5, 1))]
+
+    for _ in range(rows):
+        revenue = Decimal(rng.paretovariate(skew)).quantize(Decimal('0.0001'))
+        yield (_random_code(rng, string.ascii_letters, 30), 'synthetic title', rng.choice(artists), rng.choice(isrcs),
+               str(rng.randint(0, 10 ** 6)), str(revenue))
+
+def write_dsr_file(path, rows, skew=SKEW, seed=0):
+    '''Writes a gzipped DSR file of rows random rows'''
+    with gzip.open(path, 'wt', encoding='utf-8', compresslevel=1) as fh:
+        fh.write('\t'.join(HEADER) + '\n')
+        for row in random_rows(rows, skew, seed):
+            fh.write('\t'.join(row) + '\n')
+
+def generate_dsr_files(directory, rows, territories=TERRITORIES, months=1, year=2020, skew=SKEW, seed=0):
+    '''Writes one file per territory and month of year into directory, with rows rows in total, and
+    returns their paths. territories is a sequence of (territory, currency) code pairs'''
+    os.makedirs(directory, exist_ok=True)
+
+    files   = [(territory, currency, month) for territory, currency in territories for month in range(1, months + 1)]
+    paths   = list()
+
+    for i, (territory, currency, month) in enumerate(files):
+        file_rows  = rows // len(files) + (1 if i < rows % len(files) else 0)
+        path       = os.path.join(directory, dsr_file_name(PLANS[i % len(PLANS)], territory, currency, year, month))
+        write_dsr_file(path, file_rows, skew, seed + i)
+        paths.append(path)
+
+    return paths
+
+def _parse_territories(value):
+    return [tuple(pair.split(':')) for pair in value.split(',')]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10000, help='total number of rows, spread over all the files')
+    parser.add_argument('--territories', type=_parse_territories, default=TERRITORIES, help='TERRITORY:CURRENCY pairs, comma separated')
+    parser.add_argument('--months', type=int, default=1, help='number of monthly files per territory')
+    parser.add_argument('--skew', type=float, default=SKEW, help='Pareto shape of the revenues (smaller is more skewed)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', required=True, help='directory the files are written into')
+    args = parser.parse_args(argv)
+
+    for path in generate_dsr_files(args.output, args.rows, args.territories, args.months, skew=args.skew, seed=args.seed):
+        print(path)
+
+if __name__ == '__main__':
+    sys.exit(main())
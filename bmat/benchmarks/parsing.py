@@ -0,0 +1,57 @@
+'''Compares the rows per second of the DSR file parsers: line by line (DsrRecord objects grouped in
+batches) and column by column (see dsrs.utils._iter_column_batches), with and without numpy.
+
+Run it from the bmat directory. It parses the sample files in bmat/data by default, or any other ones (e.g. made
+with benchmarks.generator):
+
+    python -m benchmarks.parsing --repeat 20
+    python -m benchmarks.parsing --repeat 1 /tmp/dsrs/*.tsv.gz
+'''
+import argparse
+import sys
+import time
+
+from dsrs import utils
+
+
+def _by_lines(path, batch_size):
+    opener = utils._get_file_handler(path)
+    return map(utils.DsrBatch.from_records, utils.batched(utils._iter_records(opener, path), batch_size))
+
+def _by_columns(path, batch_size):
+    return utils._iter_column_batches(utils._get_file_handler(path), path, batch_size)
+
+
+# Name -> (parser, use numpy)
+_parsers = {
+    'lines'          : (_by_lines, False),
+    'columns'        : (_by_columns, False),
+    'columns+numpy'  : (_by_columns, True),
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='*', help='DSR files to parse (the samples in bmat/data by default)')
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=10, help='times every file is parsed')
+    args = parser.parse_args(argv)
+
+    paths   = [utils.Path(path) for path in args.files] or sorted(utils.DATA_DIR.glob('*.tsv*'))
+    numpy   = utils.numpy
+
+    for name, (parse, use_numpy) in _parsers.items():
+        if use_numpy and numpy is None:
+            print(f'{name:>14}: skipped, numpy is not installed')
+            continue
+
+        utils.numpy = numpy if use_numpy else None
+        start       = time.perf_counter()
+        rows        = sum(len(batch) for _ in range(args.repeat) for path in paths for batch in parse(path, args.batch_size))
+        seconds     = time.perf_counter() - start
+        utils.numpy = numpy
+
+        print(f'{name:>14}: {rows} rows in {seconds:.3f} s ({rows / seconds:,.0f} rows/s)')
+
+if __name__ == '__main__':
+    sys.exit(main())
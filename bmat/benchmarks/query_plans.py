@@ -0,0 +1,114 @@
+'''Shows the query plans and timings of the /resources/percentile/ queries, without and with the DSP/DSR
+indexes, on a generated dataset.
+
+Run it from the bmat directory (it uses its own throwaway SQLite database, or the one in DATABASE_NAME):
+
+    python -m benchmarks.query_plans --rows 1000000
+'''
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'digital.settings')
+os.environ.setdefault('DJANGO_SECRET_KEY', 'benchmark')
+os.environ.setdefault('DSRS_RATE_PROVIDER', 'dsrs.rates.FileRateProvider')
+
+if 'DATABASE_NAME' not in os.environ:
+    os.environ['DATABASE_NAME'] = os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite3')
+    os.environ.setdefault('DSRS_REVENUE_INDEX_DIR', os.path.join(os.path.dirname(os.environ['DATABASE_NAME']), 'revenue_index'))
+
+import django
+django.setup()
+
+from django.core.management import call_command
+from django.db              import connection
+
+from benchmarks             import generator
+from dsrs                   import ingestion, models, utils, views
+
+TERRITORIES = (('ES', 'Spain', 'ESP', 'EUR'), ('NO', 'Norway', 'NOR', 'NOK'), ('CH', 'Switzerland', 'CHE', 'CHF'), ('GB', 'United Kingdom', 'GBR', 'GBP'))
+MONTHS      = 12
+
+
+def generate_dataset(rows, seed=0):
+    '''Ingests rows random DSPs, spread over one DSR per territory and month of 2020'''
+    dsrs = list()
+
+    for code_2, name, code_3, code in TERRITORIES:
+        currency, _   = models.Currency.objects.get_or_create(name=code, symbol=code, code=code)
+        territory, _  = models.Territory.objects.get_or_create(name=name, code_2=code_2, code_3=code_3, local_currency=currency)
+
+        for month in range(1, MONTHS + 1):
+            dsrs.append(models.DSR.objects.create(path=f'{code_2}/{month}', period_start=f'2020-{month:02}-01', period_end=f'2020-{month:02}-28',
+                                                  status='ingested', territory=territory, currency=currency))
+
+    rows_per_dsr = rows // len(dsrs)
+    for i, dsr in enumerate(dsrs):
+        ingestion.ingest_dsr_records(dsr, (utils.DsrRecord(*row) for row in generator.random_rows(rows_per_dsr, seed=seed + i)))
+
+def _benchmarked_queries():
+    '''The queries behind /resources/percentile/, for some typical filters, with a function running them'''
+    filters = {
+        'territory'  : {'territory__code_2': 'ES'},
+        'currency'   : {'currency__code': 'NOK'},
+        'period'     : {'period_start__gte': '2020-03-01', 'period_end__lte': '2020-03-31'},
+        'all'        : {'territory__code_2': 'GB', 'currency__code': 'GBP', 'period_start__gte': '2020-06-01', 'period_end__lte': '2020-06-30'},
+    }
+
+    for name, dsr_filter in filters.items():
+        dsps = models.DSP.objects.filter(revenue_eur__isnull=False, **views._dsp_filter(dsr_filter))
+        yield f'percentile 10 by {name}', views._with_running_revenue(dsps), lambda dsps=dsps: len(list(views._iter_percentile_with_window(dsps, 10)))
+
+        revenue, count = views._percentile_cutoff(dsr_filter, 10)
+        above = dsps.filter(revenue_eur__gte=revenue or 0).order_by(*views._percentile_ordering)[:count]
+        yield f'percentile 10 by {name} (revenue index)', above, lambda dsr_filter=dsr_filter, dsps=dsps: len(list(
+            views._iter_percentile_with_index(dsps, views._percentile_cutoff(dsr_filter, 10))))
+
+        dsrs = models.DSR.objects.filter(**dsr_filter)
+        yield f'dsr lookup by {name}', dsrs, lambda dsrs=dsrs: len(list(dsrs))
+
+def _indexes():
+    return [(model, index) for model in (models.DSP, models.DSR) for index in model._meta.indexes]
+
+def _run_queries(label):
+    print(f'\n===== {label} =====')
+
+    for name, queryset, run in _benchmarked_queries():
+        start    = time.perf_counter()
+        count    = run()
+        elapsed  = time.perf_counter() - start
+
+        print(f'\n--- {name}: {count} rows in {elapsed * 1000:.1f} ms')
+        print(queryset.explain())
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000000, help='number of DSP rows to generate')
+    args = parser.parse_args(argv)
+
+    call_command('migrate', verbosity=0)
+
+    if not models.DSP.objects.exists():
+        start = time.perf_counter()
+        generate_dataset(args.rows)
+        print(f'Generated {models.DSP.objects.count()} DSPs in {time.perf_counter() - start:.1f} s ({connection.settings_dict["NAME"]})')
+
+    with connection.schema_editor() as editor:
+        for model, index in _indexes():
+            editor.remove_index(model, index)
+
+    _run_queries('without indexes')
+
+    with connection.schema_editor() as editor:
+        for model, index in _indexes():
+            editor.add_index(model, index)
+
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+    _run_queries('with indexes')
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,153 @@
+'''Scripted benchmarks of the DSR pipeline, reported in JSON.
+
+For every size, synthetic DSR files are generated (see benchmarks.generator) and then measured:
+
+- parse: rows/s of utils.iter_dsr_records over all the files, without the database.
+- insert: rows/s of the whole ingestion (ingestion.register_dsr_file and ingestion.ingest_dsr_files).
+- percentile: latency of the /resources/percentile/ view, for a few percentiles and filters. Cold runs make the
+  cached results stale first (caching.bump_data_version), warm runs are served from the cache.
+
+Run it from the bmat directory. It uses its own throwaway SQLite database (or the one in DATABASE_NAME, which is
+flushed before every size):
+
+    python -m benchmarks.run --sizes 10000,1000000,10000000 --output report.json
+'''
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'digital.settings')
+os.environ.setdefault('DJANGO_SECRET_KEY', 'benchmark')
+os.environ.setdefault('DSRS_RATE_PROVIDER', 'dsrs.rates.FileRateProvider')
+
+if 'DATABASE_NAME' not in os.environ:
+    os.environ['DATABASE_NAME'] = os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite3')
+    os.environ.setdefault('DSRS_REVENUE_INDEX_DIR', os.path.join(os.path.dirname(os.environ['DATABASE_NAME']), 'revenue_index'))
+
+import django
+django.setup()
+
+from django.conf            import settings
+from django.core.management import call_command
+from django.db              import connection
+from django.test            import RequestFactory
+
+from benchmarks             import generator
+from dsrs                   import caching, ingestion, refdata, utils, views
+
+PERCENTILES  = (10, 50, 90)
+FILTERS      = {
+    'none'       : {},
+    'territory'  : {'territory': 'ES'},
+    'currency'   : {'currency': 'NOK'},
+}
+
+
+def _throughput(rows, seconds):
+    return {'rows': rows, 'seconds': round(seconds, 6), 'rows_per_second': round(rows / seconds if seconds else 0.0, 1)}
+
+def bench_parse(paths):
+    start  = time.perf_counter()
+    rows   = sum(len(batch) for path in paths for batch in utils.iter_dsr_records(path, batch_size=settings.DSRS_INGESTION_BATCH_SIZE))
+    return _throughput(rows, time.perf_counter() - start)
+
+def bench_insert(paths, workers):
+    start      = time.perf_counter()
+    dsr_files  = [(dsr, path) for dsr, path in zip(map(ingestion.register_dsr_file, paths), paths) if dsr is not None]
+    stats      = ingestion.ingest_dsr_files(dsr_files, workers=workers)
+    return _throughput(sum(s.rows for s in stats), time.perf_counter() - start)
+
+def _time_percentile(factory, percentile, params, runs, cold):
+    latencies = list()
+    for _ in range(runs):
+        if cold:
+            caching.bump_data_version()
+
+        start     = time.perf_counter()
+        response  = views.percentile(factory.get(f'/resources/percentile/{percentile}/', params), percentile)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    return response, latencies
+
+def bench_percentile(runs):
+    factory = RequestFactory()
+    results = list()
+
+    for percentile in PERCENTILES:
+        for name, params in FILTERS.items():
+            response, cold  = _time_percentile(factory, percentile, params, runs, cold=True)
+            _, warm         = _time_percentile(factory, percentile, params, runs, cold=False)
+
+            results.append({
+                'percentile'      : percentile,
+                'filter'          : name,
+                'status'          : response.status_code,
+                'records'         : len(json.loads(response.content)),
+                'runs'            : runs,
+                'cold_median_ms'  : round(statistics.median(cold), 3),
+                'cold_max_ms'     : round(max(cold), 3),
+                'warm_median_ms'  : round(statistics.median(warm), 3),
+                'warm_max_ms'     : round(max(warm), 3),
+            })
+
+    return results
+
+def bench_size(rows, args):
+    # Flushing sends no signals, so the reference-data cache has to be dropped by hand, and so do the revenue
+    # indexes, since DSR ids start over
+    call_command('flush', interactive=False, verbosity=0)
+    refdata.clear()
+    shutil.rmtree(settings.DSRS_REVENUE_INDEX_DIR, ignore_errors=True)
+
+    with tempfile.TemporaryDirectory() as directory:
+        start  = time.perf_counter()
+        paths  = generator.generate_dsr_files(directory, rows, months=args.months, skew=args.skew, seed=args.seed)
+
+        return {
+            'rows'              : rows,
+            'files'             : len(paths),
+            'generate_seconds'  : round(time.perf_counter() - start, 3),
+            'parse'             : bench_parse(paths),
+            'insert'            : bench_insert(paths, args.workers),
+            'percentile'        : bench_percentile(args.runs),
+        }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=lambda value: [int(size) for size in value.split(',')], default=[10000, 1000000, 10000000],
+                        help='total number of rows of every run, comma separated')
+    parser.add_argument('--months', type=int, default=3, help='number of monthly files per territory')
+    parser.add_argument('--skew', type=float, default=generator.SKEW, help='Pareto shape of the revenues')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None, help='parsing processes (settings.DSRS_INGESTION_WORKERS by default)')
+    parser.add_argument('--runs', type=int, default=5, help='requests per percentile and filter')
+    parser.add_argument('--output', default='-', help='file the JSON report is written into (stdout by default)')
+    args = parser.parse_args(argv)
+
+    call_command('migrate', verbosity=0)
+
+    report = {
+        'environment': {
+            'python'    : platform.python_version(),
+            'django'    : django.get_version(),
+            'database'  : connection.vendor,
+            'cpus'      : os.cpu_count(),
+            'workers'   : args.workers or settings.DSRS_INGESTION_WORKERS,
+            'batch_size': settings.DSRS_INGESTION_BATCH_SIZE,
+        },
+        'results': [bench_size(rows, args) for rows in args.sizes],
+    }
+
+    output = sys.stdout if args.output == '-' else open(args.output, 'w')
+    with output:
+        json.dump(report, output, indent=2)
+        output.write('\n')
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,58 @@
+'''Compares the rows per second of the DRF serializers and the plain-dict ones (see
+dsrs.serializers.DSPValuesSerializer) when listing DSPs, on a generated dataset.
+
+Run it from the bmat directory (it uses its own throwaway SQLite database, or the one in DATABASE_NAME):
+
+    python -m benchmarks.serializers --rows 100000
+'''
+import argparse
+import sys
+import time
+
+from benchmarks.query_plans import generate_dataset
+
+from django.core.management import call_command
+
+from dsrs                   import models, serializers
+
+
+def _drf(dsps):
+    return serializers.DSPSerializer(dsps.select_related('dsr_id__territory', 'dsr_id__currency'), many=True).data
+
+def _values(dsps):
+    serializer = serializers.DSPValuesSerializer()
+    return serializer.serialize(dsps.values(*serializer.values_fields))
+
+
+# Name -> function serializing a DSP queryset
+_serializers = {
+    'drf'     : _drf,
+    'values'  : _values,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000, help='number of DSP rows to generate')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of every serializer, the best one is reported')
+    args = parser.parse_args(argv)
+
+    call_command('migrate', verbosity=0)
+
+    if not models.DSP.objects.exists():
+        generate_dataset(args.rows)
+
+    dsps = models.DSP.objects.order_by('id')
+    rows = dsps.count()
+
+    for name, serialize in _serializers.items():
+        best = float('inf')
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            serialize(dsps)
+            best  = min(best, time.perf_counter() - start)
+
+        print(f'{name:>8}: {rows} rows in {best:.3f} s ({rows / best:,.0f} rows/s)')
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -51,6 +51,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Measures the whole request, so it goes first (see dsrs.instrumentation)
+    "dsrs.instrumentation.InstrumentationMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -138,3 +140,104 @@ SECURE_SSL_REDIRECT=True
 SESSION_COOKIE_SECURE=True
 
 CSRF_COOKIE_SECURE=True
+
+# Tuning knobs for the DSR ingestion pipeline. DSP rows are written in chunks
+# of DSRS_INGESTION_BATCH_SIZE records, and committed every DSRS_INGESTION_CHECKPOINT_BATCHES chunks, which is
+# where a failed ingestion resumes from
+
+DSRS_INGESTION_BATCH_SIZE = int(os.getenv('DSRS_INGESTION_BATCH_SIZE', 5000))
+
+DSRS_INGESTION_CHECKPOINT_BATCHES = int(os.getenv('DSRS_INGESTION_CHECKPOINT_BATCHES', 20))
+
+# A DSR still 'ingesting' whose checkpoint has not moved for DSRS_INGESTION_STALE_SECONDS is taken for the leftover of
+# a crash, and its file is resumed when uploaded again
+DSRS_INGESTION_STALE_SECONDS = int(os.getenv('DSRS_INGESTION_STALE_SECONDS', 600))
+
+# Number of processes parsing DSR files in parallel, and number of parsed batches each of them
+# can keep waiting for the database writer
+
+DSRS_INGESTION_WORKERS = int(os.getenv('DSRS_INGESTION_WORKERS', os.cpu_count() or 1))
+
+DSRS_INGESTION_QUEUE_SIZE = int(os.getenv('DSRS_INGESTION_QUEUE_SIZE', 4))
+
+# Uploads are ingested by background jobs, run by DSRS_JOBS_WORKERS threads of the web server
+# process. Setting DSRS_JOBS_ASYNC to False runs them synchronously, within the upload request
+
+DSRS_JOBS_WORKERS = int(os.getenv('DSRS_JOBS_WORKERS', 1))
+
+DSRS_JOBS_ASYNC = os.getenv('DSRS_JOBS_ASYNC', 'True') == 'True'
+
+# Running jobs refresh their heartbeat at least every DSRS_JOBS_HEARTBEAT_SECONDS (once their batches are committed),
+# and are taken for interrupted once it is DSRS_JOBS_STALE_SECONDS old
+DSRS_JOBS_HEARTBEAT_SECONDS = int(os.getenv('DSRS_JOBS_HEARTBEAT_SECONDS', 30))
+
+DSRS_JOBS_STALE_SECONDS = int(os.getenv('DSRS_JOBS_STALE_SECONDS', 600))
+
+# Exchange rates into EUR. DSRS_RATE_PROVIDER is the dotted path of a dsrs.rates.RateProvider:
+# CurrConvProvider (web service) or FileRateProvider (reads DSRS_RATES_FILE, for tests and offline deployments).
+# Rates are cached in memory for DSRS_RATES_CACHE_TTL seconds, up to DSRS_RATES_CACHE_SIZE of them, and currencies the
+# provider could not resolve for DSRS_RATES_NEGATIVE_TTL seconds
+
+DSRS_RATE_PROVIDER = os.getenv('DSRS_RATE_PROVIDER', 'dsrs.rates.CurrConvProvider')
+
+DSRS_RATES_FILE = os.getenv('DSRS_RATES_FILE', BASE_DIR / 'data' / 'rates.json')
+
+DSRS_CURRCONV_API_KEY = os.getenv('DSRS_CURRCONV_API_KEY', '6cd9d6b95b3d077a16dc')
+
+DSRS_RATES_TIMEOUT = float(os.getenv('DSRS_RATES_TIMEOUT', 10))
+
+DSRS_RATES_CACHE_SIZE = int(os.getenv('DSRS_RATES_CACHE_SIZE', 1024))
+
+DSRS_RATES_CACHE_TTL = int(os.getenv('DSRS_RATES_CACHE_TTL', 3600))
+
+DSRS_RATES_NEGATIVE_TTL = int(os.getenv('DSRS_RATES_NEGATIVE_TTL', 60))
+
+# Page size of the paginated API endpoints (e.g. /dsps/), and the largest one clients can ask for
+
+DSRS_PAGE_SIZE = int(os.getenv('DSRS_PAGE_SIZE', 100))
+
+DSRS_MAX_PAGE_SIZE = int(os.getenv('DSRS_MAX_PAGE_SIZE', 1000))
+
+# Caches. 'results' keeps the responses of the read-only endpoints (see dsrs.caching), in local memory
+# by default, up to DSRS_RESULTS_CACHE_SIZE of them for DSRS_RESULTS_CACHE_TTL seconds. DSRS_RESULTS_CACHE_BACKEND and
+# DSRS_RESULTS_CACHE_LOCATION allow a shared backend (e.g. memcached), needed for several processes to see the same
+# data version
+
+DSRS_RESULTS_CACHE_TTL = int(os.getenv('DSRS_RESULTS_CACHE_TTL', 300))
+
+DSRS_RESULTS_CACHE_SIZE = int(os.getenv('DSRS_RESULTS_CACHE_SIZE', 1000))
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'results': {
+        'BACKEND'   : os.getenv('DSRS_RESULTS_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION'  : os.getenv('DSRS_RESULTS_CACHE_LOCATION', 'dsrs-results'),
+        'TIMEOUT'   : DSRS_RESULTS_CACHE_TTL,
+        'OPTIONS'   : {'MAX_ENTRIES': DSRS_RESULTS_CACHE_SIZE},
+    },
+}
+
+# Cumulative revenue index of the DSRs (see dsrs.revenue_index), used by /resources/percentile/ unless
+# DSRS_REVENUE_INDEX is False, and the directory its files are kept in
+
+DSRS_REVENUE_INDEX = os.getenv('DSRS_REVENUE_INDEX', 'True') == 'True'
+
+DSRS_REVENUE_INDEX_DIR = os.getenv('DSRS_REVENUE_INDEX_DIR', BASE_DIR / 'revenue_index')
+
+# Number of groups returned by /resources/rollups/ when no ?limit= is given, and the highest limit
+# allowed
+
+DSRS_ROLLUP_LIMIT = int(os.getenv('DSRS_ROLLUP_LIMIT', 100))
+
+DSRS_ROLLUP_MAX_LIMIT = int(os.getenv('DSRS_ROLLUP_MAX_LIMIT', 10000))
+
+# Highest k allowed by /resources/top/{k}/
+
+DSRS_TOP_MAX_K = int(os.getenv('DSRS_TOP_MAX_K', 10000))
+
+# Rows per chunk of the DSP exports (see dsrs.export): every chunk is an Arrow record batch, or a
+# Parquet row group. Exporting needs pyarrow
+
+DSRS_EXPORT_BATCH_SIZE = int(os.getenv('DSRS_EXPORT_BATCH_SIZE', 65536))
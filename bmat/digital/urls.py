@@ -19,14 +19,18 @@ from dsrs import views
 from rest_framework import routers
 
 router = routers.DefaultRouter()
+router.register(r"dsrs/jobs", views.IngestionJobViewSet)
 router.register(r"dsrs", views.DSRViewSet)
 router.register(r"dsps", views.DSPViewSet)
 
 '''FROM CARLOS: 
-Added the 'resources' path, which forwards the request to the module dsrs.urls'''
+Added the 'resources' path, which forwards the request to the module dsrs.urls.
+The 'dsrs/jobs' routes are registered before 'dsrs', so that they are not taken for DSR ids, and so is the
+'dsrs/metrics' endpoint (request counters in the Prometheus text format)'''
 
 urlpatterns = [
     path("admin/", admin.site.urls),
+    path("dsrs/metrics/", views.metrics, name="metrics"),
     path("", include(router.urls)),
     path("resources/", include("dsrs.urls")),
 ]
@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Territory, Currency, DSR, DSP
+from . import ingestion
+from .models import Territory, Currency, DSR, DSP, DSPStaging, DSRSummary, ExchangeRate, IngestionJob
 
 # Register your models here.
 
@@ -9,5 +10,20 @@ Models added here to be able to check the DB content and perform simple actions
 
 admin.site.register(Territory)
 admin.site.register(Currency)
-admin.site.register(DSR)
+
+@admin.register(DSR)
+class DSRAdmin(admin.ModelAdmin):
+    '''DSP.dsr_id does not cascade, so DSRs are deleted along with their DSPs in bulk (see
+    ingestion.delete_dsrs), both from the change page and with the "Delete selected" action'''
+
+    def delete_model(self, request, obj):
+        ingestion.delete_dsrs(DSR.objects.filter(pk=obj.pk))
+
+    def delete_queryset(self, request, queryset):
+        ingestion.delete_dsrs(queryset)
+
 admin.site.register(DSP)
+admin.site.register(DSRSummary)
+admin.site.register(DSPStaging)
+admin.site.register(IngestionJob)
+admin.site.register(ExchangeRate)
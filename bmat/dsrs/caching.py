@@ -0,0 +1,63 @@
+import hashlib
+import json
+import time
+
+from django.core.cache  import caches
+
+# Cache of the results of the read-only endpoints (e.g. /resources/percentile/), in the 'results'
+# cache of settings.CACHES.
+#
+# Keys are made of the endpoint name, its normalized parameters and a data version: a counter kept in the same cache
+# and bumped every time the DSPs change (see bump_data_version), so that stale results are never read again and just
+# expire. With the default local-memory backend every process has its own counter: results cached by the web server
+# are only refreshed after their TTL when DSRs are loaded by another process (e.g. manage.py load_dsrs), unless a
+# shared backend is configured
+
+CACHE_ALIAS       = 'results'
+DATA_VERSION_KEY  = 'data-version'
+
+
+def _cache():
+    return caches[CACHE_ALIAS]
+
+def _new_version():
+    '''Starting value of the counter. The cache may evict it like any other key, so it never starts
+    twice from the same value, or results of an older version could be read again'''
+    return time.time_ns()
+
+def data_version():
+    cache    = _cache()
+    version  = cache.get(DATA_VERSION_KEY)
+
+    if version is None:
+        cache.add(DATA_VERSION_KEY, _new_version(), timeout=None)
+        version = cache.get(DATA_VERSION_KEY)
+
+    return version
+
+def bump_data_version():
+    '''Makes every cached result stale. Called whenever DSPs are written, updated or deleted'''
+    cache = _cache()
+    try:
+        cache.incr(DATA_VERSION_KEY)
+
+    except ValueError:
+        cache.add(DATA_VERSION_KEY, _new_version(), timeout=None)
+
+def result_key(name, params):
+    '''Cache key of the result of an endpoint for some parameters, whatever their order'''
+    digest = hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+    return f'{name}:{data_version()}:{digest}'
+
+def cached_result(name, params, compute):
+    '''Returns the cached result of an endpoint for some parameters, computing (and caching) it with
+    compute() if it is not there'''
+    cache   = _cache()
+    key     = result_key(name, params)
+    result  = cache.get(key)
+
+    if result is None:
+        result = compute()
+        cache.set(key, result)
+
+    return result
@@ -0,0 +1,149 @@
+import io
+import os
+import tempfile
+from collections        import namedtuple
+from pathlib            import Path
+
+from django.conf        import settings
+
+from .                  import models, utils
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+
+except ImportError:
+    # pyarrow is optional. It is only needed to export DSPs
+    pyarrow = None
+
+# Bulk export of DSPs, filtered like /resources/percentile/, into columnar files for analytics.
+#
+# Two formats are supported: Parquet, and the Arrow IPC file format (which can be memory-mapped as is by pyarrow,
+# pandas or polars). Either way, DSPs are read in chunks of DSRS_EXPORT_BATCH_SIZE rows, in id order, and every chunk
+# is converted column by column into an Arrow record batch (a Parquet row group) and written straight away, so only
+# one chunk is in memory at a time. Every DSP comes with the territory, currency and period of its DSR. Amounts keep
+# their decimal type
+
+ExportFormat = namedtuple('ExportFormat', ['writer', 'content_type', 'extension'])
+
+# The export formats. writer(sink, schema) returns a pyarrow writer with write_batch and close methods
+FORMATS = {
+    'parquet'  : ExportFormat(lambda sink, schema: pyarrow.parquet.ParquetWriter(sink, schema), 'application/vnd.apache.parquet', '.parquet'),
+    'arrow'    : ExportFormat(lambda sink, schema: pyarrow.ipc.new_file(sink, schema), 'application/vnd.apache.arrow.file', '.arrow'),
+}
+
+# Columns of the exported files, and the DSP lookups they are read from
+COLUMNS = (
+    ('id',             'id'),
+    ('dsr_id',         'dsr_id'),
+    ('dsp_id',         'dsp_id'),
+    ('title',          'title'),
+    ('artists',        'artists'),
+    ('isrc',           'isrc'),
+    ('usages',         'usages'),
+    ('revenue',        'revenue'),
+    ('exchange_rate',  'exchange_rate'),
+    ('revenue_eur',    'revenue_eur'),
+    ('territory',      'dsr_id__territory__code_2'),
+    ('currency',       'dsr_id__currency__code'),
+    ('period_start',   'period_start'),
+    ('period_end',     'dsr_id__period_end'),
+)
+
+
+def is_available():
+    return pyarrow is not None
+
+def schema():
+    '''Arrow schema of the exported files. Decimals have the precision and scale of their model fields:
+    revenues, with 40 digits, do not fit in decimal128 (38 at most) and are decimal256'''
+    return pyarrow.schema([
+        ('id',             pyarrow.int64()),
+        ('dsr_id',         pyarrow.int64()),
+        ('dsp_id',         pyarrow.string()),
+        ('title',          pyarrow.string()),
+        ('artists',        pyarrow.string()),
+        ('isrc',           pyarrow.string()),
+        ('usages',         pyarrow.int64()),
+        ('revenue',        pyarrow.decimal256(40, 19)),
+        ('exchange_rate',  pyarrow.decimal128(30, 15)),
+        ('revenue_eur',    pyarrow.decimal256(40, 19)),
+        ('territory',      pyarrow.string()),
+        ('currency',       pyarrow.string()),
+        ('period_start',   pyarrow.date32()),
+        ('period_end',     pyarrow.date32()),
+    ])
+
+def _iter_record_batches(dsp_filter, batch_size, arrow_schema):
+    '''Yields the DSPs matching dsp_filter (lookups on the DSP model) as Arrow record batches'''
+    rows = models.DSP.objects.filter(**dsp_filter).order_by('id').values_list(*(lookup for _, lookup in COLUMNS))
+
+    for chunk in utils.batched(rows.iterator(chunk_size=batch_size), batch_size):
+        columns = zip(*chunk)
+        yield pyarrow.RecordBatch.from_arrays([pyarrow.array(column, type=field.type) for column, field in zip(columns, arrow_schema)],
+                                              schema=arrow_schema)
+
+def _write_batches(sink, dsp_filter, file_format, batch_size):
+    '''Writes the DSPs into sink, yielding the number of rows of every batch once it is written. The
+    file is complete (footer included) once the generator is exhausted'''
+    arrow_schema  = schema()
+    writer        = FORMATS[file_format].writer(sink, arrow_schema)
+
+    try:
+        for batch in _iter_record_batches(dsp_filter, batch_size or settings.DSRS_EXPORT_BATCH_SIZE, arrow_schema):
+            writer.write_batch(batch)
+            yield batch.num_rows
+
+    finally:
+        writer.close()
+
+def export_dsps(dsp_filter, path, file_format='parquet', batch_size=None):
+    '''Writes the DSPs matching dsp_filter into the file path, and returns how many they were. The file
+    is written aside and renamed, so that it is never seen half written'''
+    path = Path(path)
+
+    with tempfile.NamedTemporaryFile('wb', dir=path.parent, prefix=f'.{path.name}.', delete=False) as fh:
+        try:
+            rows = sum(_write_batches(fh, dsp_filter, file_format, batch_size))
+
+        except BaseException:
+            os.unlink(fh.name)
+            raise
+
+    os.replace(fh.name, path)
+    return rows
+
+
+class _ChunkSink(io.RawIOBase):
+    '''Write-only file keeping what is written until it is drained'''
+
+    def __init__(self):
+        super().__init__()
+        self.chunks    = list()
+        self.position  = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data, self.chunks = b''.join(self.chunks), list()
+        return data
+
+def iter_export(dsp_filter, file_format='parquet', batch_size=None):
+    '''Yields the bytes of the export of the DSPs matching dsp_filter as they are written, one chunk
+    per batch, e.g. to stream it in an HTTP response'''
+    sink = _ChunkSink()
+
+    for _ in _write_batches(sink, dsp_filter, file_format, batch_size):
+        yield sink.drain()
+
+    yield sink.drain()
@@ -0,0 +1,540 @@
+import csv
+import datetime
+import io
+import logging
+import multiprocessing
+import time
+from collections         import Counter, namedtuple
+from concurrent.futures  import ProcessPoolExecutor
+from decimal             import Decimal
+from itertools           import repeat
+from queue               import Empty
+
+from django.conf         import settings
+from django.db           import IntegrityError, connection, transaction
+from django.db.models    import F, Q
+from django.utils        import timezone
+
+from .                   import caching, models, partitions, rates, refdata, revenue_index, utils
+
+logger = logging.getLogger(__name__)
+
+# A namedtuple collection to report how an ingestion went
+ingestion_stats_fields  = ('path', 'rows', 'seconds', 'rows_per_second')
+IngestionStats          = namedtuple('IngestionStats', ingestion_stats_fields)
+
+# Model attributes written for every DSP row, in the order the writers expect them
+DSP_FIELDS = ('dsp_id', 'title', 'artists', 'isrc', 'usages', 'revenue', 'revenue_eur', 'exchange_rate', 'dsr_id', 'period_start')
+
+
+def _dsp_columns():
+    '''Database column names of DSP_FIELDS (the foreign key column is dsr_id_id). They are the same in
+    the DSP and DSPStaging tables'''
+    return [models.DSP._meta.get_field(name).column for name in DSP_FIELDS]
+
+def _batch_rows(batch, dsr_pk, period_start, rate, revenues_eur):
+    '''Builds the rows of a DsrBatch, in the order of DSP_FIELDS. Without a rate, revenue_eur is null'''
+    return list(zip(batch.dsp_ids, batch.titles, batch.artists, batch.isrcs, batch.usages, batch.revenues,
+                    revenues_eur if revenues_eur is not None else repeat(None), repeat(rate), repeat(dsr_pk), repeat(period_start)))
+
+def _histogram_bucket(revenue_eur):
+    '''Order of magnitude of a revenue, e.g. "2" for 100 <= revenue < 1000'''
+    return str(revenue_eur.adjusted()) if revenue_eur > 0 else 'zero'
+
+
+class _SummaryBuilder:
+    '''Accumulates the aggregates of a DSR while its rows go by, and saves them as a DSRSummary'''
+
+    def __init__(self, rate):
+        self.rate               = rate
+        self.row_count          = 0
+        self.total_usages       = 0
+        self.total_revenue      = Decimal(0)
+        self.total_revenue_eur  = Decimal(0)
+        self.histogram          = Counter()
+
+    def add(self, usages, revenues, revenues_eur):
+        self.row_count          += len(revenues)
+        self.total_usages       += sum(usages)
+        self.total_revenue      += sum(revenues, Decimal(0))
+        self.total_revenue_eur  += sum(revenues_eur, Decimal(0))
+        self.histogram.update(map(_histogram_bucket, revenues_eur))
+
+    def save(self, dsr):
+        return models.DSRSummary.objects.update_or_create(dsr=dsr, defaults={
+            'exchange_rate'      : self.rate,
+            'row_count'          : self.row_count,
+            'total_usages'       : self.total_usages,
+            'total_revenue'      : self.total_revenue,
+            'total_revenue_eur'  : self.total_revenue_eur,
+            'revenue_histogram'  : dict(self.histogram),
+        })[0]
+
+
+def _get_rate(dsr):
+    '''Rate to convert the DSR currency into EUR, or None if it is unknown'''
+    return rates.get_conversion_factors([dsr.currency.code]).get(dsr.currency.code)
+
+def _copy_rows(cursor, rows, model=models.DSP):
+    '''PostgreSQL writer. Streams the rows through COPY, which is much faster than INSERT'''
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+
+    table   = connection.ops.quote_name(model._meta.db_table)
+    columns = ', '.join(connection.ops.quote_name(c) for c in _dsp_columns())
+    cursor.copy_expert(f'COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+
+def _executemany_rows(cursor, rows, model=models.DSP):
+    '''SQLite writer. A single prepared INSERT executed for the whole chunk'''
+    table         = connection.ops.quote_name(model._meta.db_table)
+    columns       = ', '.join(connection.ops.quote_name(c) for c in _dsp_columns())
+    placeholders  = ', '.join(['%s'] * len(DSP_FIELDS))
+    cursor.executemany(f'INSERT INTO {table} ({columns}) VALUES ({placeholders})', rows)
+
+def _bulk_create_rows(cursor, rows, model=models.DSP):
+    '''Generic writer for any other backend, based on the ORM's bulk_create'''
+    attnames = [model._meta.get_field(name).attname for name in DSP_FIELDS]
+    model.objects.bulk_create([model(**dict(zip(attnames, row))) for row in rows])
+
+
+# Row writers by database vendor. They write into the DSP table, or into the model given (DSPStaging)
+_row_writers = {
+    'postgresql' : _copy_rows,
+    'sqlite'     : _executemany_rows,
+}
+
+
+def _summarize_rows(summary, dsps):
+    '''Adds rows already in the database to a _SummaryBuilder, reading them in chunks'''
+    for chunk in utils.batched(dsps.values_list('usages', 'revenue', 'revenue_eur').iterator(), settings.DSRS_INGESTION_BATCH_SIZE):
+        summary.add(*zip(*chunk))
+
+def _resume_rate(dsr):
+    '''Rate of the rows committed by an unfinished ingestion of the DSR, so that the rest of its rows
+    are converted with the same one. None if there are no such rows'''
+    if not dsr.checkpoint_rows:
+        return None
+
+    return models.DSP.objects.filter(dsr_id=dsr).values_list('exchange_rate', flat=True).first()
+
+def ingest_dsr_batches(dsr, batches, on_batch=None):
+    '''Writes the DsrBatch objects of a DSR file into the DSP table and returns an IngestionStats
+
+    Every batch is written in one go, using the fastest writer available for the database in use. Batches are
+    committed in groups of settings.DSRS_INGESTION_CHECKPOINT_BATCHES, each group along with the number of rows
+    committed so far (dsr.checkpoint_rows). If the ingestion fails, the DSR keeps that checkpoint, and a new call
+    with the batches that follow it carries on from there (see ingest_dsr_files). The DSPs of the DSR are ignored by
+    the API until the last group is committed and the checkpoint goes back to 0. on_batch, if given, is called with
+    the number of rows of every batch written (but not committed yet).
+
+    Rows are written into the partition of the DSR period (see partitions), created first if needed.
+
+    The revenue in EUR of every row is computed and stored along with it, and so is the DSR summary, with the last
+    group. The revenue index of the DSR (see revenue_index) is built right after. If the rate of the DSR currency is
+    unknown, all of them are left for summarize_dsrs to fill in later.
+    '''
+    writer   = _row_writers.get(connection.vendor, _bulk_create_rows)
+    period   = models.DSP._meta.get_field('period_start').to_python(dsr.period_start)
+    resumed  = dsr.checkpoint_rows
+    rate     = _resume_rate(dsr) if resumed else _get_rate(dsr)
+    summary  = _SummaryBuilder(rate)
+    rows     = resumed
+    start    = time.perf_counter()
+
+    if resumed and rate is not None:
+        _summarize_rows(summary, models.DSP.objects.filter(dsr_id=dsr))
+
+    partitions.ensure_partition(period)
+
+    with connection.cursor() as cursor:
+        for group in utils.batched(batches, settings.DSRS_INGESTION_CHECKPOINT_BATCHES):
+            with transaction.atomic():
+                for batch in group:
+                    revenues_eur = [revenue * rate for revenue in batch.revenues] if rate is not None else None
+                    writer(cursor, _batch_rows(batch, dsr.pk, period, rate, revenues_eur))
+                    rows += len(batch)
+
+                    if rate is not None:
+                        summary.add(batch.usages, batch.revenues, revenues_eur)
+
+                    if on_batch:
+                        on_batch(len(batch))
+
+                models.DSR.objects.filter(pk=dsr.pk).update(checkpoint_rows=rows, updated_at=timezone.now())
+
+        with transaction.atomic():
+            models.DSR.objects.filter(pk=dsr.pk).update(checkpoint_rows=0, updated_at=timezone.now())
+            if rate is not None:
+                summary.save(dsr)
+
+    dsr.checkpoint_rows = 0
+    if rate is not None:
+        revenue_index.build(dsr)
+
+    caching.bump_data_version()
+
+    seconds = time.perf_counter() - start
+    stats   = IngestionStats(dsr.path, rows - resumed, seconds, (rows - resumed) / seconds if seconds else 0.0)
+    logger.info('Ingested %d rows from %s in %.3f s (%.0f rows/s)', stats.rows, stats.path, stats.seconds, stats.rows_per_second)
+
+    return stats
+
+def summarize_dsrs(dsrs):
+    '''Fills in the revenue in EUR and the summary of DSRs ingested while their rate was unknown (or
+    before these existed). Each DSR costs one UPDATE plus one pass over its rows, once. Returns the DSRs summarized'''
+    summarized = list()
+
+    for dsr in dsrs.filter(summary__isnull=True, checkpoint_rows=0).select_related('currency'):
+        rate = _get_rate(dsr)
+        if rate is None:
+            continue
+
+        with transaction.atomic():
+            dsps = models.DSP.objects.filter(dsr_id=dsr)
+            dsps.update(exchange_rate=rate, revenue_eur=F('revenue') * rate)
+
+            summary = _SummaryBuilder(rate)
+            _summarize_rows(summary, dsps)
+            summary.save(dsr)
+
+        revenue_index.build(dsr)
+        caching.bump_data_version()
+        summarized.append(dsr)
+
+    return summarized
+
+def ingest_dsr_records(dsr, records, batch_size=None):
+    '''Same as ingest_dsr_batches, for DsrRecord objects. They are grouped in batches of batch_size
+    records (settings.DSRS_INGESTION_BATCH_SIZE by default) before being written'''
+    batch_size = batch_size or settings.DSRS_INGESTION_BATCH_SIZE
+    return ingest_dsr_batches(dsr, map(utils.DsrBatch.from_records, utils.batched(records, batch_size)))
+
+
+def replace_dsr_batches(dsr, batches, content_hash=None, on_batch=None):
+    '''Replaces the DSPs of a DSR with the DsrBatch objects of a new file, and returns an IngestionStats
+
+    The batches are first loaded into the DSPStaging table, in groups committed one after the other as in
+    ingest_dsr_batches, while the API keeps serving the DSPs the DSR had. Then one single transaction deletes
+    these (one DELETE), moves the new ones in (one INSERT ... SELECT), saves the new summary and sets the DSR
+    'ingested', with the content_hash of the new file. Readers see either all the old DSPs or all the new ones, and
+    the rows of other DSRs are never locked. If anything fails, the DSR is left as it was. Either way, the staged
+    rows are deleted afterwards, out of the swap transaction.
+    '''
+    writer   = _row_writers.get(connection.vendor, _bulk_create_rows)
+    period   = models.DSP._meta.get_field('period_start').to_python(dsr.period_start)
+    rate     = _get_rate(dsr)
+    summary  = _SummaryBuilder(rate)
+    staged   = models.DSPStaging.objects.filter(dsr_id=dsr)
+    rows     = 0
+    start    = time.perf_counter()
+
+    # Rows left by a replacement that did not finish
+    staged.delete()
+
+    try:
+        with connection.cursor() as cursor:
+            for group in utils.batched(batches, settings.DSRS_INGESTION_CHECKPOINT_BATCHES):
+                with transaction.atomic():
+                    for batch in group:
+                        revenues_eur = [revenue * rate for revenue in batch.revenues] if rate is not None else None
+                        writer(cursor, _batch_rows(batch, dsr.pk, period, rate, revenues_eur), models.DSPStaging)
+                        rows += len(batch)
+
+                        if rate is not None:
+                            summary.add(batch.usages, batch.revenues, revenues_eur)
+
+                        if on_batch:
+                            on_batch(len(batch))
+
+            partitions.ensure_partition(period)
+            columns = ', '.join(connection.ops.quote_name(c) for c in _dsp_columns())
+
+            with transaction.atomic():
+                models.DSP.objects.filter(dsr_id=dsr).delete()
+                cursor.execute(f'INSERT INTO {connection.ops.quote_name(models.DSP._meta.db_table)} ({columns}) '
+                               f'SELECT {columns} FROM {connection.ops.quote_name(models.DSPStaging._meta.db_table)} '
+                               f'WHERE {connection.ops.quote_name(models.DSPStaging._meta.get_field("dsr_id").column)} = %s', [dsr.pk])
+
+                updates = {'status': 'ingested', 'checkpoint_rows': 0, 'updated_at': timezone.now()}
+                if content_hash is not None:
+                    updates['content_hash'] = content_hash
+
+                models.DSR.objects.filter(pk=dsr.pk).update(**updates)
+                if rate is not None:
+                    summary.save(dsr)
+
+                else:
+                    models.DSRSummary.objects.filter(dsr=dsr).delete()
+
+    finally:
+        staged.delete()
+
+    dsr.status, dsr.checkpoint_rows = 'ingested', 0
+    if rate is not None:
+        revenue_index.build(dsr)
+
+    else:
+        revenue_index.delete(dsr.pk)
+
+    caching.bump_data_version()
+
+    seconds = time.perf_counter() - start
+    stats   = IngestionStats(dsr.path, rows, seconds, rows / seconds if seconds else 0.0)
+    logger.info('Replaced the DSPs of %s with %d rows in %.3f s (%.0f rows/s)', stats.path, stats.rows, stats.seconds, stats.rows_per_second)
+
+    return stats
+
+def delete_dsrs(dsrs):
+    '''Deletes a QuerySet of DSRs with their DSPs, summaries and revenue indexes, and returns how many
+    DSRs were deleted. DSP.dsr_id does not cascade, so the DSPs are deleted first, with one single DELETE'''
+    dsr_pks = list(dsrs.values_list('pk', flat=True))
+
+    with transaction.atomic():
+        models.DSP.objects.filter(dsr_id__in=dsrs).delete()
+        models.DSR.objects.filter(pk__in=dsr_pks).delete()
+
+    for dsr_pk in dsr_pks:
+        revenue_index.delete(dsr_pk)
+
+    caching.bump_data_version()
+    return len(dsr_pks)
+
+
+# Statuses of the DSRs whose file is ingested again when uploaded again, from their checkpoint. A DSR
+# left 'ingesting' by a crash is too, once its checkpoint is stale (see _claim_stale_dsr)
+RESUMABLE_STATUSES = ('failed',)
+
+# Statuses of the DSRs whose DSPs are replaced (see replace_dsr_batches) when a file with the same name
+# but another content is uploaded
+REPLACEABLE_STATUSES = ('ingested', 'failed')
+
+
+def _claim_stale_dsr(dsr):
+    '''Marks as failed a DSR left 'ingesting' by a crash, i.e. whose status or checkpoint has not changed for
+    settings.DSRS_INGESTION_STALE_SECONDS, so that its file can be resumed. The status is compared and set in a
+    single UPDATE, so that only one of several concurrent uploads claims it. Returns whether this one did'''
+    cutoff   = timezone.now() - datetime.timedelta(seconds=settings.DSRS_INGESTION_STALE_SECONDS)
+    claimed  = (models.DSR.objects.filter(pk=dsr.pk, status='ingesting')
+                                  .filter(Q(updated_at__lt=cutoff) | Q(updated_at__isnull=True))
+                                  .update(status='failed', updated_at=timezone.now()))
+    if claimed:
+        logger.warning('DSR %d was left ingesting by a crash', dsr.pk)
+        dsr.status = 'failed'
+
+    return bool(claimed)
+
+def find_dsr_file(file_name):
+    '''Returns the sha256 of a file and the DSR already registered with that content, or None'''
+    content_hash = utils.file_sha256(file_name)
+    return content_hash, models.DSR.objects.filter(content_hash=content_hash).first()
+
+def register_dsr_file(file_name):
+    '''Returns the DSR a file is to be ingested into, or None if there is nothing to ingest
+
+    Files are recognized by the sha256 of their content, before parsing anything. A file already ingested (or being
+    ingested) is skipped, and a file whose ingestion failed, or was left 'ingesting' by a crash (see
+    _claim_stale_dsr), gets its DSR back, to resume it. Otherwise a 'pending'
+    DSR is created from the file name (see utils.parse_dsr_meta), unless there is one for that name already: a new
+    version of its file, which gets the DSR back to replace its DSPs (see ingest_dsr_files). Raises ValueError if the
+    file name does not identify a valid territory and currency, and OSError if the file cannot be read.
+    '''
+    content_hash, dsr = find_dsr_file(file_name)
+
+    if dsr is not None:
+        if dsr.status in RESUMABLE_STATUSES or _claim_stale_dsr(dsr):
+            logger.info('Resuming %s from row %d', file_name, dsr.checkpoint_rows)
+            return dsr
+
+        logger.info('Skipping %s: same content as DSR %d (%s)', file_name, dsr.pk, dsr.status)
+        return None
+
+    md         = utils.parse_dsr_meta(file_name)
+    territory  = refdata.get_territory(md.territory, md.currency)
+    currency   = refdata.get_currency(md.currency)
+
+    try:
+        with transaction.atomic():
+            return models.DSR.objects.create(path=md.path, period_start=md.period_start, period_end=md.period_end, status='pending',
+                                             territory=territory, currency=currency, content_hash=content_hash)
+
+    except IntegrityError:
+        # The DSR model implements a unique constraint to prevent the same DSR file meta data to be inserted more
+        # than once. A different file for the same DSR replaces its records, unless it is still being ingested
+        dsr = models.DSR.objects.get(path=md.path, period_start=md.period_start, period_end=md.period_end, territory=territory, currency=currency)
+
+    if dsr.status not in REPLACEABLE_STATUSES and not _claim_stale_dsr(dsr):
+        logger.info('Skipping %s: DSR %d is %s', file_name, dsr.pk, dsr.status)
+        return None
+
+    logger.info('Replacing the DSPs of DSR %d with %s', dsr.pk, file_name)
+    return dsr
+
+
+def _process_context():
+    '''Start method of the parsing processes. Ingestions run in threads of the web server too (see jobs), and forking
+    a process with threads can deadlock the child, so they are started by a fork server (or spawned, where there is
+    none). Either way, the child only imports dsrs.utils (see utils.parse_into_queue), not the Django apps'''
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(method)
+
+# Seconds the writer waits for a batch before checking that the worker parsing the file is alive
+_QUEUE_POLL_SECONDS = 1
+
+class _QueuedBatches:
+    '''Iterates over the batches a worker process puts in a queue, until the file is exhausted
+
+    future is the one of the worker task. If it is done and the queue is empty, the worker died (e.g. killed for
+    lack of memory, which breaks the whole pool) before it could send anything else: its error is raised, so that
+    the file fails instead of waiting forever'''
+
+    def __init__(self, queue, future):
+        self.queue      = queue
+        self.future     = future
+        self.exhausted  = False
+
+    def _get(self):
+        while True:
+            try:
+                return self.queue.get(timeout=_QUEUE_POLL_SECONDS)
+
+            except Empty:
+                if not self.future.done():
+                    continue
+
+            # Whatever the worker put before it was done is in the queue by now
+            try:
+                return self.queue.get_nowait()
+
+            except Empty:
+                return self.future.exception() or RuntimeError('The worker process parsing the file ended before finishing it')
+
+    def __iter__(self):
+        while not self.exhausted:
+            item = self._get()
+
+            if item is None or isinstance(item, Exception):
+                self.exhausted = True
+
+            if isinstance(item, Exception):
+                raise item
+
+            if item is not None:
+                yield item
+
+    def discard(self):
+        '''Consumes what is left, so that the worker process of a failed file can finish'''
+        try:
+            for _ in self:
+                pass
+
+        except Exception:
+            pass
+
+def _write_dsr_file(dsr, batches, on_batch=None):
+    '''Writes a file's batches, keeping the DSR status up to date. Returns None if the file failed'''
+    models.DSR.objects.filter(pk=dsr.pk).update(status='ingesting', updated_at=timezone.now())
+
+    try:
+        stats = ingest_dsr_batches(dsr, batches, on_batch)
+
+    except Exception:
+        logger.exception('Ingestion of %s failed', dsr.path)
+        models.DSR.objects.filter(pk=dsr.pk).update(status='failed', updated_at=timezone.now())
+        return None
+
+    models.DSR.objects.filter(pk=dsr.pk).update(status='ingested', updated_at=timezone.now())
+    return stats
+
+def _replace_dsr_file(dsr, batches, content_hash, on_batch=None):
+    '''Same as _write_dsr_file, to replace the DSPs of a DSR. Its status only changes, to 'ingested',
+    along with its DSPs. Returns None if the file failed, in which case the DSR is left as it was'''
+    try:
+        return replace_dsr_batches(dsr, batches, content_hash, on_batch)
+
+    except Exception:
+        logger.exception('Replacement of the DSPs of %s failed', dsr.path)
+        return None
+
+def _replacement_hash(dsr, file_name):
+    '''Returns the sha256 of a file if it is to replace the DSPs of its DSR, or None if it is to be
+    ingested into it: an ingested DSR is always replaced, a failed one only by a file with another content (a
+    failed DSR without a content_hash, ingested before it existed, is always resumed)'''
+    if dsr.status not in REPLACEABLE_STATUSES or (dsr.status == 'failed' and not dsr.content_hash):
+        return None
+
+    content_hash = utils.file_sha256(file_name)
+    return content_hash if dsr.status == 'ingested' or content_hash != dsr.content_hash else None
+
+def ingest_dsr_files(dsr_files, workers=None, progress=None):
+    '''Ingests several DSR files, parsing them in parallel. Returns a list of IngestionStats
+
+    dsr_files is a list of (DSR, file name) pairs. Up to workers (settings.DSRS_INGESTION_WORKERS by default)
+    processes decompress and parse the files, and send their batches through one bounded queue per file, so that
+    parsing never gets too far ahead of the database. A single writer, the calling process with its own database
+    connection, writes the files one after the other in the given order. The DSR status goes from 'pending' to
+    'ingesting' and then 'ingested' or 'failed', always in that same order. Failed files are left out of the result,
+    and the path of every IngestionStats is the name of its file.
+    With one worker, or one single file, everything happens in the calling process. If a worker process dies, the
+    files it had not finished parsing fail (see _QueuedBatches). Files whose DSR has a checkpoint
+    (see ingest_dsr_batches) are read from there on. Files given with a DSR already ingested (or failed, with
+    another content) replace its DSPs instead (see replace_dsr_batches), and their DSR status does not go through
+    'pending' and 'ingesting'.
+
+    progress, if given, is called with the number of rows parsed and inserted (committed) so far, every time a
+    batch is written and every time a file is committed.
+    '''
+    workers     = min(workers or settings.DSRS_INGESTION_WORKERS, len(dsr_files))
+    batch_size  = settings.DSRS_INGESTION_BATCH_SIZE
+    counters    = {'parsed': 0, 'inserted': 0}
+    results     = list()
+
+    def on_batch(rows):
+        counters['parsed'] += rows
+        if progress:
+            progress(counters['parsed'], counters['inserted'])
+
+    def write(dsr, file_name, batches):
+        if dsr.pk in replacements:
+            stats = _replace_dsr_file(dsr, batches, replacements[dsr.pk], on_batch)
+
+        else:
+            stats = _write_dsr_file(dsr, batches, on_batch)
+        if stats:
+            counters['inserted'] += stats.rows
+
+        if progress:
+            progress(counters['parsed'], counters['inserted'])
+
+        results.append(stats._replace(path=str(file_name)) if stats else None)
+
+    replacements = dict()
+    for dsr, file_name in dsr_files:
+        content_hash = _replacement_hash(dsr, file_name)
+        if content_hash is not None:
+            replacements[dsr.pk] = content_hash
+
+        else:
+            models.DSR.objects.filter(pk=dsr.pk).update(status='pending', updated_at=timezone.now())
+
+    def skip(dsr):
+        return 0 if dsr.pk in replacements else dsr.checkpoint_rows
+
+    if workers <= 1:
+        for dsr, file_name in dsr_files:
+            write(dsr, file_name, utils.iter_dsr_records(file_name, batch_size=batch_size, skip=skip(dsr)))
+
+        return [stats for stats in results if stats]
+
+    context = _process_context()
+    with context.Manager() as manager, ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        queues = [manager.Queue(maxsize=settings.DSRS_INGESTION_QUEUE_SIZE) for _ in dsr_files]
+
+        futures = [executor.submit(utils.parse_into_queue, file_name, batch_size, skip(dsr), queue) for (dsr, file_name), queue in zip(dsr_files, queues)]
+
+        for (dsr, file_name), queue, future in zip(dsr_files, queues, futures):
+            batches = _QueuedBatches(queue, future)
+            write(dsr, file_name, batches)
+            batches.discard()
+
+    return [stats for stats in results if stats]
@@ -0,0 +1,162 @@
+import contextvars
+import threading
+import time
+from collections        import defaultdict
+from contextlib         import ExitStack, contextmanager
+
+from django.db          import connections
+
+# Request-level instrumentation of the dsrs endpoints.
+#
+# InstrumentationMiddleware measures every request: number of SQL queries and time spent in the database (with an
+# execute wrapper on every connection), time spent in external HTTP calls (see timed), rows processed (see add_rows)
+# and total time. They are sent back in the Server-Timing header of the response, and added up per view into
+# counters that /dsrs/metrics/ (views.metrics) exposes in the Prometheus text format.
+#
+# Metrics of the current request are kept in a context variable, so that nothing has to be passed around: code that
+# runs outside of a request (e.g. background ingestion jobs, which use their own threads) is simply not measured.
+# Counters live in the process, so every worker of the web server exposes its own. The body of streamed responses
+# is produced after the middleware returns, so the queries it runs are not counted either
+
+_current = contextvars.ContextVar('dsrs_request_metrics', default=None)
+
+
+class RequestMetrics:
+    '''What a request spent. Times are in seconds'''
+
+    def __init__(self):
+        self.queries       = 0
+        self.db_time       = 0.0
+        self.http_calls    = 0
+        self.http_time     = 0.0
+        self.rows          = 0
+        self.total_time    = 0.0
+
+    def server_timing(self):
+        '''Value of the Server-Timing header (durations in milliseconds)'''
+        return ', '.join((
+            f'db;dur={self.db_time * 1000:.3f};desc="{self.queries} queries"',
+            f'http;dur={self.http_time * 1000:.3f};desc="{self.http_calls} calls"',
+            f'rows;desc="{self.rows} rows"',
+            f'total;dur={self.total_time * 1000:.3f}',
+        ))
+
+
+def current():
+    '''Returns the RequestMetrics of the request being served, or None'''
+    return _current.get()
+
+def add_rows(count):
+    '''Adds count to the rows processed by the current request, if any'''
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.rows += count
+
+@contextmanager
+def timed():
+    '''Context manager adding the time of its block to the external HTTP time of the current request'''
+    start = time.perf_counter()
+    try:
+        yield
+
+    finally:
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.http_calls  += 1
+            metrics.http_time   += time.perf_counter() - start
+
+def _query_timer(metrics):
+    '''Execute wrapper (see connection.execute_wrapper) counting the queries of a request'''
+    def wrapper(execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+
+        finally:
+            metrics.queries  += 1
+            metrics.db_time  += time.perf_counter() - start
+
+    return wrapper
+
+@contextmanager
+def collect():
+    '''Context manager measuring its block: yields a RequestMetrics, filled in as the block runs'''
+    metrics  = RequestMetrics()
+    token    = _current.set(metrics)
+    start    = time.perf_counter()
+
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(_query_timer(metrics)))
+
+            yield metrics
+
+    finally:
+        metrics.total_time = time.perf_counter() - start
+        _current.reset(token)
+
+
+# Counters of every view served by this process: (metric name, help, RequestMetrics attribute). The
+# number of requests is kept apart
+COUNTERS = (
+    ('dsrs_db_queries_total',           'SQL queries run',                          'queries'),
+    ('dsrs_db_seconds_total',           'Time spent in the database',               'db_time'),
+    ('dsrs_http_calls_total',           'External HTTP calls made',                 'http_calls'),
+    ('dsrs_http_seconds_total',         'Time spent in external HTTP calls',        'http_time'),
+    ('dsrs_rows_processed_total',       'Rows processed',                           'rows'),
+    ('dsrs_request_seconds_total',      'Time spent serving requests',              'total_time'),
+)
+
+_requests  = defaultdict(int)
+_totals    = defaultdict(int)
+_lock      = threading.Lock()
+
+
+def record(view, metrics):
+    '''Adds the metrics of a request to the counters of its view'''
+    with _lock:
+        _requests[view] += 1
+        for _, _, attribute in COUNTERS:
+            _totals[view, attribute] += getattr(metrics, attribute)
+
+def reset():
+    with _lock:
+        _requests.clear()
+        _totals.clear()
+
+def _label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def render_metrics():
+    '''Returns the counters in the Prometheus text exposition format'''
+    with _lock:
+        requests  = dict(_requests)
+        totals    = dict(_totals)
+
+    lines = ['# HELP dsrs_requests_total Requests served', '# TYPE dsrs_requests_total counter']
+    lines.extend(f'dsrs_requests_total{{view="{_label(view)}"}} {count}' for view, count in sorted(requests.items()))
+
+    for name, description, attribute in COUNTERS:
+        lines.extend((f'# HELP {name} {description}', f'# TYPE {name} counter'))
+        lines.extend(f'{name}{{view="{_label(view)}"}} {totals[view, attribute]}' for view in sorted(requests))
+
+    return '\n'.join(lines) + '\n'
+
+
+class InstrumentationMiddleware:
+    '''Measures every request (see collect), adds the Server-Timing header to its response and records
+    it under its view name ('unresolved' if no URL matched)'''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with collect() as metrics:
+            response = self.get_response(request)
+
+        match = getattr(request, 'resolver_match', None)
+        record(match.view_name if match is not None else 'unresolved', metrics)
+
+        response['Server-Timing'] = metrics.server_timing()
+        return response
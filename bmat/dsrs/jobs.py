@@ -0,0 +1,136 @@
+import datetime
+import logging
+import threading
+from concurrent.futures  import ThreadPoolExecutor
+
+from django.conf         import settings
+from django.db           import connection, transaction
+from django.db.models    import Q
+from django.utils        import timezone
+
+from .                   import ingestion, models
+
+logger = logging.getLogger(__name__)
+
+# Background ingestion jobs, run by a pool of threads living in the web server process itself.
+# No external broker is needed: a job is an IngestionJob row plus a task submitted to _executor. Jobs interrupted by a
+# server restart stop refreshing their heartbeat, and are marked as failed once it is stale (see fail_orphaned_jobs)
+
+_executor = ThreadPoolExecutor(max_workers=settings.DSRS_JOBS_WORKERS, thread_name_prefix='dsrs-jobs')
+
+# Counters of the jobs running in this process, updated after every batch. The database row is only
+# updated when a file is committed, since the batches in between are written inside the file's transaction
+_live_progress  = dict()
+_heartbeats     = dict()
+_lock           = threading.Lock()
+
+
+def live_progress(job_id):
+    '''Returns the (rows parsed, rows inserted) of a job running in this process, or None'''
+    with _lock:
+        return _live_progress.get(job_id)
+
+def _update_progress(job_id, rows_parsed, rows_inserted):
+    now = timezone.now()
+    with _lock:
+        previous  = _live_progress.get(job_id, (0, 0))
+        beat      = (now - _heartbeats.get(job_id, now)).total_seconds() >= settings.DSRS_JOBS_HEARTBEAT_SECONDS
+        _live_progress[job_id] = (rows_parsed, rows_inserted)
+        if beat:
+            _heartbeats[job_id] = now
+
+    # Batches are written inside the transaction of their group, so a heartbeat sent from here is seen by other
+    # processes once the group is committed
+    if rows_inserted != previous[1] or beat:
+        models.IngestionJob.objects.filter(pk=job_id).update(rows_parsed=rows_parsed, rows_inserted=rows_inserted, heartbeat_at=now)
+
+def fail_orphaned_jobs():
+    '''Marks as failed the running jobs whose heartbeat is older than settings.DSRS_JOBS_STALE_SECONDS, but the ones
+    running in this process. Their process died (e.g. on a server restart) and nothing else would ever finish them.
+    Returns the number of jobs marked'''
+    cutoff = timezone.now() - datetime.timedelta(seconds=settings.DSRS_JOBS_STALE_SECONDS)
+    with _lock:
+        live = list(_live_progress)
+
+    return (models.IngestionJob.objects.filter(status='running')
+                                       .filter(Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True))
+                                       .exclude(pk__in=live)
+                                       .update(status='failed', error='The job was interrupted', finished_at=timezone.now()))
+
+def _register_files(job):
+    '''Registers the files of a job that are not yet (see ingestion.register_dsr_file), which reads them whole to
+    hash them, and returns the (DSR, file name) pairs to ingest. Files that cannot be read, or whose names do not
+    identify a valid currency or country, are left out, and so are the ones there is nothing to ingest from'''
+    dsr_ids = list()
+    for dsr_id, file_name in job.files:
+        if dsr_id is None:
+            try:
+                dsr = ingestion.register_dsr_file(file_name)
+
+            except (OSError, ValueError) as e:
+                logger.error(f'Skipping {file_name}: {e}')
+                dsr = None
+
+            dsr_id = dsr.pk if dsr is not None else None
+
+        dsr_ids.append(dsr_id)
+
+    job.files = [[dsr_id, file_name] for dsr_id, (_, file_name) in zip(dsr_ids, job.files)]
+    models.IngestionJob.objects.filter(pk=job.pk).update(files=job.files)
+
+    dsrs = models.DSR.objects.in_bulk([dsr_id for dsr_id in dsr_ids if dsr_id is not None])
+    return [(dsrs[dsr_id], file_name) for dsr_id, file_name in job.files if dsr_id is not None]
+
+def run_ingestion_job(job_id):
+    '''Runs a queued job in the calling thread, and records its final status'''
+    now = timezone.now()
+    models.IngestionJob.objects.filter(pk=job_id).update(status='running', started_at=now, heartbeat_at=now)
+    job = models.IngestionJob.objects.get(pk=job_id)
+
+    with _lock:
+        _live_progress[job_id]  = (0, 0)
+        _heartbeats[job_id]     = now
+
+    try:
+        dsr_files  = _register_files(job)
+        results    = ingestion.ingest_dsr_files(dsr_files, progress=lambda parsed, inserted: _update_progress(job_id, parsed, inserted))
+
+    except Exception as e:
+        logger.exception('Ingestion job %d failed', job_id)
+        models.IngestionJob.objects.filter(pk=job_id).update(status='failed', error=str(e), finished_at=timezone.now())
+
+    else:
+        status = 'finished' if len(results) == len(dsr_files) else 'failed'
+        error  = '' if status == 'finished' else f'{len(dsr_files) - len(results)} file(s) could not be ingested'
+        models.IngestionJob.objects.filter(pk=job_id).update(status=status, error=error, finished_at=timezone.now())
+
+    finally:
+        with _lock:
+            _live_progress.pop(job_id, None)
+            _heartbeats.pop(job_id, None)
+
+def _run_in_background(job_id):
+    '''Thread entry point. Database connections are per thread, so this one must be closed here'''
+    try:
+        run_ingestion_job(job_id)
+
+    finally:
+        connection.close()
+
+def submit_ingestion_job(file_names):
+    '''Creates a job for a list of file names and returns it straight away. The files are registered
+    (see ingestion.register_dsr_file) by the job itself, since hashing them means reading them whole
+
+    The job starts once the current transaction is committed, in a background thread. With settings.DSRS_JOBS_ASYNC
+    set to False, it runs synchronously instead (handy for tests and scripts).
+    '''
+    job = models.IngestionJob.objects.create(files=[[None, file_name] for file_name in file_names])
+
+    if settings.DSRS_JOBS_ASYNC:
+        transaction.on_commit(lambda: _executor.submit(_run_in_background, job.pk))
+
+    else:
+        run_ingestion_job(job.pk)
+        job.refresh_from_db()
+
+    return job
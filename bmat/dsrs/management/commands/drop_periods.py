@@ -0,0 +1,31 @@
+import datetime
+
+from django.core.management.base  import BaseCommand, CommandError
+
+from dsrs                         import models, partitions
+
+
+class Command(BaseCommand):
+    '''Drops old reporting periods: the DSRs whose period starts before a date, with their DSPs (see
+    partitions.drop_periods). On PostgreSQL, the partitions of whole months are dropped instead of deleting rows'''
+    help = 'Deletes the DSRs, and their DSPs, whose period starts before a date (YYYY-MM-DD)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('before', help='YYYY-MM-DD. DSRs whose period starts before it are deleted')
+        parser.add_argument('--dry-run', action='store_true', help='tell what would be deleted, without deleting anything')
+
+    def handle(self, *args, **options):
+        try:
+            before = datetime.date.fromisoformat(options['before'])
+
+        except ValueError:
+            raise CommandError(f'Date {options["before"]} is not in YYYY-MM-DD format')
+
+        if options['dry_run']:
+            dsrs    = models.DSR.objects.filter(period_start__lt=before).count()
+            months  = [month for month in partitions.list_partitions() if partitions.next_month(month) <= before]
+            self.stdout.write(f'{dsrs} DSR(s) would be deleted, {len(months)} partition(s) dropped')
+            return
+
+        dsrs = partitions.drop_periods(before)
+        self.stdout.write(self.style.SUCCESS(f'Deleted {dsrs} DSR(s) whose period starts before {before}'))
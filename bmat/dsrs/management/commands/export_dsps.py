@@ -0,0 +1,49 @@
+import time
+
+from django.core.management.base  import BaseCommand, CommandError
+
+from dsrs                         import export, views
+
+
+class Command(BaseCommand):
+    '''Exports DSPs into a Parquet or Arrow IPC file (see dsrs.export), for bulk analytics
+
+    DSPs are selected with the same optional filters as /resources/percentile/. The format is taken from the
+    extension of the output file unless --format is given, and defaults to Parquet.
+    '''
+    help = 'Exports DSPs, optionally filtered by territory, currency and period, into a Parquet or Arrow file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='file the DSPs are written into')
+        parser.add_argument('--format', choices=list(export.FORMATS), default=None, help='parquet or arrow (from the extension of the output by default)')
+        parser.add_argument('--territory', default='', help='ISO 3166-1 alpha-2 code')
+        parser.add_argument('--currency', default='', help='ISO 4217 code')
+        parser.add_argument('--period-start', default='', help='YYYY-MM-DD, DSRs starting on or after it')
+        parser.add_argument('--period-end', default='', help='YYYY-MM-DD, DSRs ending on or before it')
+        parser.add_argument('--batch-size', type=int, default=None, help='rows per chunk (settings.DSRS_EXPORT_BATCH_SIZE by default)')
+
+    def _format(self, options):
+        if options['format']:
+            return options['format']
+
+        for name, file_format in export.FORMATS.items():
+            if options['output'].endswith(file_format.extension):
+                return name
+
+        return 'parquet'
+
+    def handle(self, *args, **options):
+        if not export.is_available():
+            raise CommandError('Exporting DSPs needs pyarrow, which is not installed')
+
+        params = {name: options[name] for name in ('territory', 'currency', 'period_start', 'period_end')}
+        dsr_filter, err_msg = views._get_dsr_filter(params)
+        if err_msg:
+            raise CommandError(err_msg)
+
+        file_format  = self._format(options)
+        start        = time.perf_counter()
+        rows         = export.export_dsps(views._dsp_filter(dsr_filter), options['output'], file_format, options['batch_size'])
+        seconds      = time.perf_counter() - start
+
+        self.stdout.write(self.style.SUCCESS(f'Exported {rows} DSPs into {options["output"]} ({file_format}) in {seconds:.2f} s'))
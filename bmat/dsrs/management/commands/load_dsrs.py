@@ -0,0 +1,97 @@
+import glob
+import os
+import time
+
+from django.core.management.base  import BaseCommand, CommandError
+
+from dsrs                         import ingestion, models, utils
+
+
+class Command(BaseCommand):
+    '''Loads DSR files from the file system, without going through the upload form
+
+    Every argument is a directory (all the DSR files in it are loaded), a glob pattern (** included) or a file. Files
+    are registered as the form does (see ingestion.register_dsr_file), so files already ingested are skipped, failed
+    ones resumed and new versions of a DSR file replace its DSPs, and then ingested by ingestion.ingest_dsr_files,
+    parsing them in parallel processes.
+    '''
+    help = 'Loads DSR files (.tsv or .tsv.gz) from directories, glob patterns or paths'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='directories, glob patterns or files')
+        parser.add_argument('--workers', type=int, default=None, help='parsing processes (settings.DSRS_INGESTION_WORKERS by default)')
+        parser.add_argument('--dry-run', action='store_true', help='list the files and what would be done with them, without loading anything')
+
+    def _discover(self, paths):
+        '''Absolute paths of the DSR files matching the arguments, sorted and without duplicates'''
+        found = set()
+
+        for path in paths:
+            pattern = os.path.join(path, '*') if os.path.isdir(path) else path
+            found.update(os.path.abspath(name) for name in glob.glob(pattern, recursive=True)
+                         if os.path.isfile(name) and os.path.splitext(name)[1] in utils._file_handlers)
+
+        return sorted(found)
+
+    def _same_name(self, file_name):
+        '''The DSR registered for the name of a file, whatever its content, or None'''
+        try:
+            md = utils.parse_dsr_meta(file_name)
+
+        except ValueError:
+            return None
+
+        return models.DSR.objects.filter(path=md.path, period_start=md.period_start, period_end=md.period_end,
+                                         territory__code_2=md.territory, currency__code=md.currency).first()
+
+    def _dry_run(self, files):
+        for file_name in files:
+            _, dsr = ingestion.find_dsr_file(file_name)
+
+            if dsr is None:
+                known   = self._same_name(file_name)
+                action  = 'new' if known is None else f'replace the DSPs of DSR {known.pk} ({known.status})'
+
+            elif dsr.status in ingestion.RESUMABLE_STATUSES:
+                action = f'resume DSR {dsr.pk} from row {dsr.checkpoint_rows}'
+
+            else:
+                action = f'skip, same content as DSR {dsr.pk} ({dsr.status})'
+
+            self.stdout.write(f'{file_name}: {action}')
+
+    def handle(self, *args, **options):
+        files = self._discover(options['paths'])
+        if not files:
+            raise CommandError('No DSR files found')
+
+        if options['dry_run']:
+            return self._dry_run(files)
+
+        dsr_files = list()
+        for file_name in files:
+            try:
+                dsr = ingestion.register_dsr_file(file_name)
+
+            except (OSError, ValueError) as e:
+                self.stderr.write(self.style.ERROR(f'{file_name}: skipped, {e}'))
+                continue
+
+            if dsr is None:
+                self.stdout.write(f'{file_name}: skipped, already loaded')
+                continue
+
+            dsr_files.append((dsr, file_name))
+
+        start    = time.perf_counter()
+        results  = ingestion.ingest_dsr_files(dsr_files, workers=options['workers'])
+        seconds  = time.perf_counter() - start
+
+        for stats in results:
+            self.stdout.write(f'{stats.path}: {stats.rows} rows in {stats.seconds:.2f} s ({stats.rows_per_second:,.0f} rows/s)')
+
+        rows = sum(stats.rows for stats in results)
+        self.stdout.write(self.style.SUCCESS(f'Loaded {len(results)} file(s), {rows} rows in {seconds:.2f} s ({rows / seconds if seconds else 0:,.0f} rows/s)'))
+
+        if len(results) < len(dsr_files):
+            raise CommandError(f'{len(dsr_files) - len(results)} file(s) could not be loaded')
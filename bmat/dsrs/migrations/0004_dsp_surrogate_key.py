@@ -0,0 +1,28 @@
+# Generated by Django 3.1.7 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dsrs', '0003_auto_20210309_2255'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='dsp',
+            name='dsp_id',
+            field=models.CharField(max_length=128),
+        ),
+        migrations.AddField(
+            model_name='dsp',
+            name='id',
+            field=models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID'),
+            preserve_default=False,
+        ),
+        migrations.AddConstraint(
+            model_name='dsp',
+            constraint=models.UniqueConstraint(fields=('dsr_id', 'dsp_id'), name='dsp_dsr_dsp_id_unique'),
+        ),
+    ]
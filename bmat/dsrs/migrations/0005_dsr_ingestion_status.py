@@ -0,0 +1,18 @@
+# Generated by Django 3.1.7 on 2026-10-18 19:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dsrs', '0004_dsp_surrogate_key'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='dsr',
+            name='status',
+            field=models.CharField(choices=[('failed', 'FAILED'), ('ingested', 'INGESTED'), ('pending', 'PENDING'), ('ingesting', 'INGESTING')], default='failed', max_length=48),
+        ),
+    ]
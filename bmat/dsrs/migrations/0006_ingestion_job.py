@@ -0,0 +1,31 @@
+# Generated by Django 3.1.7 on 2026-10-18 19:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dsrs', '0005_dsr_ingestion_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestionJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'QUEUED'), ('running', 'RUNNING'), ('finished', 'FINISHED'), ('failed', 'FAILED')], default='queued', max_length=48)),
+                ('files', models.JSONField(default=list)),
+                ('rows_parsed', models.PositiveBigIntegerField(default=0)),
+                ('rows_inserted', models.PositiveBigIntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'ingestion_job',
+                'ordering': ('-id',),
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 3.1.7 on 2026-10-18 19:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dsrs', '0007_exchange_rate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DSRSummary',
+            fields=[
+                ('dsr', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='dsrs.dsr')),
+                ('exchange_rate', models.DecimalField(decimal_places=15, max_digits=30)),
+                ('row_count', models.PositiveBigIntegerField(default=0)),
+                ('total_usages', models.PositiveBigIntegerField(default=0)),
+                ('total_revenue', models.DecimalField(decimal_places=19, default=0, max_digits=40)),
+                ('total_revenue_eur', models.DecimalField(decimal_places=19, default=0, max_digits=40)),
+                ('revenue_histogram', models.JSONField(default=dict)),
+            ],
+            options={
+                'verbose_name_plural': 'DSR summaries',
+                'db_table': 'dsr_summary',
+            },
+        ),
+        migrations.AddField(
+            model_name='dsp',
+            name='exchange_rate',
+            field=models.DecimalField(blank=True, decimal_places=15, max_digits=30, null=True),
+        ),
+        migrations.AddField(
+            model_name='dsp',
+            name='revenue_eur',
+            field=models.DecimalField(blank=True, decimal_places=19, max_digits=40, null=True),
+        ),
+    ]
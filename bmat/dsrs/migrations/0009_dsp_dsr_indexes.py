@@ -0,0 +1,29 @@
+# Generated by Django 3.1.7 on 2026-10-18 19:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dsrs', '0008_dsp_revenue_eur_dsr_summary'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='dsp',
+            index=models.Index(fields=['dsr_id', 'revenue'], name='dsp_dsr_revenue_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dsp',
+            index=models.Index(fields=['dsr_id', '-revenue_eur'], name='dsp_dsr_revenue_eur_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dsp',
+            index=models.Index(fields=['-revenue_eur'], name='dsp_revenue_eur_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dsr',
+            index=models.Index(fields=['territory', 'currency', 'period_start', 'period_end'], name='dsr_filter_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.1.7 on 2026-10-18 19:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dsrs', '0009_dsp_dsr_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dsr',
+            name='checkpoint_rows',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='dsr',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='dsr',
+            index=models.Index(fields=['content_hash'], name='dsr_content_hash_idx'),
+        ),
+    ]
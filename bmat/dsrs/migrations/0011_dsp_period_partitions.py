@@ -0,0 +1,114 @@
+import datetime
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_dsr_periods(apps, schema_editor):
+    DSP = apps.get_model('dsrs', 'DSP')
+    DSR = apps.get_model('dsrs', 'DSR')
+    DSP.objects.update(period_start=Subquery(DSR.objects.filter(pk=OuterRef('dsr_id')).values('period_start')[:1]))
+
+def _rebuild_dsp_table(apps, schema_editor, partitioned):
+    '''Moves the rows of the dsp table into a new one, partitioned by month of period_start (one dsp_YYYYMM table
+    per month, plus dsp_default) or not, and puts back its keys, constraints and indexes. PostgreSQL only
+
+    Only SQL is used, and the historical DSP model: the constraints and indexes of the table are read from the
+    catalog before it is dropped, and created again as they were.'''
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    DSP    = apps.get_model('dsrs', 'DSP')
+    quote  = schema_editor.quote_name
+    table  = DSP._meta.db_table
+    new    = f'{table}_new'
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT pg_get_serial_sequence(%s, %s)', [table, 'id'])
+        sequence = cursor.fetchone()[0]
+
+        # Constraints but the primary key (NOT NULL ones are copied by LIKE), and indexes not backing one of them
+        cursor.execute("SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+                       "WHERE conrelid = %s::regclass AND contype NOT IN ('p', 'n') ORDER BY conname", [table])
+        constraints = cursor.fetchall()
+
+        cursor.execute('SELECT pg_get_indexdef(indexrelid) FROM pg_index WHERE indrelid = %s::regclass '
+                       'AND NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conindid = indexrelid) ORDER BY indexrelid', [table])
+        indexes = [definition for definition, in cursor.fetchall()]
+
+        cursor.execute(f"SELECT DISTINCT date_trunc('month', period_start)::date FROM {quote(table)} ORDER BY 1")
+        months = [month for month, in cursor.fetchall()]
+
+    partition_by = ' PARTITION BY RANGE (period_start)' if partitioned else ''
+    schema_editor.execute(f'CREATE TABLE {quote(new)} (LIKE {quote(table)} INCLUDING DEFAULTS){partition_by}')
+    schema_editor.execute(f'ALTER SEQUENCE {sequence} OWNED BY {quote(new)}.id')
+
+    if partitioned:
+        schema_editor.execute(f'CREATE TABLE {quote(table + "_default")} PARTITION OF {quote(new)} DEFAULT')
+        for month in months:
+            next_month = (month + datetime.timedelta(days=32)).replace(day=1)
+            schema_editor.execute(f'CREATE TABLE {quote(f"{table}_{month:%Y%m}")} PARTITION OF {quote(new)} '
+                                  f'FOR VALUES FROM (%s) TO (%s)', [month, next_month])
+
+    schema_editor.execute(f'INSERT INTO {quote(new)} SELECT * FROM {quote(table)}')
+    schema_editor.execute(f'DROP TABLE {quote(table)}')
+    schema_editor.execute(f'ALTER TABLE {quote(new)} RENAME TO {quote(table)}')
+
+    # The keys of a partitioned table must include its partition key. The constraints and indexes get back their
+    # names, and the index definitions name the table, which has its old name again by now
+    primary_key = 'id, period_start' if partitioned else 'id'
+    schema_editor.execute(f'ALTER TABLE {quote(table)} ADD PRIMARY KEY ({primary_key})')
+
+    for name, definition in constraints:
+        schema_editor.execute(f'ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(name)} {definition}')
+
+    for definition in indexes:
+        schema_editor.execute(definition)
+
+def partition_dsp_table(apps, schema_editor):
+    _rebuild_dsp_table(apps, schema_editor, partitioned=True)
+
+def unpartition_dsp_table(apps, schema_editor):
+    _rebuild_dsp_table(apps, schema_editor, partitioned=False)
+
+
+class Migration(migrations.Migration):
+    '''Adds DSP.period_start, a copy of the period_start of the DSR, and partitions the dsp table by
+    month of it on PostgreSQL (see dsrs.partitions, which creates the partitions of new months). On other databases,
+    it is only indexed.
+
+    It is not atomic as a whole: PostgreSQL cannot alter a table updated earlier in the same transaction (deferred
+    foreign key checks are still pending). The table rebuild runs in a transaction of its own'''
+
+    atomic = False
+
+    dependencies = [
+        ('dsrs', '0010_dsr_content_hash_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dsp',
+            name='period_start',
+            field=models.DateField(null=True),
+        ),
+        migrations.RunPython(copy_dsr_periods, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='dsp',
+            name='period_start',
+            field=models.DateField(),
+        ),
+        migrations.RemoveConstraint(
+            model_name='dsp',
+            name='dsp_dsr_dsp_id_unique',
+        ),
+        migrations.AddConstraint(
+            model_name='dsp',
+            constraint=models.UniqueConstraint(fields=('dsr_id', 'dsp_id', 'period_start'), name='dsp_dsr_dsp_id_unique'),
+        ),
+        migrations.AddIndex(
+            model_name='dsp',
+            index=models.Index(fields=['period_start', '-revenue_eur'], name='dsp_period_revenue_eur_idx'),
+        ),
+        migrations.RunPython(partition_dsp_table, unpartition_dsp_table, atomic=True),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 3.1.7 on 2026-10-18 19:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dsrs', '0011_dsp_period_partitions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DSPStaging',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dsp_id', models.CharField(max_length=128)),
+                ('title', models.CharField(max_length=128)),
+                ('artists', models.CharField(max_length=256)),
+                ('isrc', models.CharField(max_length=12)),
+                ('usages', models.PositiveIntegerField()),
+                ('revenue', models.DecimalField(decimal_places=19, max_digits=40)),
+                ('exchange_rate', models.DecimalField(blank=True, decimal_places=15, max_digits=30, null=True)),
+                ('revenue_eur', models.DecimalField(blank=True, decimal_places=19, max_digits=40, null=True)),
+                ('period_start', models.DateField()),
+                ('dsr_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='staged_dsps', to='dsrs.dsr')),
+            ],
+            options={
+                'verbose_name_plural': 'DSP staging',
+                'db_table': 'dsp_staging',
+            },
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dsrs', '0013_ingestion_job_heartbeat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dsr',
+            name='updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
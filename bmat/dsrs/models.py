@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 
 class Territory(models.Model):
@@ -44,10 +45,16 @@ class DSR(models.Model):
             models.UniqueConstraint(fields=['path', 'period_start', 'period_end', 'territory', 'currency'],
                                     name='dsr_unique_constraint')
         ]
+        indexes = [
+            models.Index(fields=['territory', 'currency', 'period_start', 'period_end'], name='dsr_filter_idx'),
+            models.Index(fields=['content_hash'], name='dsr_content_hash_idx'),
+        ]
 
     STATUS_ALL = (
         ("failed", "FAILED"),
         ("ingested", "INGESTED"),
+        ("pending", "PENDING"),
+        ("ingesting", "INGESTING"),
     )
 
     path = models.CharField(max_length=256)
@@ -65,6 +72,14 @@ class DSR(models.Model):
         Currency, related_name="dsrs", on_delete=models.CASCADE
     )
 
+    # sha256 of the file the DSR was ingested from, to recognize files uploaded again before parsing
+    # them. checkpoint_rows is the number of rows already committed by an ingestion that has not finished (it goes back
+    # to 0 when it does), so that a failed ingestion can resume from there. The DSPs of a DSR are not taken into
+    # account while its checkpoint_rows is not 0. updated_at is the last time its status or checkpoint changed
+    content_hash = models.CharField(max_length=64, blank=True, default='')
+    checkpoint_rows = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(null=True, blank=True)
+
 class DSP(models.Model):
     '''FROM CARLOS: The DSP table models the information contained in the tsv.gz files.
 
@@ -72,22 +87,135 @@ class DSP(models.Model):
     into account the samples provided. The revenue field has been setup as a 'decimal'
     instead of a 'float' type, so that there are no issues with loss of precission.
 
-    The field dsp_id has been choosen as the primary key, since it seems to be unique.
-    Also, this would prevent to insert twice the same record on the database for a given 
-    DSR.
+    The field dsp_id was initially choosen as the primary key, but the same sound recording
+    is reported by every territory's DSR, so the sample files share their dsp_ids. The table
+    now uses a surrogate primary key, and a unique constraint on (dsr_id, dsp_id) still
+    prevents to insert twice the same record on the database for a given DSR.
 
     The table must be linked to the 'dsr' table, so that the query specified in the API model,
     /resources/percentile/{number}, can be filtered by the optional parameters 'territory',
     'period_start' and 'period_end'. This has been achieved via the column 'dsr_id.'
     The cascade policy on deleting has not been implemented to preserve a 'dsr' even if a 'dsp'
-    is deleted, since there might be more 'dsps' associated with it.'''
+    is deleted, since there might be more 'dsps' associated with it.
+
+    On PostgreSQL the table is partitioned by month of period_start (see dsrs.partitions). Unique constraints of a
+    partitioned table must include its partition key, hence period_start in the one on (dsr_id, dsp_id): since it
+    is the period_start of the DSR, it does not change what the constraint allows.'''
     class Meta:
+        '''The indexes serve the /resources/percentile/ queries: the DSPs of the selected DSRs (or periods) sorted by revenue'''
         db_table = "dsp"
+        constraints = [
+            models.UniqueConstraint(fields=['dsr_id', 'dsp_id', 'period_start'], name='dsp_dsr_dsp_id_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['dsr_id', 'revenue'], name='dsp_dsr_revenue_idx'),
+            models.Index(fields=['dsr_id', '-revenue_eur'], name='dsp_dsr_revenue_eur_idx'),
+            models.Index(fields=['-revenue_eur'], name='dsp_revenue_eur_idx'),
+            models.Index(fields=['period_start', '-revenue_eur'], name='dsp_period_revenue_eur_idx'),
+        ]
 
-    dsp_id   = models.CharField(max_length=128, primary_key=True)
+    dsp_id   = models.CharField(max_length=128)
     title    = models.CharField(max_length=128)
     artists  = models.CharField(max_length=256)
     isrc     = models.CharField(max_length=12)
     usages   = models.PositiveIntegerField()
     revenue  = models.DecimalField(max_digits=40, decimal_places=19)
     dsr_id   = models.ForeignKey(DSR, related_name="dsps", on_delete=models.DO_NOTHING)
+
+    # Filled in at ingestion time (see dsrs.ingestion), null while the rate of the DSR currency is unknown
+    exchange_rate  = models.DecimalField(max_digits=30, decimal_places=15, null=True, blank=True)
+    revenue_eur    = models.DecimalField(max_digits=40, decimal_places=19, null=True, blank=True)
+
+    # Copy of the period_start of the DSR, written at ingestion time: the partition key of the table
+    period_start   = models.DateField()
+
+
+class DSPStaging(models.Model):
+    '''DSPs of a new file of a DSR already ingested, loaded here before they replace its DSPs.
+
+    The file is loaded in chunks, like any other, while the API keeps serving the DSPs the DSR had. They are then
+    swapped in with one single transaction: one DELETE of the old DSPs and one INSERT ... SELECT from this table (see
+    ingestion.replace_dsr_batches). The table has the columns of DSP, but none of its constraints and indexes, so
+    that loading it costs as little as possible'''
+    class Meta:
+        db_table = "dsp_staging"
+        verbose_name_plural = "DSP staging"
+
+    dsp_id         = models.CharField(max_length=128)
+    title          = models.CharField(max_length=128)
+    artists        = models.CharField(max_length=256)
+    isrc           = models.CharField(max_length=12)
+    usages         = models.PositiveIntegerField()
+    revenue        = models.DecimalField(max_digits=40, decimal_places=19)
+    dsr_id         = models.ForeignKey(DSR, related_name="staged_dsps", on_delete=models.CASCADE)
+    exchange_rate  = models.DecimalField(max_digits=30, decimal_places=15, null=True, blank=True)
+    revenue_eur    = models.DecimalField(max_digits=40, decimal_places=19, null=True, blank=True)
+    period_start   = models.DateField()
+
+
+class DSRSummary(models.Model):
+    '''Aggregates of a DSR's DSPs, computed once at ingestion time, so that they never need to be
+    recomputed from the DSP table. revenue_histogram maps the order of magnitude of the revenue in EUR of the DSPs
+    (e.g. "2" for 100 <= revenue < 1000, "zero" for no revenue) to the number of DSPs in it'''
+    class Meta:
+        db_table = "dsr_summary"
+        verbose_name_plural = "DSR summaries"
+
+    dsr                = models.OneToOneField(DSR, related_name="summary", on_delete=models.CASCADE, primary_key=True)
+    exchange_rate      = models.DecimalField(max_digits=30, decimal_places=15)
+    row_count          = models.PositiveBigIntegerField(default=0)
+    total_usages       = models.PositiveBigIntegerField(default=0)
+    total_revenue      = models.DecimalField(max_digits=40, decimal_places=19, default=0)
+    total_revenue_eur  = models.DecimalField(max_digits=40, decimal_places=19, default=0)
+    revenue_histogram  = models.JSONField(default=dict)
+
+
+class IngestionJob(models.Model):
+    '''An ingestion of one or more DSR files running in the background.
+
+    files stores the [DSR id, file name] pairs to ingest, the DSR id being null until the file is registered (see
+    jobs.run_ingestion_job). The counters are persisted every time a file is committed, so that the progress can be
+    followed from any process through the /dsrs/jobs/<id>/ endpoint. heartbeat_at is refreshed while the job runs,
+    so that a job whose process died can be told apart (see jobs.fail_orphaned_jobs).'''
+    class Meta:
+        db_table = "ingestion_job"
+        ordering = ("-id",)
+
+    STATUS_ALL = (
+        ("queued", "QUEUED"),
+        ("running", "RUNNING"),
+        ("finished", "FINISHED"),
+        ("failed", "FAILED"),
+    )
+
+    status         = models.CharField(choices=STATUS_ALL, default=STATUS_ALL[0][0], max_length=48)
+    files          = models.JSONField(default=list)
+    rows_parsed    = models.PositiveBigIntegerField(default=0)
+    rows_inserted  = models.PositiveBigIntegerField(default=0)
+    error          = models.TextField(blank=True, default='')
+    created_at     = models.DateTimeField(auto_now_add=True)
+    started_at     = models.DateTimeField(null=True, blank=True)
+    finished_at    = models.DateTimeField(null=True, blank=True)
+    heartbeat_at   = models.DateTimeField(null=True, blank=True)
+
+    def throughput(self, now=None):
+        '''Rows inserted per second since the job started'''
+        if not self.started_at:
+            return 0.0
+
+        seconds = ((self.finished_at or now or timezone.now()) - self.started_at).total_seconds()
+        return self.rows_inserted / seconds if seconds > 0 else 0.0
+
+
+class ExchangeRate(models.Model):
+    '''Rate to convert one unit of currency into EUR on a given date. Filled in by dsrs.rates, so that
+    every rate is fetched from the provider only once'''
+    class Meta:
+        db_table = "exchange_rate"
+        constraints = [
+            models.UniqueConstraint(fields=['currency', 'date'], name='exchange_rate_currency_date_unique'),
+        ]
+
+    currency  = models.CharField(max_length=3)
+    date      = models.DateField()
+    rate      = models.DecimalField(max_digits=30, decimal_places=15)
@@ -0,0 +1,20 @@
+from django.conf                  import settings
+
+from rest_framework.pagination    import CursorPagination
+
+
+class PrimaryKeyCursorPagination(CursorPagination):
+    '''Cursor pagination over the primary key (id, so that .values() rows can be paginated too)
+
+    Every page is fetched with WHERE id > <cursor> ORDER BY id LIMIT <page size>, which the primary key index answers
+    straight away, so the last page of millions of rows costs the same as the first one (unlike OFFSET pagination,
+    which has to skip all the rows before the page). The page size defaults to settings.DSRS_PAGE_SIZE and can be
+    changed with ?page_size=, up to settings.DSRS_MAX_PAGE_SIZE.
+    '''
+    ordering               = 'id'
+    page_size_query_param  = 'page_size'
+
+    def __init__(self):
+        # A paginator is created for every request, so the settings are read here rather than at import time
+        self.page_size      = settings.DSRS_PAGE_SIZE
+        self.max_page_size  = settings.DSRS_MAX_PAGE_SIZE
@@ -0,0 +1,112 @@
+import datetime
+import logging
+import threading
+
+from django.db          import DatabaseError, connection, transaction
+
+from .                  import caching, models, revenue_index
+
+logger = logging.getLogger(__name__)
+
+# Partitioning of the DSP table by reporting period.
+#
+# Every DSP keeps a copy of the period_start of its DSR. On PostgreSQL, the dsp table is partitioned by range of that
+# column (migration 0011), with one partition per month, named dsp_YYYYMM, plus a default one for whatever has no
+# partition of its own. Partitions are created by ensure_partition right before a DSR is ingested, so its rows are
+# routed to their month. Queries filtering DSPs by period_start (see views._dsp_filter) only read the partitions of
+# the months they cover, and dropping old months (drop_periods) drops whole tables instead of deleting rows.
+#
+# Other databases have no declarative partitioning: there, the dsp_period_revenue_eur_idx index serves the period
+# filters, and drop_periods deletes the rows of the period
+
+DEFAULT_PARTITION = f'{models.DSP._meta.db_table}_default'
+
+# Partitions known to exist, so that ingestions do not run DDL for every DSR
+_known  = set()
+_lock   = threading.Lock()
+
+
+def is_partitioned():
+    return connection.vendor == 'postgresql'
+
+def month_start(day):
+    return day.replace(day=1)
+
+def next_month(day):
+    return (month_start(day) + datetime.timedelta(days=32)).replace(day=1)
+
+def partition_name(day):
+    '''Name of the partition of the month of day'''
+    return f'{models.DSP._meta.db_table}_{day:%Y%m}'
+
+def create_partition_sql(day, table=None):
+    '''Statement creating the partition of the month of day, unless it exists'''
+    quote = connection.ops.quote_name
+    return (f'CREATE TABLE IF NOT EXISTS {quote(partition_name(day))} PARTITION OF {quote(table or models.DSP._meta.db_table)} '
+            f"FOR VALUES FROM ('{month_start(day).isoformat()}') TO ('{next_month(day).isoformat()}')")
+
+def ensure_partition(period_start):
+    '''Creates the partition of the month of period_start if needed. Nothing to do without partitions
+
+    A month whose rows went to the default partition (e.g. ingested before the partition was created) cannot get a
+    partition of its own: it is left there, which only costs the queries on that month some pruning.'''
+    if not is_partitioned():
+        return
+
+    name = partition_name(period_start)
+    with _lock:
+        if name in _known:
+            return
+
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(create_partition_sql(period_start))
+
+    except DatabaseError as e:
+        logger.warning('Could not create the DSP partition %s, its rows go to %s: %s', name, DEFAULT_PARTITION, e)
+
+    with _lock:
+        _known.add(name)
+
+def list_partitions():
+    '''Returns the months (their first day) that have a partition of their own'''
+    if not is_partitioned():
+        return []
+
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT child.relname FROM pg_inherits '
+                       'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+                       'JOIN pg_class parent ON parent.oid = pg_inherits.inhparent '
+                       'WHERE parent.relname = %s', [models.DSP._meta.db_table])
+        names = [name for name, in cursor.fetchall()]
+
+    prefix = f'{models.DSP._meta.db_table}_'
+    return sorted(datetime.datetime.strptime(name[len(prefix):], '%Y%m').date() for name in names if name != DEFAULT_PARTITION)
+
+def drop_periods(before):
+    '''Deletes the DSRs whose period starts before the date before, along with their DSPs, summaries
+    and revenue indexes. Returns the number of DSRs deleted
+
+    Partitions of months ending before that date are dropped whole. The DSPs left (those of the month of before, or
+    in the default partition, or all of them without partitions) are deleted with one single DELETE.
+    '''
+    dsrs     = models.DSR.objects.filter(period_start__lt=before)
+    dsr_pks  = list(dsrs.values_list('pk', flat=True))
+    dropped  = [month for month in list_partitions() if next_month(month) <= before]
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            for month in dropped:
+                cursor.execute(f'DROP TABLE {connection.ops.quote_name(partition_name(month))}')
+
+        models.DSP.objects.filter(period_start__lt=before).delete()
+        dsrs.delete()
+
+    with _lock:
+        _known.difference_update(partition_name(month) for month in dropped)
+
+    for dsr_pk in dsr_pks:
+        revenue_index.delete(dsr_pk)
+
+    caching.bump_data_version()
+    return len(dsr_pks)
@@ -0,0 +1,196 @@
+import json
+import logging
+import threading
+import time
+from abc                          import ABC, abstractmethod
+from collections                  import OrderedDict
+from decimal                      import Decimal
+
+import requests
+
+from django.conf                  import settings
+from django.core.signals          import setting_changed
+from django.dispatch              import receiver
+from django.utils                 import timezone
+from django.utils.module_loading  import import_string
+
+from .                            import instrumentation, models
+
+logger = logging.getLogger(__name__)
+
+# Exchange rates into EUR, the currency every revenue is compared in.
+#
+# Rates are looked up in three levels: an in-process cache, the exchange_rate table, and finally a rate provider. The
+# provider is chosen with settings.DSRS_RATE_PROVIDER, so that tests and offline deployments can use a local file
+# instead of the currconv web service
+
+BASE_CURRENCY = 'EUR'
+
+
+class RateProvider(ABC):
+    '''Interface of the rate providers. fetch must return a dictionary currency code -> Decimal with
+    the rates of the given date, in one single call. Currencies it does not know about are simply left out'''
+
+    @abstractmethod
+    def fetch(self, currencies, date):
+        pass
+
+
+class CurrConvProvider(RateProvider):
+    '''Gets the rates from the currconv web service, asking for all currency pairs at once'''
+
+    url = 'https://free.currconv.com/api/v7/convert'
+
+    def __init__(self, api_key=None, timeout=None):
+        self.api_key  = api_key or settings.DSRS_CURRCONV_API_KEY
+        self.timeout  = timeout or settings.DSRS_RATES_TIMEOUT
+
+    def fetch(self, currencies, date):
+        pairs     = {f'{currency}_{BASE_CURRENCY}': currency for currency in currencies}
+        params    = {'q': ','.join(pairs), 'compact': 'ultra', 'date': date.isoformat(), 'apiKey': self.api_key}
+        with instrumentation.timed():
+            response = requests.get(self.url, params=params, timeout=self.timeout)
+
+        response.raise_for_status()
+
+        # With a date, currconv answers {"USD_EUR": {"2021-03-01": 0.83}}, without it {"USD_EUR": 0.83}
+        rates = dict()
+        for pair, value in response.json().items():
+            value = value.get(date.isoformat()) if isinstance(value, dict) else value
+            if pair in pairs and value is not None:
+                rates[pairs[pair]] = Decimal(str(value))
+
+        return rates
+
+
+class FileRateProvider(RateProvider):
+    '''Reads the rates from a JSON file (settings.DSRS_RATES_FILE). The file either maps currency codes
+    to rates, used for any date, or dates (YYYY-MM-DD) to such mappings'''
+
+    def __init__(self, path=None):
+        self.path = path or settings.DSRS_RATES_FILE
+
+    def fetch(self, currencies, date):
+        with open(self.path) as fh:
+            content = json.load(fh)
+
+        rates = content.get(date.isoformat(), content)
+        return {currency: Decimal(str(rates[currency])) for currency in currencies if currency in rates}
+
+
+class _RateCache:
+    '''Thread-safe LRU cache whose entries expire after ttl seconds (or the ttl they were set with)'''
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize  = maxsize
+        self.ttl      = ttl
+        self.entries  = OrderedDict()
+        self.lock     = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+
+            value, expires = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+# Cached in place of the rate of a currency the provider could not resolve, so that every lookup
+# does not ask it again (and wait for it, up to settings.DSRS_RATES_TIMEOUT) before settings.DSRS_RATES_NEGATIVE_TTL
+_NO_RATE = object()
+
+_cache     = None
+_provider  = None
+
+
+def _get_cache():
+    global _cache
+    if _cache is None:
+        _cache = _RateCache(settings.DSRS_RATES_CACHE_SIZE, settings.DSRS_RATES_CACHE_TTL)
+
+    return _cache
+
+def get_provider():
+    '''Returns the rate provider configured in settings.DSRS_RATE_PROVIDER'''
+    global _provider
+    if _provider is None:
+        _provider = import_string(settings.DSRS_RATE_PROVIDER)()
+
+    return _provider
+
+@receiver(setting_changed)
+def _reset(setting, **kwargs):
+    '''Forgets the cache and the provider when their settings change (e.g. with override_settings)'''
+    global _cache, _provider
+    if setting.startswith('DSRS_RATE'):
+        _cache, _provider = None, None
+
+def get_conversion_factors(currencies, date=None):
+    '''Returns a dictionary currency code -> rate to convert an amount of that currency into EUR
+
+    date defaults to today. Whatever is not in the cache is looked up in the exchange_rate table with one single
+    query, and whatever is not there either is fetched from the provider in one single call and stored. Currencies
+    with no known rate are logged and left out of the result, and the provider is not asked for them again for a
+    while (see _NO_RATE).
+    '''
+    date    = date or timezone.now().date()
+    cache   = _get_cache()
+    rates   = {BASE_CURRENCY: Decimal(1)}
+
+    missing = set()
+    for currency in set(currencies) - {BASE_CURRENCY}:
+        rate = cache.get((currency, date))
+        if rate is None:
+            missing.add(currency)
+
+        elif rate is not _NO_RATE:
+            rates[currency] = rate
+
+    if missing:
+        stored = dict(models.ExchangeRate.objects.filter(currency__in=missing, date=date).values_list('currency', 'rate'))
+        missing -= set(stored)
+
+        if missing:
+            try:
+                fetched = get_provider().fetch(sorted(missing), date)
+
+            except Exception as e:
+                logger.error('Could not fetch exchange rates for %s: %s', ', '.join(sorted(missing)), e)
+                fetched = dict()
+
+            models.ExchangeRate.objects.bulk_create(
+                [models.ExchangeRate(currency=currency, date=date, rate=rate) for currency, rate in fetched.items()],
+                ignore_conflicts=True,
+            )
+            stored.update(fetched)
+
+            for currency in missing - set(fetched):
+                cache.set((currency, date), _NO_RATE, ttl=settings.DSRS_RATES_NEGATIVE_TTL)
+
+        for currency, rate in stored.items():
+            cache.set((currency, date), rate)
+            rates[currency] = rate
+
+    for currency in set(currencies) - set(rates):
+        logger.error('No exchange rate found for %s on %s', currency, date)
+
+    return rates
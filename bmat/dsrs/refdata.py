@@ -0,0 +1,86 @@
+import logging
+import threading
+
+import pycountry
+
+from django.db                  import IntegrityError, transaction
+from django.db.models.signals   import post_delete, post_save
+from django.dispatch            import receiver
+
+from .                          import models
+
+logger = logging.getLogger(__name__)
+
+# Process-level cache of the reference data (Territory and Currency rows), keyed by their codes.
+#
+# Both tables are loaded at once, with one query each, the first time a code is resolved. From then on, known codes
+# cost no query at all. Codes that are not in the tables yet are completed with pycountry and inserted. Any change
+# made to these tables through the ORM (e.g. from the admin site) drops the cache, which is loaded again on the next
+# lookup. Changes made by other processes are not seen until then
+
+_currencies   = None
+_territories  = None
+_lock         = threading.RLock()
+
+
+def clear():
+    '''Drops the cached rows'''
+    global _currencies, _territories
+    with _lock:
+        _currencies, _territories = None, None
+
+@receiver(post_save, sender=models.Currency)
+@receiver(post_delete, sender=models.Currency)
+@receiver(post_save, sender=models.Territory)
+@receiver(post_delete, sender=models.Territory)
+def _invalidate(sender, **kwargs):
+    clear()
+
+def _load():
+    global _currencies, _territories
+    if _currencies is None:
+        _currencies   = {currency.code: currency for currency in models.Currency.objects.all()}
+        _territories  = {territory.code_2: territory for territory in models.Territory.objects.select_related('local_currency')}
+
+def _create(model, **fields):
+    '''Codes missing from the cache are missing from the table too, so the row is inserted straight away.
+    If another process inserted it in the meantime, the unique constraint fails and that row is read instead'''
+    try:
+        with transaction.atomic():
+            return model.objects.create(**fields)
+
+    except IntegrityError:
+        lookup = {name: value for name, value in fields.items() if name in ('code', 'code_2')}
+        return model.objects.get(**lookup)
+
+def get_currency(code):
+    '''Returns the Currency of a three-letter code, creating it if needed. Raises ValueError if the code
+    is not a valid ISO 4217 code'''
+    with _lock:
+        _load()
+        currency = _currencies.get(code)
+
+    if currency is None:
+        iso_currency = pycountry.currencies.get(alpha_3=code)
+        if not iso_currency:
+            raise ValueError(f'Currency {code} not found')
+
+        currency = _create(models.Currency, name=iso_currency.name, symbol=iso_currency.numeric, code=code)
+
+    return currency
+
+def get_territory(code_2, currency_code):
+    '''Returns the Territory of a two-letter code, creating it (and its local currency, currency_code)
+    if needed. Raises ValueError if either code is not a valid ISO code'''
+    with _lock:
+        _load()
+        territory = _territories.get(code_2)
+
+    if territory is None:
+        country = pycountry.countries.get(alpha_2=code_2)
+        if not country:
+            raise ValueError(f'Country {code_2} not found')
+
+        territory = _create(models.Territory, name=country.name, code_2=code_2, code_3=country.alpha_3, local_currency=get_currency(currency_code))
+
+    return territory
@@ -0,0 +1,208 @@
+import bisect
+import hashlib
+import mmap
+import os
+import tempfile
+from array              import array
+from contextlib         import ExitStack
+from pathlib            import Path
+
+from django.conf        import settings
+
+from .                  import models, utils
+
+# Cumulative revenue index of every DSR, to find the cut-off of a percentile without reading DSP rows.
+#
+# The index of a DSR is a sidecar file (settings.DSRS_REVENUE_INDEX_DIR/<DSR id>.idx) holding a stamp of the data it
+# was built from (see _stamp) and two arrays of doubles: the revenues in EUR of its DSPs sorted in descending order
+# (stored negated, i.e. ascending, so that bisect works on them) and their running sum. Files are memory-mapped, so a
+# lookup only reads the few pages a binary search touches.
+#
+# The DSPs of a percentile are the longest run of DSPs, sorted by revenue (descending) and id, such that the revenue
+# of the DSPs before each of them does not exceed the target. That is, every DSP with a revenue above some value v,
+# plus the first few of the ones with a revenue of exactly v. percentile_cutoff finds v and the number of DSPs with a
+# binary search over the revenues of all the indexes of the selected DSRs at once. Revenues are compared in double
+# precision
+
+_HEADER_SIZE = hashlib.sha256().digest_size
+
+
+def _path(dsr_pk):
+    return Path(settings.DSRS_REVENUE_INDEX_DIR) / f'{dsr_pk}.idx'
+
+def _stamp(content_hash, row_count, total_revenue_eur):
+    '''Header of the index of a DSR: a digest of its content_hash and its summary totals, which change
+    whenever its DSPs do (e.g. replaced by a new file whose index could not be built)'''
+    return hashlib.sha256(f'{content_hash}:{row_count}:{total_revenue_eur}'.encode()).digest()
+
+def build(dsr):
+    '''Writes (or rewrites) the index of a DSR from its DSPs, reading their revenues in index order'''
+    stamp    = _stamp(*models.DSR.objects.filter(pk=dsr.pk).values_list('content_hash', 'summary__row_count', 'summary__total_revenue_eur').get())
+    revenues = models.DSP.objects.filter(dsr_id=dsr, revenue_eur__isnull=False).order_by('-revenue_eur').values_list('revenue_eur', flat=True)
+
+    keys, sums, total = array('d'), array('d'), 0.0
+    for chunk in utils.batched(revenues.iterator(), settings.DSRS_INGESTION_BATCH_SIZE):
+        for revenue in map(float, chunk):
+            total += revenue
+            keys.append(-revenue)
+            sums.append(total)
+
+    path = _path(dsr.pk)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Written aside and renamed, so that readers never see half a file
+    with tempfile.NamedTemporaryFile('wb', dir=path.parent, delete=False) as fh:
+        fh.write(stamp)
+        keys.tofile(fh)
+        sums.tofile(fh)
+
+    os.replace(fh.name, path)
+
+def _is_current(dsr):
+    '''Whether the index file of a (summarized) DSR exists, has one entry per row of its summary and was
+    built from the DSPs it has now (its stamp)'''
+    summary = dsr.summary
+
+    try:
+        with open(_path(dsr.pk), 'rb') as fh:
+            if os.fstat(fh.fileno()).st_size != _HEADER_SIZE + 2 * array('d').itemsize * summary.row_count:
+                return False
+
+            return fh.read(_HEADER_SIZE) == _stamp(dsr.content_hash, summary.row_count, summary.total_revenue_eur)
+
+    except FileNotFoundError:
+        return False
+
+def ensure(dsrs):
+    '''Builds the indexes of the summarized DSRs that do not have an up to date one (e.g. ingested
+    before they existed, or whose file was left by a deleted DSR with the same id)'''
+    for dsr in dsrs:
+        if not _is_current(dsr):
+            build(dsr)
+
+def delete(dsr_pk):
+    try:
+        _path(dsr_pk).unlink()
+
+    except FileNotFoundError:
+        pass
+
+
+class _Index:
+    '''Read-only view of the index file of a DSR'''
+
+    def __init__(self, fh):
+        size = os.fstat(fh.fileno()).st_size
+        self.length = max(size - _HEADER_SIZE, 0) // (2 * array('d').itemsize)
+
+        if self.length:
+            self.buffer  = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            self.bytes   = memoryview(self.buffer)[_HEADER_SIZE:]
+            self.values  = self.bytes.cast('d')
+            self.keys    = self.values[:self.length]
+            self.sums    = self.values[self.length:]
+
+    def close(self):
+        # The views must be released before the map can be closed
+        if self.length:
+            for view in (self.keys, self.sums, self.values, self.bytes):
+                view.release()
+
+            self.buffer.close()
+
+    def count_above(self, value):
+        return bisect.bisect_left(self.keys, -value) if self.length else 0
+
+    def count_at_least(self, value):
+        return bisect.bisect_right(self.keys, -value) if self.length else 0
+
+    def sum_above(self, value):
+        count = self.count_above(value)
+        return self.sums[count - 1] if count else 0.0
+
+    def total(self):
+        return self.sums[-1] if self.length else 0.0
+
+    def value(self, position):
+        return -self.keys[position]
+
+
+def _sum_above(indexes, value):
+    return sum(index.sum_above(value) for index in indexes)
+
+def _weighted_median(candidates):
+    '''Value of (value, weight) pairs such that the pairs on either side of it (itself included) weigh
+    at least half of the total'''
+    half, weight = sum(weight for _, weight in candidates) / 2, 0
+    for value, weight_of_value in sorted(candidates):
+        weight += weight_of_value
+        if weight >= half:
+            return value
+
+def percentile_cutoff(indexes, percentile_value):
+    '''Returns (v, n): the percentile is made of the first n DSPs with a revenue of at least v (in the
+    order of the endpoint). n is 0 if there are no DSPs
+
+    v is the smallest revenue such that the revenue of the DSPs above it does not exceed the target. Since that sum
+    only grows as v goes down, it is found with a binary search over the revenues of all the indexes, as if they
+    were merged: every index keeps the range of its positions that can still hold v, and each step tries the
+    weighted median of the middle revenues of those ranges. Whatever the outcome, that discards at least a quarter
+    of the revenues left, so there are O(log n) steps of O(D log n) each, D being the number of indexes.
+    '''
+    target  = percentile_value / 100 * sum(index.total() for index in indexes)
+    ranges  = [[0, index.length] for index in indexes]
+    cutoff  = None
+
+    while True:
+        candidates = [(index.value((low + high) // 2), high - low) for index, (low, high) in zip(indexes, ranges) if low < high]
+        if not candidates:
+            break
+
+        pivot = _weighted_median(candidates)
+        if _sum_above(indexes, pivot) <= target:
+            # v is pivot or below: revenues of at least pivot are discarded
+            cutoff = pivot
+            for index, bounds in zip(indexes, ranges):
+                bounds[0] = max(bounds[0], index.count_at_least(pivot))
+
+        else:
+            # v is above pivot: revenues of at most pivot are discarded
+            for index, bounds in zip(indexes, ranges):
+                bounds[1] = min(bounds[1], index.count_above(pivot))
+
+    if cutoff is None:
+        return None, 0
+
+    above  = sum(index.count_above(cutoff) for index in indexes)
+    ties   = sum(index.count_at_least(cutoff) for index in indexes) - above
+
+    # DSPs with a revenue of exactly v are taken while the revenue before them does not exceed the target
+    room = target - _sum_above(indexes, cutoff)
+    if cutoff > 0:
+        ties = min(ties, int(room // cutoff) + 1)
+
+    return cutoff, above + ties
+
+class open_indexes(ExitStack):
+    '''Context manager opening the indexes of some DSRs. It returns None if any of them is missing'''
+
+    def __init__(self, dsr_pks):
+        super().__init__()
+        self.dsr_pks = dsr_pks
+
+    def __enter__(self):
+        super().__enter__()
+        indexes = list()
+
+        for dsr_pk in self.dsr_pks:
+            try:
+                fh = self.enter_context(open(_path(dsr_pk), 'rb'))
+
+            except FileNotFoundError:
+                return None
+
+            index = _Index(fh)
+            self.callback(index.close)
+            indexes.append(index)
+
+        return indexes
@@ -1,6 +1,6 @@
 from rest_framework import serializers
 
-from . import models
+from . import jobs, models
 
 
 class TerritorySerializer(serializers.ModelSerializer):
@@ -21,7 +21,18 @@ class CurrencySerializer(serializers.ModelSerializer):
         )
 
 
-class DSRSerializer(serializers.ModelSerializer):
+class SparseFieldsMixin:
+    '''Lets a serializer be created with fields=[...], to output only those of its fields'''
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class DSRSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     territory = TerritorySerializer()
     currency = CurrencySerializer()
 
@@ -37,7 +48,7 @@ class DSRSerializer(serializers.ModelSerializer):
             "currency",
         )
 
-class DSPSerializer(serializers.ModelSerializer):
+class DSPSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     '''FROM CARLOS: Added basic serializer for the DSP model'''
     dsr_id = DSRSerializer()
 
@@ -52,3 +63,115 @@ class DSPSerializer(serializers.ModelSerializer):
             "revenue",
             "dsr_id",
         )
+
+def _converters(serializer, names):
+    '''to_representation of the fields whose database values are not ready to be rendered as they are
+    (decimals and dates), so that the plain-dict serializers output exactly what the DRF ones do'''
+    convertible = (serializers.DecimalField, serializers.DateField, serializers.DateTimeField)
+    return {name: serializer.fields[name].to_representation for name in names if isinstance(serializer.fields[name], convertible)}
+
+
+class DSRValuesSerializer:
+    '''Read-only, plain-dict version of DSRSerializer, working on .values() rows
+
+    The DRF serializers create and run a field object per attribute and row, which dominates the cost of listing
+    large tables. These ones only copy dictionary keys, converting the few values that need it.
+    '''
+    serializer_class  = DSRSerializer
+    nested            = {'territory': TerritorySerializer.Meta.fields, 'currency': CurrencySerializer.Meta.fields}
+
+    def __init__(self, fields=None):
+        self.fields      = [name for name in self.serializer_class.Meta.fields if fields is None or name in fields]
+        self.converters  = _converters(self.serializer_class(), self.fields)
+
+    @property
+    def values_fields(self):
+        '''Lookups to pass to .values() to read the rows'''
+        return [f'{name}__{nested}' if name in self.nested else name
+                for name in self.fields for nested in self.nested.get(name, (None,))]
+
+    def to_dict(self, row):
+        data = dict()
+        for name in self.fields:
+            if name in self.nested:
+                data[name] = {nested: row[f'{name}__{nested}'] for nested in self.nested[name]}
+                continue
+
+            value    = row[name]
+            convert  = self.converters.get(name)
+            data[name] = convert(value) if convert and value is not None else value
+
+        return data
+
+    def serialize(self, rows):
+        return [self.to_dict(row) for row in rows]
+
+
+class DSPValuesSerializer(DSRValuesSerializer):
+    '''Read-only, plain-dict version of DSPSerializer, working on .values() rows
+
+    The DSRs are not joined to every row: the ones a page refers to are read with one extra query and turned into
+    dictionaries once, and kept for the following pages serialized by the same instance (one per request).
+    '''
+    serializer_class  = DSPSerializer
+    nested            = dict()
+
+    def __init__(self, fields=None):
+        super().__init__(fields)
+        self.dsrs            = dict()
+        self.dsr_serializer  = DSRValuesSerializer()
+
+    @property
+    def values_fields(self):
+        return [name for name in self.fields if name != 'dsr_id'] + ['dsr_id']
+
+    def _memoize_dsrs(self, dsr_ids):
+        missing = set(dsr_ids) - set(self.dsrs)
+        if missing:
+            rows = models.DSR.objects.filter(pk__in=missing).values(*self.dsr_serializer.values_fields)
+            self.dsrs.update((row['id'], self.dsr_serializer.to_dict(row)) for row in rows)
+
+    def to_dict(self, row):
+        data = super().to_dict(row)
+        if 'dsr_id' in data:
+            data['dsr_id'] = self.dsrs[row['dsr_id']]
+
+        return data
+
+    def serialize(self, rows):
+        rows = list(rows)
+        if 'dsr_id' in self.fields:
+            self._memoize_dsrs(row['dsr_id'] for row in rows)
+
+        return [self.to_dict(row) for row in rows]
+
+
+class IngestionJobSerializer(serializers.ModelSerializer):
+    '''Serializer for the ingestion jobs. The counters of a job running in this same process are
+    taken from memory, since they are more recent than the ones in the database'''
+    throughput = serializers.SerializerMethodField()
+
+    class Meta:
+        model = models.IngestionJob
+        fields = (
+            "id",
+            "status",
+            "files",
+            "rows_parsed",
+            "rows_inserted",
+            "throughput",
+            "error",
+            "created_at",
+            "started_at",
+            "finished_at",
+        )
+
+    def to_representation(self, instance):
+        progress = jobs.live_progress(instance.pk)
+        if progress:
+            instance.rows_parsed, instance.rows_inserted = progress
+
+        return super().to_representation(instance)
+
+    def get_throughput(self, instance):
+        return round(instance.throughput(), 3)
@@ -1,12 +1,54 @@
-from django.test import Client, TestCase
-from dsrs.models import DSR, Territory, Currency
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.core.cache import caches
+from django.db import connection
+from django.db.models import F
+from django.utils import timezone
+from dsrs import export, ingestion, instrumentation, jobs, partitions, rates, refdata, revenue_index, serializers, utils, views
+from dsrs.models import DSP, DSPStaging, DSR, DSRSummary, ExchangeRate, IngestionJob, Territory, Currency
+from dsrs.utils import DsrBatch, DsrRecord, iter_dsr_records
 
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+from itertools import islice
+from decimal import Decimal
 from random import randint
+from unittest import mock
+
+import io
+import json
+import tempfile
+import os
+import types
+import unittest
+
+class _DyingProcessPoolExecutor(ProcessPoolExecutor):
+    '''Process pool whose worker processes die as soon as they get a task, like processes killed for lack of memory'''
+    def submit(self, *args, **kwargs):
+        future = super().submit(*args, **kwargs)
+        for process in list(self._processes.values()):
+            process.kill()
+
+        return future
+
+def use_temporary_revenue_index_dir(test_case):
+    '''Gives a test its own revenue index directory, since DSR ids are reused once a test is rolled back'''
+    directory = tempfile.TemporaryDirectory()
+    test_case.addCleanup(directory.cleanup)
+
+    override = override_settings(DSRS_REVENUE_INDEX_DIR=directory.name)
+    override.enable()
+    test_case.addCleanup(override.disable)
+
 
 # Create your tests here.
 class DsrTests(TestCase):
     
     def setUp(self):
+        use_temporary_revenue_index_dir(self)
+
         # Add data into the DB (ideally, much more, this is just a sample)
         currency   = Currency(name='Euro', symbol='8888', code='EUR')
         territory  = Territory(name='Spain', code_2='ES', code_3='ESP', local_currency=currency)
@@ -63,17 +105,951 @@ class DsrTests(TestCase):
     def test_get_percentile_limit_values_returns_OK_response(self):
         percentile = 1
         response = self.client.get(f'/resources/percentile/{percentile}/', HTTP_ACCEPT='application/json')
-        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.status_code, 200)
 
         percentile = 100
         response = self.client.get(f'/resources/percentile/{percentile}/', HTTP_ACCEPT='application/json')
-        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.status_code, 200)
 
     def test_get_percentile_with_query_params_returns_OK_response(self):
         percentile = randint(1, 100)
         response = self.client.get(f'/resources/percentile/{percentile}/', {'country':'ES', 'currency':'EUR', 'period_start':'2020-01-01', 'period_end':'2020-01-30'}, HTTP_ACCEPT='application/json')
         self.assertEqual(response.status_code, 200)
 
-        
-        
 
+@override_settings(DSRS_RATE_PROVIDER='dsrs.rates.FileRateProvider')
+class IngestionTests(TestCase):
+
+    def setUp(self):
+        use_temporary_revenue_index_dir(self)
+        currency   = Currency.objects.create(name='Euro', symbol='978', code='EUR')
+        territory  = Territory.objects.create(name='Spain', code_2='ES', code_3='ESP', local_currency=currency)
+        self.dsr   = DSR.objects.create(path='some/random/path', period_start='2020-01-01', period_end='2020-01-31', territory=territory, currency=currency)
+
+    def test_ingest_dsr_records_writes_every_record_in_batches(self):
+        records = [DsrRecord(f'dsp{i}', 'title', 'artist', 'ISRC', str(i), f'{i}.5') for i in range(25)]
+        stats = ingestion.ingest_dsr_records(self.dsr, records, batch_size=10)
+
+        self.assertEqual(stats.rows, 25)
+        self.assertEqual(DSP.objects.filter(dsr_id=self.dsr).count(), 25)
+        self.assertEqual(DSP.objects.get(dsp_id='dsp3').usages, 3)
+
+    def test_ingest_dsr_records_defaults_empty_usages_and_revenue(self):
+        ingestion.ingest_dsr_records(self.dsr, [DsrRecord('dsp0', 'title', 'artist', 'ISRC', '', '')])
+
+        dsp = DSP.objects.get(dsp_id='dsp0')
+        self.assertEqual((dsp.usages, dsp.revenue), (0, 0))
+
+    def test_ingest_dsr_files_in_parallel_updates_every_status(self):
+        other = DSR.objects.create(path='other/path', period_start='2020-01-01', period_end='2020-01-31', territory=self.dsr.territory, currency=self.dsr.currency)
+        dsr_files = [(self.dsr, 'Spotify_SpotifyDuo_NO_NOK_20200101-20200131.tsv.gz'), (other, 'Spotify_SpotifyStudent_GB_GBP_20200301-20200331.tsv.gz')]
+
+        stats = ingestion.ingest_dsr_files(dsr_files, workers=2)
+
+        self.assertEqual([s.rows for s in stats], [1000, 1000])
+        self.assertEqual(set(DSR.objects.values_list('status', flat=True)), {'ingested'})
+        self.assertEqual(DSP.objects.filter(dsr_id=other).count(), 1000)
+
+    def test_ingest_dsr_files_marks_unparsable_files_as_failed(self):
+        other = DSR.objects.create(path='other/path', period_start='2020-01-01', period_end='2020-01-31', territory=self.dsr.territory, currency=self.dsr.currency)
+        stats = ingestion.ingest_dsr_files([(self.dsr, 'Spotify_SpotifyDuo_NO_NOK_20200101-20200131.tsv.gz'), (other, 'missing.tsv')], workers=2)
+
+        self.assertEqual(len(stats), 1)
+        self.assertEqual(DSR.objects.get(pk=self.dsr.pk).status, 'ingested')
+        self.assertEqual(DSR.objects.get(pk=other.pk).status, 'failed')
+
+    def test_ingest_dsr_files_fails_files_whose_worker_process_dies(self):
+        other = DSR.objects.create(path='other/path', period_start='2020-01-01', period_end='2020-01-31', territory=self.dsr.territory, currency=self.dsr.currency)
+        with mock.patch.object(ingestion, 'ProcessPoolExecutor', _DyingProcessPoolExecutor):
+            stats = ingestion.ingest_dsr_files([(self.dsr, 'Spotify_SpotifyDuo_NO_NOK_20200101-20200131.tsv.gz'), (other, 'Spotify_SpotifyStudent_GB_GBP_20200301-20200331.tsv.gz')], workers=2)
+
+        self.assertEqual(stats, [])
+        self.assertEqual(set(DSR.objects.values_list('status', flat=True)), {'failed'})
+
+    @override_settings(DSRS_JOBS_ASYNC=False)
+    def test_upload_sample_file_ingests_all_its_rows(self):
+        file_name = 'Spotify_SpotifyDuo_NO_NOK_20200101-20200131.tsv.gz'
+        response = self.client.post('/resources/upload-dsrs/', {'dsr_files': SimpleUploadedFile(file_name, b'dsr')})
+
+        job = IngestionJob.objects.get()
+        self.assertRedirects(response, f'/dsrs/jobs/{job.pk}/', fetch_redirect_response=False)
+        self.assertEqual(DSP.objects.filter(dsr_id__territory__code_2='NO').count(), 1000)
+
+    @override_settings(DSRS_JOBS_ASYNC=False)
+    def test_ingestion_job_endpoint_reports_progress(self):
+        job = jobs.submit_ingestion_job(['Spotify_SpotifyDuo_NO_NOK_20200101-20200131.tsv.gz'])
+        response = self.client.get(f'/dsrs/jobs/{job.pk}/', HTTP_ACCEPT='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'finished')
+        self.assertEqual((response.json()['rows_parsed'], response.json()['rows_inserted']), (1000, 1000))
+        self.assertGreater(response.json()['throughput'], 0)
+
+    @override_settings(DSRS_JOBS_ASYNC=False)
+    def test_ingestion_job_registers_its_files(self):
+        job = jobs.submit_ingestion_job(['Spotify_SpotifyDuo_NO_NOK_20200101-20200131.tsv.gz', 'Spotify_SpotifyDuo_XX_NOK_20200101-20200131.tsv.gz'])
+        dsr = DSR.objects.get(territory__code_2='NO')
+
+        self.assertEqual(job.status, 'finished')
+        self.assertEqual(job.files, [[dsr.pk, 'Spotify_SpotifyDuo_NO_NOK_20200101-20200131.tsv.gz'], [None, 'Spotify_SpotifyDuo_XX_NOK_20200101-20200131.tsv.gz']])
+        self.assertEqual(dsr.status, 'ingested')
+
+    @override_settings(DSRS_JOBS_STALE_SECONDS=600)
+    def test_ingestion_jobs_interrupted_by_a_restart_are_failed_when_fetched(self):
+        stale  = timezone.now() - timedelta(seconds=601)
+        orphan = IngestionJob.objects.create(status='running', started_at=stale, heartbeat_at=stale)
+        alive  = IngestionJob.objects.create(status='running', started_at=stale, heartbeat_at=timezone.now())
+        local  = IngestionJob.objects.create(status='running', started_at=stale, heartbeat_at=stale)
+
+        with mock.patch.dict(jobs._live_progress, {local.pk: (0, 0)}):
+            response = self.client.get(f'/dsrs/jobs/{orphan.pk}/', HTTP_ACCEPT='application/json')
+
+        self.assertEqual(response.json()['status'], 'failed')
+        self.assertEqual({job.pk: job.status for job in IngestionJob.objects.all()}, {orphan.pk: 'failed', alive.pk: 'running', local.pk: 'running'})
+
+    @override_settings(DSRS_INGESTION_BATCH_SIZE=100, DSRS_INGESTION_CHECKPOINT_BATCHES=2)
+    def test_failed_ingestion_resumes_from_its_checkpoint(self):
+        file_name = 'Spotify_SpotifyDuo_NO_NOK_20200101-20200131.tsv.gz'
+
+        def failing_after_five_batches(batches):
+            yield from islice(batches, 5)
+            raise OSError('disk full')
+
+        with self.assertRaises(OSError):
+            ingestion.ingest_dsr_batches(self.dsr, failing_after_five_batches(iter_dsr_records(file_name, batch_size=100)))
+
+        # The first two groups of two batches were committed, the third one was rolled back
+        self.dsr.refresh_from_db()
+        self.assertEqual(self.dsr.checkpoint_rows, 400)
+        self.assertEqual(DSP.objects.filter(dsr_id=self.dsr).count(), 400)
+        self.assertEqual(self.client.get('/resources/percentile/100/').json(), [])
+
+        stats = ingestion.ingest_dsr_files([(self.dsr, file_name)], workers=1)
+
+        self.dsr.refresh_from_db()
+        self.assertEqual((stats[0].rows, self.dsr.checkpoint_rows), (600, 0))
+        self.assertEqual(DSP.objects.filter(dsr_id=self.dsr).count(), 1000)
+
+        # The committed rows are read back to complete the summary, and SQLite stores decimals as floating point
+        total_revenue = sum(r.revenue for r in iter_dsr_records(file_name))
+        self.assertAlmostEqual(float(DSRSummary.objects.get(dsr=self.dsr).total_revenue), float(total_revenue), delta=float(total_revenue) * 1e-12)
+        self.assertEqual(DSRSummary.objects.get(dsr=self.dsr).row_count, 1000)
+
+    @override_settings(DSRS_INGESTION_BATCH_SIZE=100, DSRS_INGESTION_CHECKPOINT_BATCHES=2, DSRS_INGESTION_STALE_SECONDS=600, DSRS_JOBS_ASYNC=False)
+    def test_ingestion_left_ingesting_by_a_crash_resumes_when_uploaded_again(self):
+        file_name  = 'Spotify_SpotifyDuo_NO_NOK_20200101-20200131.tsv.gz'
+        dsr        = ingestion.register_dsr_file(file_name)
+
+        def crashing_after_five_batches(batches):
+            yield from islice(batches, 5)
+            raise SystemExit()
+
+        # The process dies after committing two groups, and the DSR is left 'ingesting'
+        DSR.objects.filter(pk=dsr.pk).update(status='ingesting')
+        with self.assertRaises(SystemExit):
+            ingestion.ingest_dsr_batches(dsr, crashing_after_five_batches(iter_dsr_records(file_name, batch_size=100)))
+
+        self.assertEqual(DSR.objects.get(pk=dsr.pk).checkpoint_rows, 400)
+
+        # Still ingesting, as far as anyone can tell
+        self.assertIsNone(ingestion.register_dsr_file(file_name))
+
+        DSR.objects.filter(pk=dsr.pk).update(updated_at=timezone.now() - timedelta(seconds=601))
+        self.client.post('/resources/upload-dsrs/', {'dsr_files': SimpleUploadedFile(file_name, b'dsr')})
+
+        dsr.refresh_from_db()
+        self.assertEqual(IngestionJob.objects.get().status, 'finished')
+        self.assertEqual((dsr.status, dsr.checkpoint_rows), ('ingested', 0))
+        self.assertEqual(IngestionJob.objects.get().rows_inserted, 600)
+        self.assertEqual(DSP.objects.filter(dsr_id=dsr).count(), 1000)
+
+    def test_register_dsr_file_recognizes_files_by_their_content(self):
+        file_name  = 'Spotify_SpotifyDuo_NO_NOK_20200101-20200131.tsv.gz'
+        dsr        = ingestion.register_dsr_file(file_name)
+
+        self.assertEqual((dsr.status, dsr.territory.code_2, len(dsr.content_hash)), ('pending', 'NO', 64))
+        self.assertIsNone(ingestion.register_dsr_file(file_name))
+
+        DSR.objects.filter(pk=dsr.pk).update(status='failed')
+        self.assertEqual(ingestion.register_dsr_file(file_name), dsr)
+
+
+class ReplaceTests(TestCase):
+
+    def setUp(self):
+        use_temporary_revenue_index_dir(self)
+        refdata.clear()
+        caches['results'].clear()
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.file_name = os.path.join(directory.name, 'Spotify_SpotifyDuo_ES_EUR_20200101-20200131.tsv')
+
+        self.dsr = self._upload([('a', 5), ('b', 3), ('c', 2)])
+        ingestion.ingest_dsr_files([(self.dsr, self.file_name)], workers=1)
+        self.dsr.refresh_from_db()
+
+    def _upload(self, rows):
+        with open(self.file_name, 'w') as fh:
+            fh.write('dsp_id\ttitle\tartists\tisrc\tusages\trevenue\n')
+            fh.writelines(f'{dsp_id}\tt\tx\tI\t1\t{revenue}\n' for dsp_id, revenue in rows)
+
+        return ingestion.register_dsr_file(self.file_name)
+
+    def _dsp_ids(self):
+        return sorted(DSP.objects.filter(dsr_id=self.dsr).values_list('dsp_id', flat=True))
+
+    def test_new_file_of_an_ingested_dsr_replaces_its_dsps(self):
+        self.assertEqual(len(self.client.get('/resources/percentile/100/').json()), 3)
+        old_hash = self.dsr.content_hash
+
+        self.assertEqual(self._upload([('d', 7), ('e', 1)]), self.dsr)
+        stats = ingestion.ingest_dsr_files([(self.dsr, self.file_name)], workers=1)
+        self.dsr.refresh_from_db()
+
+        self.assertEqual(stats[0].rows, 2)
+        self.assertEqual(self._dsp_ids(), ['d', 'e'])
+        self.assertEqual(self.dsr.status, 'ingested')
+        self.assertNotEqual(self.dsr.content_hash, old_hash)
+        self.assertEqual(DSRSummary.objects.get(dsr=self.dsr).row_count, 2)
+        self.assertFalse(DSPStaging.objects.exists())
+        self.assertEqual([r['fields']['dsp_id'] for r in self.client.get('/resources/percentile/100/').json()], ['d', 'e'])
+
+        # The same file again is recognized by its content
+        self.assertIsNone(ingestion.register_dsr_file(self.file_name))
+
+    def test_failed_replacement_leaves_the_dsr_as_it_was(self):
+        def failing_after_one_batch(batches):
+            yield from islice(batches, 1)
+            raise OSError('disk full')
+
+        with self.assertRaises(OSError):
+            ingestion.replace_dsr_batches(self.dsr, failing_after_one_batch(iter_dsr_records('Spotify_SpotifyDuo_NO_NOK_20200101-20200131.tsv.gz', batch_size=100)))
+
+        self.dsr.refresh_from_db()
+        self.assertEqual(self._dsp_ids(), ['a', 'b', 'c'])
+        self.assertEqual(self.dsr.status, 'ingested')
+        self.assertFalse(DSPStaging.objects.exists())
+
+    def test_delete_dsrs_deletes_their_dsps_in_bulk(self):
+        self.client.get('/resources/percentile/100/')
+        self.assertTrue(revenue_index._path(self.dsr.pk).exists())
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(ingestion.delete_dsrs(DSR.objects.filter(pk=self.dsr.pk)), 1)
+
+        self.assertEqual(len([q for q in queries if q['sql'].startswith('DELETE FROM "dsp" ')]), 1)
+
+        self.assertFalse(DSR.objects.exists())
+        self.assertFalse(DSP.objects.exists())
+        self.assertFalse(revenue_index._path(self.dsr.pk).exists())
+
+
+class ParserTests(TestCase):
+
+    file_name = 'Spotify_SpotifyFree_CH_CHF_20200201-20200228.tsv.gz'
+
+    def test_iter_dsr_records_is_lazy_and_skips_the_header(self):
+        records = iter_dsr_records(self.file_name)
+        self.assertIsInstance(records, types.GeneratorType)
+
+        first = next(records)
+        self.assertNotEqual(first.dsp_id, 'dsp_id')
+        self.assertEqual(1 + sum(1 for _ in records), 1000)
+
+    def test_iter_dsr_records_yields_bounded_batches(self):
+        batch_sizes = [len(batch) for batch in iter_dsr_records(self.file_name, batch_size=300)]
+        self.assertEqual(batch_sizes, [300, 300, 300, 100])
+
+    def test_iter_dsr_records_types_usages_and_revenue(self):
+        record = next(iter_dsr_records(self.file_name))
+        self.assertIsInstance(record.usages, int)
+        self.assertIsInstance(record.revenue, Decimal)
+
+    def test_dsr_batch_keeps_columns(self):
+        batch = DsrBatch.from_records([DsrRecord('a', 'title', 'artist', 'ISRC', 2, Decimal('1.5')), DsrRecord('b', 'title', 'artist', 'ISRC')])
+
+        self.assertEqual(len(batch), 2)
+        self.assertEqual((list(batch.usages), batch.revenues), ([2, 0], [Decimal('1.5'), Decimal(0)]))
+        self.assertIs(batch.artists[0], batch.artists[1])
+        self.assertEqual(list(batch)[0].revenue, Decimal('1.5'))
+
+    def test_column_batches_match_the_line_by_line_parser_with_and_without_numpy(self):
+        records = list(iter_dsr_records(self.file_name))
+
+        for numpy in {utils.numpy, None}:
+            with mock.patch.object(utils, 'numpy', numpy):
+                self.assertEqual([r for batch in iter_dsr_records(self.file_name, batch_size=77) for r in batch], records)
+                self.assertEqual([r for batch in iter_dsr_records(self.file_name, batch_size=77, skip=10) for r in batch], records[10:])
+
+    def test_usages_out_of_range_are_rejected_with_and_without_numpy(self):
+        for numpy in {utils.numpy, None}:
+            with mock.patch.object(utils, 'numpy', numpy):
+                self.assertEqual(list(utils._usages_column(['18446744073709551615', '', '+3'])), [2 ** 64 - 1, 0, 3])
+
+                for value, error in (('18446744073709551616', OverflowError), ('-1', OverflowError), ('1.5', ValueError), ('1 2', ValueError)):
+                    with self.assertRaises(error):
+                        utils._usages_column(['1', value])
+
+    def test_column_batches_fall_back_to_lines_with_missing_values(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.tsv') as fh:
+            fh.write('dsp_id\ttitle\tartists\tisrc\tusages\trevenue\na\tt\tx\tI\t3\t1.5\nb\tt\tx\tI\n')
+            fh.flush()
+            batch = next(iter_dsr_records(fh.name, batch_size=10))
+
+        self.assertEqual(list(batch), [DsrRecord('a', 't', 'x', 'I', 3, Decimal('1.5')), DsrRecord('b', 't', 'x', 'I', 0, Decimal(0))])
+
+    def test_iter_dsr_records_rejects_unknown_extensions(self):
+        with self.assertRaises(KeyError):
+            iter_dsr_records('Spotify_SpotifyFree_CH_CHF_20200201-20200228.csv')
+
+
+class RatesTests(TestCase):
+
+    def setUp(self):
+        self.rates_file = tempfile.NamedTemporaryFile('w', suffix='.json')
+        json.dump({'NOK': 0.1, 'GBP': '1.15'}, self.rates_file)
+        self.rates_file.flush()
+
+        self.settings_override = override_settings(DSRS_RATE_PROVIDER='dsrs.rates.FileRateProvider', DSRS_RATES_FILE=self.rates_file.name)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.rates_file.close()
+
+    def test_get_conversion_factors_uses_the_provider_once_and_stores_the_rates(self):
+        with mock.patch.object(rates.FileRateProvider, 'fetch', wraps=rates.get_provider().fetch) as fetch:
+            first   = rates.get_conversion_factors(['NOK', 'GBP', 'EUR'])
+            second  = rates.get_conversion_factors(['NOK', 'GBP'])
+
+        self.assertEqual(first, {'EUR': 1, 'NOK': Decimal('0.1'), 'GBP': Decimal('1.15')})
+        self.assertEqual(second, first)
+        self.assertEqual(fetch.call_count, 1)
+        self.assertEqual(ExchangeRate.objects.count(), 2)
+
+    def test_get_conversion_factors_reads_stored_rates_before_asking_the_provider(self):
+        ExchangeRate.objects.create(currency='CHF', date=date(2020, 2, 28), rate=Decimal('0.9'))
+
+        self.assertEqual(rates.get_conversion_factors(['CHF'], date(2020, 2, 28))['CHF'], Decimal('0.9'))
+
+    def test_get_conversion_factors_leaves_unknown_currencies_out(self):
+        self.assertNotIn('USD', rates.get_conversion_factors(['USD']))
+
+    def test_get_conversion_factors_does_not_ask_again_for_unknown_currencies_for_a_while(self):
+        with mock.patch.object(rates.FileRateProvider, 'fetch', side_effect=OSError('timed out')) as fetch:
+            for _ in range(3):
+                self.assertEqual(rates.get_conversion_factors(['USD']), {'EUR': 1})
+
+            self.assertEqual(fetch.call_count, 1)
+
+            with override_settings(DSRS_RATES_NEGATIVE_TTL=0):
+                rates.get_conversion_factors(['USD'])
+                rates.get_conversion_factors(['USD'])
+
+            self.assertEqual(fetch.call_count, 3)
+
+    def test_rate_providers_must_implement_fetch(self):
+        with self.assertRaises(TypeError):
+            rates.RateProvider()
+
+    def test_currconv_provider_asks_for_every_pair_in_one_call(self):
+        response = mock.Mock(**{'json.return_value': {'NOK_EUR': {'2020-01-31': 0.095}, 'GBP_EUR': {'2020-01-31': 1.18}}})
+
+        with mock.patch('dsrs.rates.requests.get', return_value=response) as get:
+            fetched = rates.CurrConvProvider(api_key='key').fetch(['GBP', 'NOK'], date(2020, 1, 31))
+
+        self.assertEqual(get.call_count, 1)
+        self.assertEqual(get.call_args.kwargs['params']['q'], 'GBP_EUR,NOK_EUR')
+        self.assertEqual(fetched, {'NOK': Decimal('0.095'), 'GBP': Decimal('1.18')})
+
+
+@override_settings(DSRS_RATE_PROVIDER='dsrs.rates.FileRateProvider')
+class PercentileTests(TestCase):
+
+    def setUp(self):
+        use_temporary_revenue_index_dir(self)
+        euro     = Currency.objects.create(name='Euro', symbol='978', code='EUR')
+        krone    = Currency.objects.create(name='Norwegian Krone', symbol='578', code='NOK')
+        spain    = Territory.objects.create(name='Spain', code_2='ES', code_3='ESP', local_currency=euro)
+        norway   = Territory.objects.create(name='Norway', code_2='NO', code_3='NOR', local_currency=krone)
+        es_dsr   = DSR.objects.create(path='es', period_start='2020-01-01', period_end='2020-01-31', territory=spain, currency=euro)
+        no_dsr   = DSR.objects.create(path='no', period_start='2020-01-01', period_end='2020-01-31', territory=norway, currency=krone)
+
+        # Revenue in EUR: 50, 30 (300 NOK), 10, 10 (100 NOK)
+        ExchangeRate.objects.create(currency='NOK', date=date.today(), rate=Decimal('0.1'))
+        ingestion.ingest_dsr_records(es_dsr, [DsrRecord('a', 't', 'x', 'I', 1, Decimal(50)), DsrRecord('c', 't', 'x', 'I', 1, Decimal(10))])
+        ingestion.ingest_dsr_records(no_dsr, [DsrRecord('b', 't', 'x', 'I', 1, Decimal(300)), DsrRecord('d', 't', 'x', 'I', 1, Decimal(100))])
+        self.no_dsr = no_dsr
+        caches['results'].clear()
+
+    def test_percentile_returns_the_records_making_up_the_revenue(self):
+        response = self.client.get('/resources/percentile/40/', HTTP_ACCEPT='application/json')
+        self.assertEqual([r['fields']['dsp_id'] for r in response.json()], ['a'])
+
+        response = self.client.get('/resources/percentile/60/', HTTP_ACCEPT='application/json')
+        self.assertEqual([r['fields']['dsp_id'] for r in response.json()], ['a', 'b'])
+
+        response = self.client.get('/resources/percentile/100/', {'territory': 'NO'}, HTTP_ACCEPT='application/json')
+        self.assertEqual([r['fields']['dsp_id'] for r in response.json()], ['b', 'd'])
+
+    def test_percentile_with_or_without_indexes_or_window_functions_returns_the_same_records(self):
+        for percentile in (1, 40, 50, 60, 90, 100):
+            with_index = self.client.get(f'/resources/percentile/{percentile}/').json()
+
+            with override_settings(DSRS_REVENUE_INDEX=False):
+                caches['results'].clear()
+                with_window = self.client.get(f'/resources/percentile/{percentile}/').json()
+
+                caches['results'].clear()
+                with mock.patch.object(connection.features, 'supports_over_clause', False):
+                    in_python = self.client.get(f'/resources/percentile/{percentile}/').json()
+
+            caches['results'].clear()
+            self.assertEqual(with_index, with_window)
+            self.assertEqual(with_window, in_python)
+
+    def test_whole_percentile_of_sample_revenues_returns_every_record_on_every_path(self):
+        pound  = Currency.objects.create(name='Pound Sterling', symbol='826', code='GBP')
+        uk     = Territory.objects.create(name='United Kingdom', code_2='GB', code_3='GBR', local_currency=pound)
+        dsr    = DSR.objects.create(path='gb', period_start='2020-03-01', period_end='2020-03-31', territory=uk, currency=pound)
+        ExchangeRate.objects.create(currency='GBP', date=date.today(), rate=Decimal('1.1'))
+
+        # Revenues of up to 1e14, adding up to about 5e16: more digits than a float holds
+        ingestion.ingest_dsr_files([(dsr, 'Spotify_SpotifyStudent_GB_GBP_20200301-20200331.tsv.gz')], workers=1)
+
+        for settings_override, over_clause in (({}, True), ({'DSRS_REVENUE_INDEX': False}, True), ({'DSRS_REVENUE_INDEX': False}, False)):
+            caches['results'].clear()
+            with override_settings(**settings_override), mock.patch.object(connection.features, 'supports_over_clause', over_clause):
+                response = self.client.get('/resources/percentile/100/', {'currency': 'GBP'})
+
+            self.assertEqual(len(response.json()), 1000)
+
+    def test_whole_percentile_of_several_currencies_with_zero_revenues_is_the_same_on_every_path(self):
+        franc   = Currency.objects.create(name='Swiss Franc', symbol='756', code='CHF')
+        swiss   = Territory.objects.create(name='Switzerland', code_2='CH', code_3='CHE', local_currency=franc)
+        euro    = Currency.objects.get(code='EUR')
+        spain   = Territory.objects.get(code_2='ES')
+        ExchangeRate.objects.filter(currency='NOK').update(rate=Decimal('0.095'))
+        ExchangeRate.objects.create(currency='CHF', date=date.today(), rate=Decimal('0.92'))
+
+        dsrs = [DSR.objects.create(path=f'mixed-{code}', period_start='2020-04-01', period_end='2020-04-30', territory=territory, currency=currency)
+                for code, territory, currency in (('ES', spain, euro), ('NO', self.no_dsr.territory, self.no_dsr.currency), ('CH', swiss, franc))]
+
+        # The first 250 rows of three sample files (revenues of up to 1e14), and 50 rows without revenue each
+        for dsr, file_name in zip(dsrs, ('Spotify_SpotifyFamilyPlan_ES_EUR_20200101-20200131.tsv.gz', 'Spotify_SpotifyDuo_NO_NOK_20200101-20200131.tsv.gz',
+                                         'Spotify_SpotifyFree_CH_CHF_20200201-20200228.tsv.gz')):
+            zeros = [DsrRecord(f'{dsr.path}-{i}', 't', 'x', 'I', 1, Decimal(0)) for i in range(50)]
+            ingestion.ingest_dsr_records(dsr, list(islice(iter_dsr_records(file_name), 250)) + zeros)
+
+        paths = self._percentile_on_every_path(100, {'period_start': '2020-04-01'})
+        self.assertEqual(len(paths['python']), 900)
+        self.assertEqual(paths['window'], paths['python'])
+        self.assertEqual(paths['index'], paths['python'])
+
+    def test_whole_percentile_does_not_depend_on_the_order_revenues_are_added_in(self):
+        euro      = Currency.objects.get(code='EUR')
+        portugal  = Territory.objects.create(name='Portugal', code_2='PT', code_3='PRT', local_currency=euro)
+        dsr       = DSR.objects.create(path='order', period_start='2020-05-01', period_end='2020-05-31', territory=portugal, currency=euro)
+
+        # In floats, 3.5 + 3.5 + 3.5 + 10000000000000040 is 10000000000000050, but 10000000000000040 + 3.5 + 3.5 + 3.5
+        # (the order of the percentile) is 10000000000000052: 1.00000000000000E+16 and 1.00000000000001E+16 once
+        # rounded to the 15 digits SQLite sums are read with
+        revenues = [Decimal('3.5')] * 3 + [Decimal('10000000000000040')] + [Decimal(0)] * 2
+        ingestion.ingest_dsr_records(dsr, [DsrRecord(f'o{i}', 't', 'x', 'I', 1, revenue) for i, revenue in enumerate(revenues)])
+
+        paths = self._percentile_on_every_path(100, {'territory': 'PT'})
+        self.assertEqual(len(paths['python']), 6)
+        self.assertEqual(paths['window'], paths['python'])
+        self.assertEqual(paths['index'], paths['python'])
+
+    def _percentile_on_every_path(self, percentile, params):
+        paths = dict()
+        for name, settings_override, over_clause in (('index', {}, True), ('window', {'DSRS_REVENUE_INDEX': False}, True), ('python', {'DSRS_REVENUE_INDEX': False}, False)):
+            caches['results'].clear()
+            with override_settings(**settings_override), mock.patch.object(connection.features, 'supports_over_clause', over_clause):
+                paths[name] = [r['pk'] for r in self.client.get(f'/resources/percentile/{percentile}/', params).json()]
+
+        return paths
+
+    def test_revenue_index_cutoff_takes_ties_while_the_target_is_not_exceeded(self):
+        ties_dsr = DSR.objects.create(path='ties', period_start='2020-02-01', period_end='2020-02-29', territory=self.no_dsr.territory, currency=self.no_dsr.currency)
+        ingestion.ingest_dsr_records(ties_dsr, [DsrRecord(f't{i}', 't', 'x', 'I', 1, Decimal(100)) for i in range(4)] + [DsrRecord('z', 't', 'x', 'I', 1, Decimal(0))])
+
+        # 10 EUR each: 35% of 40 EUR is 14, so the second one is taken (10 before it) but not the third (20 before it)
+        with revenue_index.open_indexes([ties_dsr.pk]) as indexes:
+            self.assertEqual(revenue_index.percentile_cutoff(indexes, 35), (10.0, 2))
+            self.assertEqual(revenue_index.percentile_cutoff(indexes, 100), (0.0, 5))
+
+        response = self.client.get('/resources/percentile/35/', {'period_start': '2020-02-01'})
+        self.assertEqual([r['fields']['dsp_id'] for r in response.json()], ['t0', 't1'])
+
+    def test_revenue_index_cutoff_over_many_dsrs_matches_a_plain_scan(self):
+        euro, spain, revenues = Currency.objects.get(code='EUR'), Territory.objects.get(code_2='ES'), list()
+        for i in range(12):
+            dsr = DSR.objects.create(path=f'many{i}', period_start='2020-03-01', period_end='2020-03-31', territory=spain, currency=euro)
+            dsr_revenues = [randint(0, 20) for _ in range(randint(0, 15))]
+            ingestion.ingest_dsr_records(dsr, [DsrRecord(f'm{i}-{j}', 't', 'x', 'I', 1, Decimal(r)) for j, r in enumerate(dsr_revenues)])
+            revenues.extend(dsr_revenues)
+
+        revenues.sort(reverse=True)
+        dsr_pks = DSR.objects.filter(path__startswith='many').values_list('pk', flat=True)
+
+        with revenue_index.open_indexes(list(dsr_pks)) as indexes:
+            for percentile in (1, 10, 33, 50, 75, 99, 100):
+                target, before, expected = percentile / 100 * sum(revenues), 0, (None, 0)
+                for position, revenue in enumerate(revenues):
+                    if before > target:
+                        break
+
+                    expected, before = (float(revenue), position + 1), before + revenue
+
+                self.assertEqual(revenue_index.percentile_cutoff(indexes, percentile), expected)
+
+    def test_percentile_rebuilds_revenue_indexes_left_by_a_replacement(self):
+        batches = [DsrBatch.from_records([DsrRecord('f', 't', 'x', 'I', 1, Decimal(400)), DsrRecord('g', 't', 'x', 'I', 1, Decimal(5))])]
+        with mock.patch.object(revenue_index, 'build', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                ingestion.replace_dsr_batches(self.no_dsr, batches, content_hash='new')
+
+        # The index left has as many rows as the new DSPs, but not their revenues (30 and 10 EUR instead of 40 and 0.5)
+        response = self.client.get('/resources/percentile/100/', {'territory': 'NO'})
+        self.assertEqual([r['fields']['dsp_id'] for r in response.json()], ['f', 'g'])
+
+    def test_percentile_rebuilds_missing_revenue_indexes(self):
+        revenue_index.delete(self.no_dsr.pk)
+
+        response = self.client.get('/resources/percentile/100/', {'territory': 'NO'})
+        self.assertEqual([r['fields']['dsp_id'] for r in response.json()], ['b', 'd'])
+
+    def test_ingestion_stores_the_revenue_in_eur_and_the_dsr_summary(self):
+        self.assertEqual(DSP.objects.get(dsp_id='b').revenue_eur, Decimal(30))
+
+        summary = DSRSummary.objects.get(dsr=self.no_dsr)
+        self.assertEqual((summary.row_count, summary.total_usages, summary.total_revenue_eur), (2, 2, Decimal(40)))
+        self.assertEqual(summary.revenue_histogram, {'1': 2})
+
+    def test_percentile_summarizes_dsrs_ingested_without_a_rate(self):
+        DSRSummary.objects.filter(dsr=self.no_dsr).delete()
+        DSP.objects.filter(dsr_id=self.no_dsr).update(revenue_eur=None, exchange_rate=None)
+
+        response = self.client.get('/resources/percentile/100/', {'territory': 'NO'}, HTTP_ACCEPT='application/json')
+
+        self.assertEqual([r['fields']['dsp_id'] for r in response.json()], ['b', 'd'])
+        self.assertEqual(DSRSummary.objects.get(dsr=self.no_dsr).total_revenue_eur, Decimal(40))
+
+    def test_percentile_with_no_records_returns_an_empty_list(self):
+        response = self.client.get('/resources/percentile/50/', {'territory': 'GB'}, HTTP_ACCEPT='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [])
+
+    def test_percentile_results_are_cached_until_the_dsps_change(self):
+        first = self.client.get('/resources/percentile/60/', {'territory': 'NO'}).json()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/resources/percentile/60/', {'territory': 'NO'}).json(), first)
+
+        ingestion.ingest_dsr_records(self.no_dsr, [DsrRecord('e', 't', 'x', 'I', 1, Decimal(1000))])
+        self.assertEqual([r['fields']['dsp_id'] for r in self.client.get('/resources/percentile/60/', {'territory': 'NO'}).json()], ['e'])
+
+    def test_percentile_streams_json_and_ndjson(self):
+        response = self.client.get('/resources/percentile/60/', {'stream': 'json'})
+        records  = json.loads(b''.join(response.streaming_content))
+        self.assertEqual([r['dsp_id'] for r in records], ['a', 'b'])
+        self.assertEqual(set(records[1]), {'id', 'dsp_id', 'title', 'artists', 'isrc', 'usages', 'revenue', 'revenue_eur', 'dsr_id'})
+
+        response = self.client.get('/resources/percentile/60/', {'stream': 'ndjson'})
+        lines    = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual([json.loads(line)['dsp_id'] for line in lines], ['a', 'b'])
+
+        with mock.patch.object(connection.features, 'supports_over_clause', False):
+            response = self.client.get('/resources/percentile/60/', {'stream': 'json'})
+            self.assertEqual(json.loads(b''.join(response.streaming_content)), records)
+
+        response = self.client.get('/resources/percentile/60/', {'stream': 'json', 'territory': 'GB'})
+        self.assertEqual(json.loads(b''.join(response.streaming_content)), [])
+
+        response = self.client.get('/resources/percentile/60/', {'stream': 'xml'})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(DSRS_RATE_PROVIDER='dsrs.rates.FileRateProvider')
+class RollupTests(TestCase):
+
+    def setUp(self):
+        use_temporary_revenue_index_dir(self)
+        euro    = Currency.objects.create(name='Euro', symbol='978', code='EUR')
+        krone   = Currency.objects.create(name='Norwegian Krone', symbol='578', code='NOK')
+        spain   = Territory.objects.create(name='Spain', code_2='ES', code_3='ESP', local_currency=euro)
+        norway  = Territory.objects.create(name='Norway', code_2='NO', code_3='NOR', local_currency=krone)
+        es_dsr  = DSR.objects.create(path='es', period_start='2020-01-01', period_end='2020-01-31', territory=spain, currency=euro)
+        no_dsr  = DSR.objects.create(path='no', period_start='2020-02-01', period_end='2020-02-29', territory=norway, currency=krone)
+
+        # Revenue in EUR: I1 50 + 30 (300 NOK), I2 10, I3 10 (100 NOK)
+        ExchangeRate.objects.create(currency='NOK', date=date.today(), rate=Decimal('0.1'))
+        ingestion.ingest_dsr_records(es_dsr, [DsrRecord('a', 't', 'x', 'I1', 1, Decimal(50)), DsrRecord('c', 't', 'y', 'I2', 2, Decimal(10))])
+        ingestion.ingest_dsr_records(no_dsr, [DsrRecord('b', 't', 'x', 'I1', 4, Decimal(300)), DsrRecord('d', 't', 'y', 'I3', 8, Decimal(100))])
+        caches['results'].clear()
+
+    def _rollup(self, dimension, **params):
+        response = self.client.get(f'/resources/rollups/{dimension}/', params)
+        self.assertEqual(response.status_code, 200)
+        return [{**row, 'revenue_eur': round(Decimal(row['revenue_eur']), 6)} for row in response.json()]
+
+    def test_rollups_add_up_revenue_and_usages_by_dimension(self):
+        self.assertEqual(self._rollup('isrc'), [
+            {'isrc': 'I1', 'revenue_eur': Decimal(80), 'usages': 5, 'dsps': 2},
+            {'isrc': 'I2', 'revenue_eur': Decimal(10), 'usages': 2, 'dsps': 1},
+            {'isrc': 'I3', 'revenue_eur': Decimal(10), 'usages': 8, 'dsps': 1},
+        ])
+        self.assertEqual(self._rollup('artist', limit='1'), [{'artists': 'x', 'revenue_eur': Decimal(80), 'usages': 5, 'dsps': 2}])
+        self.assertEqual(self._rollup('territory', currency='NOK'), [{'territory': 'NO', 'revenue_eur': Decimal(40), 'usages': 12, 'dsps': 2}])
+        self.assertEqual(self._rollup('period'), [
+            {'period_start': '2020-01-01', 'period_end': '2020-01-31', 'revenue_eur': Decimal(60), 'usages': 3, 'dsps': 2},
+            {'period_start': '2020-02-01', 'period_end': '2020-02-29', 'revenue_eur': Decimal(40), 'usages': 12, 'dsps': 2},
+        ])
+
+    def test_rollups_are_cached_until_the_dsps_change(self):
+        self._rollup('isrc')
+        with self.assertNumQueries(0):
+            self._rollup('isrc')
+
+        dsr = DSR.objects.get(path='es')
+        ingestion.ingest_dsr_records(dsr, [DsrRecord('e', 't', 'z', 'I4', 1, Decimal(1000))])
+        self.assertEqual(self._rollup('isrc', limit='1'), [{'isrc': 'I4', 'revenue_eur': Decimal(1000), 'usages': 1, 'dsps': 1}])
+
+    def test_rollups_leave_out_blank_keys_and_render_large_revenues_in_full(self):
+        dsr = DSR.objects.get(path='es')
+        ingestion.ingest_dsr_records(dsr, [DsrRecord('e', 't', '', '', 1, Decimal('51229572728981312.5'))])
+
+        self.assertEqual([row['isrc'] for row in self._rollup('isrc')], ['I1', 'I2', 'I3'])
+        self.assertEqual([row['artists'] for row in self._rollup('artist')], ['x', 'y'])
+
+        for dimension in ('territory', 'period'):
+            revenue = self.client.get(f'/resources/rollups/{dimension}/').json()[0]['revenue_eur']
+            self.assertRegex(revenue, r'^51229572728981\d{3}\.\d{19}$')
+
+    def test_rollups_reject_unknown_dimensions_and_limits(self):
+        self.assertEqual(self.client.get('/resources/rollups/title/').status_code, 400)
+        self.assertEqual(self.client.get('/resources/rollups/isrc/', {'limit': '0'}).status_code, 400)
+        self.assertEqual(self.client.get('/resources/rollups/isrc/', {'limit': 'ten'}).status_code, 400)
+        self.assertEqual(self.client.get('/resources/rollups/isrc/', {'territory': 'XX'}).status_code, 400)
+
+
+class TopTests(TestCase):
+
+    def setUp(self):
+        use_temporary_revenue_index_dir(self)
+        euro   = Currency.objects.create(name='Euro', symbol='978', code='EUR')
+        spain  = Territory.objects.create(name='Spain', code_2='ES', code_3='ESP', local_currency=euro)
+        dsr    = DSR.objects.create(path='es', period_start='2020-01-01', period_end='2020-01-31', territory=spain, currency=euro)
+
+        # 60 DSPs over 20 ISRCs and 7 artists, with plenty of ties
+        ingestion.ingest_dsr_records(dsr, [DsrRecord(f'dsp{i}', 't', f'artist{i % 7}', f'I{i % 20:02}', i, Decimal(i % 9)) for i in range(60)])
+        caches['results'].clear()
+
+    def test_top_dsps_are_the_highest_revenues(self):
+        records = self.client.get('/resources/top/3/').json()
+        self.assertEqual([r['fields']['dsp_id'] for r in records], ['dsp8', 'dsp17', 'dsp26'])
+
+    def test_top_isrcs_and_artists_match_the_rollups(self):
+        for by, dimension in (('isrc', 'isrc'), ('artist', 'artist')):
+            for k in (1, 5, 30):
+                top      = self.client.get(f'/resources/top/{k}/', {'by': by}).json()
+                rollups  = self.client.get(f'/resources/rollups/{dimension}/', {'limit': k}).json()
+
+                self.assertEqual([{**row, 'revenue_eur': Decimal(row['revenue_eur'])} for row in top],
+                                 [{**row, 'revenue_eur': Decimal(row['revenue_eur'])} for row in rollups])
+
+    def test_top_isrcs_and_artists_leave_out_blank_ones(self):
+        ingestion.ingest_dsr_records(DSR.objects.get(path='es'), [DsrRecord('blank', 't', '', '', 1, Decimal(1000))])
+
+        for by, key in (('isrc', 'isrc'), ('artist', 'artists')):
+            top = self.client.get('/resources/top/1/', {'by': by}).json()
+            self.assertNotEqual(top[0][key], '')
+            self.assertEqual(top, self.client.get(f'/resources/rollups/{by}/', {'limit': 1}).json())
+
+    def test_top_rejects_unknown_rankings_and_k(self):
+        self.assertEqual(self.client.get('/resources/top/0/').status_code, 400)
+        self.assertEqual(self.client.get('/resources/top/3/', {'by': 'title'}).status_code, 400)
+
+
+class PartitionTests(TestCase):
+
+    def setUp(self):
+        use_temporary_revenue_index_dir(self)
+        euro   = Currency.objects.create(name='Euro', symbol='978', code='EUR')
+        spain  = Territory.objects.create(name='Spain', code_2='ES', code_3='ESP', local_currency=euro)
+
+        for month in (1, 2, 3):
+            dsr = DSR.objects.create(path=f'es{month}', period_start=f'2020-{month:02}-01', period_end=f'2020-{month:02}-28', territory=spain, currency=euro)
+            ingestion.ingest_dsr_records(dsr, [DsrRecord(f'{month}-{i}', 't', 'x', 'I', 1, Decimal(i)) for i in range(4)])
+
+        caches['results'].clear()
+
+    def test_dsps_keep_the_period_of_their_dsr(self):
+        self.assertFalse(DSP.objects.exclude(period_start=F('dsr_id__period_start')).exists())
+        self.assertEqual(partitions.partition_name(date(2020, 2, 14)), 'dsp_202002')
+        self.assertEqual(partitions.next_month(date(2020, 12, 31)), date(2021, 1, 1))
+
+    def test_period_filters_apply_to_the_dsps_themselves(self):
+        dsr_filter, _ = views._get_dsr_filter({'period_start': '2020-02-01', 'period_end': '2020-02-28'})
+        dsp_filter    = views._dsp_filter(dsr_filter)
+
+        self.assertEqual((dsp_filter['period_start__gte'], dsp_filter['period_start__lte']), ('2020-02-01', '2020-02-28'))
+        self.assertEqual(set(DSP.objects.filter(**dsp_filter).values_list('dsr_id__path', flat=True)), {'es2'})
+
+        records = self.client.get('/resources/percentile/100/', {'period_start': '2020-02-01', 'period_end': '2020-02-28'}).json()
+        self.assertEqual({r['fields']['dsp_id'] for r in records}, {f'2-{i}' for i in range(4)})
+
+    def test_drop_periods_deletes_old_dsrs_with_their_dsps_and_indexes(self):
+        old = DSR.objects.get(path='es1')
+        self.client.get('/resources/percentile/100/')
+        self.assertTrue(revenue_index._path(old.pk).exists())
+
+        out = io.StringIO()
+        call_command('drop_periods', '2020-02-01', '--dry-run', stdout=out)
+        self.assertIn('1 DSR(s) would be deleted', out.getvalue())
+        self.assertEqual(DSR.objects.count(), 3)
+
+        call_command('drop_periods', '2020-02-01', stdout=io.StringIO())
+        self.assertEqual(sorted(DSR.objects.values_list('path', flat=True)), ['es2', 'es3'])
+        self.assertEqual(DSP.objects.count(), 8)
+        self.assertFalse(DSRSummary.objects.filter(dsr=old.pk).exists())
+        self.assertFalse(revenue_index._path(old.pk).exists())
+        self.assertEqual(len(self.client.get('/resources/percentile/100/').json()), 8)
+
+        with self.assertRaises(CommandError):
+            call_command('drop_periods', '2020/02/01')
+
+
+class DspApiTests(TestCase):
+
+    def setUp(self):
+        use_temporary_revenue_index_dir(self)
+        euro     = Currency.objects.create(name='Euro', symbol='978', code='EUR')
+        spain    = Territory.objects.create(name='Spain', code_2='ES', code_3='ESP', local_currency=euro)
+        dsr      = DSR.objects.create(path='es', period_start='2020-01-01', period_end='2020-01-31', territory=spain, currency=euro)
+        ingestion.ingest_dsr_records(dsr, [DsrRecord(f'dsp{i}', 't', 'x', 'I', i, Decimal(i)) for i in range(5)])
+
+    @override_settings(DSRS_PAGE_SIZE=2)
+    def test_dsps_are_listed_in_pages_with_a_constant_number_of_queries(self):
+        dsp_ids, url = list(), '/dsps/'
+        while url:
+            # One query for the DSPs of the page, and one for their DSRs
+            with self.assertNumQueries(2):
+                page = self.client.get(url, HTTP_ACCEPT='application/json').json()
+
+            self.assertLessEqual(len(page['results']), 2)
+            self.assertEqual(page['results'][0]['dsr_id']['territory']['code_2'], 'ES')
+            dsp_ids += [dsp['dsp_id'] for dsp in page['results']]
+            url = page['next']
+
+        self.assertEqual(dsp_ids, [f'dsp{i}' for i in range(5)])
+
+    def test_fields_limits_the_output(self):
+        page = self.client.get('/dsps/', {'fields': 'dsp_id,usages'}, HTTP_ACCEPT='application/json').json()
+        self.assertEqual(page['results'][1], {'dsp_id': 'dsp1', 'usages': 1})
+
+        dsr = self.client.get('/dsrs/', {'fields': 'id,status'}, HTTP_ACCEPT='application/json').json()
+        self.assertEqual(set(dsr[0]), {'id', 'status'})
+
+        response = self.client.get('/dsps/', {'fields': 'dsp_id,password'}, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_values_serializers_output_the_same_as_the_drf_ones(self):
+        dsps = DSP.objects.order_by('id')
+        self.assertEqual(serializers.DSPValuesSerializer().serialize(dsps.values(*serializers.DSPValuesSerializer().values_fields)),
+                         serializers.DSPSerializer(dsps, many=True).data)
+
+        fast = self.client.get('/dsrs/', HTTP_ACCEPT='application/json').json()
+        with mock.patch.object(views.DSRViewSet, 'values_serializer_class', None):
+            self.assertEqual(self.client.get('/dsrs/', HTTP_ACCEPT='application/json').json(), fast)
+
+
+class RefdataTests(TestCase):
+
+    def setUp(self):
+        # Creating the rows drops whatever an earlier (rolled back) test left in the cache
+        self.euro   = Currency.objects.create(name='Euro', symbol='978', code='EUR')
+        self.spain  = Territory.objects.create(name='Spain', code_2='ES', code_3='ESP', local_currency=self.euro)
+
+    def test_known_codes_cost_no_query_once_loaded(self):
+        self.assertEqual(refdata.get_territory('ES', 'EUR'), self.spain)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(refdata.get_currency('EUR'), self.euro)
+            self.assertEqual(refdata.get_territory('ES', 'EUR'), self.spain)
+
+    def test_unknown_codes_are_created_once(self):
+        norway = refdata.get_territory('NO', 'NOK')
+
+        self.assertEqual((norway.name, norway.code_3, norway.local_currency.code), ('Norway', 'NOR', 'NOK'))
+        self.assertEqual(refdata.get_territory('NO', 'NOK'), norway)
+        self.assertEqual(Currency.objects.filter(code='NOK').count(), 1)
+
+        with self.assertRaises(ValueError):
+            refdata.get_currency('ABC')
+
+    def test_edits_drop_the_cache(self):
+        refdata.get_currency('EUR')
+        Currency.objects.filter(pk=self.euro.pk).delete()
+        Currency.objects.create(name='Euro', symbol='978', code='EUR')
+
+        self.assertNotEqual(refdata.get_currency('EUR').pk, self.euro.pk)
+
+
+class InstrumentationTests(TestCase):
+
+    def setUp(self):
+        use_temporary_revenue_index_dir(self)
+        euro  = Currency.objects.create(name='Euro', symbol='978', code='EUR')
+        spain = Territory.objects.create(name='Spain', code_2='ES', code_3='ESP', local_currency=euro)
+        dsr   = DSR.objects.create(path='es', period_start='2020-01-01', period_end='2020-01-31', territory=spain, currency=euro)
+        ingestion.ingest_dsr_records(dsr, [DsrRecord('a', 't', 'x', 'I', 1, Decimal(50)), DsrRecord('b', 't', 'x', 'I', 1, Decimal(10))])
+
+        caches['results'].clear()
+        instrumentation.reset()
+        self.addCleanup(instrumentation.reset)
+
+    def test_responses_tell_their_queries_and_rows_in_server_timing(self):
+        response = self.client.get('/resources/percentile/100/')
+        timing   = dict(entry.split(';', 1) for entry in response['Server-Timing'].split(', '))
+
+        self.assertRegex(timing['db'], r'^dur=[0-9.]+;desc="[1-9][0-9]* queries"$')
+        self.assertEqual(timing['rows'], 'desc="2 rows"')
+        self.assertRegex(timing['total'], r'^dur=[0-9.]+$')
+
+    def test_collect_counts_queries_and_timed_blocks(self):
+        with instrumentation.collect() as metrics:
+            list(DSP.objects.all())
+            with instrumentation.timed():
+                pass
+
+        self.assertEqual((metrics.queries, metrics.http_calls), (1, 1))
+        self.assertIsNone(instrumentation.current())
+
+        # Outside of a request, nothing is measured
+        with instrumentation.timed():
+            instrumentation.add_rows(1)
+
+    def test_metrics_endpoint_adds_up_requests_by_view(self):
+        self.client.get('/resources/percentile/100/')
+        self.client.get('/resources/percentile/100/')
+        self.client.get('/dsrs/')
+
+        response  = self.client.get('/dsrs/metrics/')
+        lines     = response.content.decode().splitlines()
+
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertIn('dsrs_requests_total{view="dsrs:percentile"} 2', lines)
+        self.assertIn('dsrs_requests_total{view="dsr-list"} 1', lines)
+        self.assertIn('# TYPE dsrs_db_queries_total counter', lines)
+        self.assertIn('dsrs_rows_processed_total{view="dsr-list"} 1', lines)
+
+
+@override_settings(DSRS_RATE_PROVIDER='dsrs.rates.FileRateProvider')
+class LoadDsrsCommandTests(TestCase):
+
+    def setUp(self):
+        use_temporary_revenue_index_dir(self)
+        refdata.clear()
+
+    def test_load_dsrs_loads_a_directory_once(self):
+        out = io.StringIO()
+        call_command('load_dsrs', str(utils.DATA_DIR), '--workers', '2', stdout=out)
+
+        self.assertEqual(DSR.objects.filter(status='ingested').count(), 4)
+        self.assertEqual(DSP.objects.count(), 4000)
+        self.assertIn('Loaded 4 file(s), 4000 rows', out.getvalue())
+
+        out = io.StringIO()
+        call_command('load_dsrs', str(utils.DATA_DIR / '*_NO_*.tsv.gz'), stdout=out)
+        self.assertIn('skipped, already loaded', out.getvalue())
+        self.assertEqual(DSP.objects.count(), 4000)
+
+    def test_dry_run_loads_nothing(self):
+        out = io.StringIO()
+        call_command('load_dsrs', str(utils.DATA_DIR), '--dry-run', stdout=out)
+
+        self.assertEqual(out.getvalue().count(': new'), 4)
+        self.assertFalse(DSR.objects.exists())
+
+    def test_no_files_is_an_error(self):
+        with self.assertRaises(CommandError):
+            call_command('load_dsrs', '/nonexistent/*.tsv.gz')
+
+
+class ExportTests(TestCase):
+
+    def setUp(self):
+        use_temporary_revenue_index_dir(self)
+        euro    = Currency.objects.create(name='Euro', symbol='978', code='EUR')
+        krone   = Currency.objects.create(name='Norwegian Krone', symbol='578', code='NOK')
+        spain   = Territory.objects.create(name='Spain', code_2='ES', code_3='ESP', local_currency=euro)
+        norway  = Territory.objects.create(name='Norway', code_2='NO', code_3='NOR', local_currency=krone)
+        es_dsr  = DSR.objects.create(path='es', period_start='2020-01-01', period_end='2020-01-31', territory=spain, currency=euro)
+        no_dsr  = DSR.objects.create(path='no', period_start='2020-02-01', period_end='2020-02-29', territory=norway, currency=krone)
+
+        ExchangeRate.objects.create(currency='NOK', date=date.today(), rate=Decimal('0.1'))
+        ingestion.ingest_dsr_records(es_dsr, [DsrRecord(f'es{i}', 't', 'x', 'I', i, Decimal(i) / 4) for i in range(5)])
+        ingestion.ingest_dsr_records(no_dsr, [DsrRecord(f'no{i}', 't', 'x', 'I', i, Decimal(i)) for i in range(3)])
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    @unittest.skipUnless(export.is_available(), 'pyarrow is not installed')
+    def test_export_command_writes_the_filtered_dsps_into_a_parquet_file(self):
+        import pyarrow.parquet
+
+        path  = os.path.join(self.directory.name, 'es.parquet')
+        out   = io.StringIO()
+        call_command('export_dsps', path, '--territory', 'ES', '--batch-size', '2', stdout=out)
+
+        parquet_file  = pyarrow.parquet.ParquetFile(path)
+        table         = parquet_file.read()
+
+        self.assertIn('Exported 5 DSPs', out.getvalue())
+        self.assertEqual(parquet_file.num_row_groups, 3)
+        self.assertEqual(table.column('dsp_id').to_pylist(), [f'es{i}' for i in range(5)])
+        self.assertEqual(table.column('revenue_eur').to_pylist(), [Decimal(i) / 4 for i in range(5)])
+        self.assertEqual(set(table.column('territory').to_pylist()), {'ES'})
+        self.assertEqual(set(table.column('period_start').to_pylist()), {date(2020, 1, 1)})
+
+    @unittest.skipUnless(export.is_available(), 'pyarrow is not installed')
+    @override_settings(DSRS_EXPORT_BATCH_SIZE=2)
+    def test_export_endpoint_streams_an_arrow_file(self):
+        import pyarrow.ipc
+
+        response = self.client.get('/resources/export/', {'format': 'arrow', 'currency': 'NOK'})
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="dsps.arrow"')
+
+        reader = pyarrow.ipc.open_file(pyarrow.BufferReader(b''.join(response.streaming_content)))
+        table  = reader.read_all()
+
+        self.assertEqual(reader.num_record_batches, 2)
+        self.assertEqual(table.column('revenue_eur').to_pylist(), [Decimal(0), Decimal('0.1'), Decimal('0.2')])
+
+        self.assertEqual(self.client.get('/resources/export/', {'format': 'csv'}).status_code, 400)
+        self.assertEqual(self.client.get('/resources/export/', {'territory': 'XX'}).status_code, 400)
+
+    @unittest.skipUnless(export.is_available(), 'pyarrow is not installed')
+    def test_export_keeps_revenues_with_every_digit_of_their_field(self):
+        import pyarrow.parquet
+
+        dsr = DSR.objects.get(path='es')
+        ingestion.ingest_dsr_records(dsr, [DsrRecord('large', 't', 'x', 'I', 1, Decimal('123456789012345678901.5'))])
+
+        path = os.path.join(self.directory.name, 'large.parquet')
+        export.export_dsps({'dsp_id': 'large'}, path)
+
+        self.assertEqual(pyarrow.parquet.read_table(path).column('revenue').to_pylist(), [DSP.objects.get(dsp_id='large').revenue])
+
+    def test_export_without_pyarrow_is_reported(self):
+        with mock.patch.object(export, 'pyarrow', None):
+            self.assertEqual(self.client.get('/resources/export/').status_code, 501)
+
+            with self.assertRaises(CommandError):
+                call_command('export_dsps', os.path.join(self.directory.name, 'dsps.parquet'))
@@ -6,10 +6,16 @@ app_name = "dsrs"
 
 '''FROM CARLOS: This list contains the handler to manage the 'resources/percentile' request.
 It also contains a handler to manage a request to 'resources/upload-dsrs', which presents the 
-user a form to select the data that the user would want to store into the DB.'''
+user a form to select the data that the user would want to store into the DB, one to manage 'resources/rollups',
+which aggregates the revenue and usages by ISRC, artist, territory or period, one to manage 'resources/top', which
+ranks DSPs, ISRCs or artists by revenue, and one to manage 'resources/export',
+which downloads DSPs as a columnar file.'''
 
 urlpatterns = [
     path('upload-dsrs/',                        views.UploadDsrFilesForm.as_view(), name='upload-dsrs'),
     path('upload-dsrs/success/',                views.success,                      name='success'),
     path('percentile/<int:percentile_value>/',  views.percentile,                   name='percentile'),
+    path('rollups/<str:dimension>/',            views.rollup,                       name='rollup'),
+    path('top/<int:k>/',                        views.top,                          name='top'),
+    path('export/',                             views.export_dsps,                  name='export'),
 ]
\ No newline at end of file
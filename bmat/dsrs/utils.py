@@ -1,31 +1,86 @@
-import ast
 import gzip
-import requests
-from collections  import namedtuple
+import hashlib
+import sys
+from array        import array
+from collections  import deque, namedtuple
 from datetime     import datetime
+from decimal      import Decimal
+from itertools    import chain, islice
 from pathlib      import Path
 
+try:
+    import numpy
+
+except ImportError:
+    # numpy is optional. Without it, the columnar parser converts the numeric columns in pure Python
+    numpy = None
+
 DATA_DIR = Path(__file__).parent.parent.absolute() / 'data'
 
 
-class DsrRecord:
-    '''FROM CARLOS: This class represents a DSR's file row.
-    
-    The only particularity is that usages and revenue have been set as keyword arguments. This is because DSR files can
-    contain an empty value for these fields. In order to feed something correct to the database, these fields are initialized
-    by default to their 'null' values, 0 and 0.0, respectively. 
+# A namedtuple collection representing a DSR's file row.
+#
+# A namedtuple has no per-instance __dict__, which matters when files have millions of rows. usages and revenue are
+# typed (int and Decimal) by the parser, and default to their 'null' values, since DSR files can contain an empty value
+# for these fields.
+dsr_record_fields  = ('dsp_id', 'title', 'artists', 'isrc', 'usages', 'revenue')
+DsrRecord          = namedtuple('DsrRecord', dsr_record_fields, defaults=(0, Decimal(0)))
+
+
+class DsrBatch:
+    '''Columnar representation of a group of consecutive DSR rows.
+
+    Each field is kept in its own column: usages in an array of unsigned integers, revenue as Decimal objects (no
+    loss of precision) and artists/isrc strings interned, since the same values repeat a lot across rows. The
+    ingestion code consumes the columns directly (see ingestion._batch_rows), without creating one object per record.
     '''
 
-    def __init__(self, dsp_id, title, artists, isrc, usages=0, revenue=0.0):
-        self.dsp_id   = dsp_id
-        self.title    = title
-        self.artists  = artists
-        self.isrc     = isrc
-        self.usages   = usages 
-        self.revenue  = revenue
+    __slots__ = ('dsp_ids', 'titles', 'artists', 'isrcs', 'usages', 'revenues')
+
+    def __init__(self):
+        self.dsp_ids   = list()
+        self.titles    = list()
+        self.artists   = list()
+        self.isrcs     = list()
+        self.usages    = array('Q')
+        self.revenues  = list()
+
+    @classmethod
+    def from_records(cls, records):
+        batch = cls()
+        for record in records:
+            batch.append(record)
+
+        return batch
+
+    @classmethod
+    def from_columns(cls, dsp_ids, titles, artists, isrcs, usages, revenues):
+        '''Builds a batch from already converted columns (usages must be an array('Q'))'''
+        batch           = cls()
+        batch.dsp_ids   = dsp_ids
+        batch.titles    = titles
+        batch.artists   = list(map(sys.intern, artists))
+        batch.isrcs     = list(map(sys.intern, isrcs))
+        batch.usages    = usages
+        batch.revenues  = revenues
+        return batch
+
+    def append(self, record):
+        self.dsp_ids.append(record.dsp_id)
+        self.titles.append(record.title)
+        self.artists.append(sys.intern(record.artists))
+        self.isrcs.append(sys.intern(record.isrc))
+        self.usages.append(int(record.usages or 0))
+        self.revenues.append(Decimal(record.revenue or 0))
+
+    def __len__(self):
+        return len(self.dsp_ids)
+
+    def __iter__(self):
+        return map(DsrRecord, self.dsp_ids, self.titles, self.artists, self.isrcs, self.usages, self.revenues)
 
     def __repr__(self):
-        return f'<DsrRecord(dsp_id={self.dsp_id}, title={self.title}, artists={self.artists}, isrc={self.isrc}, usages={self.usages}, revenue={self.revenue})>'
+        return f'<DsrBatch(rows={len(self)})>'
 
 '''FROM CARLOS: A namedtuple collection to store the DSR file metadata'''
 dsr_meta_fields    = ('path', 'territory', 'currency', 'period_start', 'period_end')
@@ -37,65 +92,168 @@ def _reformat_date(date):
     dobj = datetime.strptime(date, '%Y%m%d')
     return datetime.strftime(dobj, '%Y-%m-%d')
 
-def _handle_gzip_file(file_name):
-    '''FROM CARLOS: Handles compressed files'''
-    with gzip.open(file_name, 'r') as fh:
-        return _handle_tsv_file_with_handler(fh, file_name, compressed=True)
+def _open_gzip_file(file_name):
+    '''Opens compressed files, decompressing and decoding them on the fly'''
+    return gzip.open(file_name, 'rt', encoding='utf-8')
 
-def _handle_tsv_file(file_name):
-    '''FROM CARLOS: Handles uncompressed files'''
-    with open(file_name) as fh:
-        return _handle_tsv_file_with_handler(fh, file_name)
+def _open_tsv_file(file_name):
+    '''Opens uncompressed files'''
+    return open(file_name, encoding='utf-8')
 
-def _handle_tsv_file_with_handler(fh, file_name, compressed=False):
-    '''FROM CARLOS: Shared code between compressed/uncompressed files'''
-    dsr_records = dict()
 
-    _, _, territory, currency, rest = file_name.name.split('_')
+'''FROM CARLOS: "kind-of-factory" implemented with a dictionary'''
+_file_handlers = {
+    '.gz' : _open_gzip_file,
+    '.tsv' : _open_tsv_file
+}
+
+
+def _get_file_handler(file_path):
+    '''Returns the function able to open a file, based on its extension'''
+    try:
+        return _file_handlers[file_path.suffix]
+
+    except KeyError:
+        raise KeyError(f'Cannot handle files of extension {file_path.suffix}')
+
+def parse_dsr_meta(file_name):
+    '''Extracts the DSR metadata (territory, currency and period) from the file name'''
+    file_path = Path(DATA_DIR) / file_name
+
+    _, _, territory, currency, rest = file_path.name.split('_')
     period_start, period_end_dirty = rest.split('-')
     period_end = period_end_dirty.split('.')[0]
 
     ps = _reformat_date(period_start)
     pe = _reformat_date(period_end)
 
-    dsr_meta_data = DsrMetaData(file_name.parents[0], territory, currency, ps, pe)
-    dsr_records['meta'] = dsr_meta_data
-    dsr_records['data'] = list()
+    return DsrMetaData(file_path.parents[0], territory, currency, ps, pe)
 
-    for line in fh.readlines():
-        decoded_line = line if not compressed else line.decode()
-        if 'dsp_id' in decoded_line:
-            continue
+def _parse_line(line):
+    '''Builds a typed DsrRecord from a file line. Missing or empty usages/revenue become 0'''
+    dsp_id, title, artists, isrc, *numbers = line.rstrip('\r\n').split('\t')
+    usages, revenue = (numbers + ['', ''])[:2]
 
-        dsr_record = DsrRecord(*decoded_line.strip().split('\t'))
-        dsr_records['data'].append(dsr_record)
+    return DsrRecord(dsp_id, title, artists, isrc, int(usages) if usages else 0, Decimal(revenue) if revenue else Decimal(0))
 
-    return dsr_records
+def _iter_records(opener, file_path, skip=0):
+    '''Reads the file line by line, so that only one line is held in memory at a time. The first skip
+    records are read but not parsed'''
+    with opener(file_path) as fh:
+        lines = (line for line in fh if not line.startswith('dsp_id'))
+        for line in islice(lines, skip, None):
+            yield _parse_line(line)
 
+def _usages_column(values):
+    '''Converts a column of usages, where empty values are 0, into an array('Q'). numpy, if available,
+    parses the whole column in one call'''
+    usages = array('Q')
 
-'''FROM CARLOS: "kind-of-factory" implemented with a dictionary'''
-_file_handlers = {
-    '.gz' : _handle_gzip_file,
-    '.tsv' : _handle_tsv_file
-}
+    if numpy is not None:
+        try:
+            usages.frombytes(numpy.loadtxt([value or '0' for value in values], dtype=numpy.uint64, delimiter='\t', comments=None, ndmin=1).tobytes())
+            return usages
 
+        except ValueError:
+            # numpy rejects values out of range too, but with another error: they are converted again below, so that
+            # the same values fail the same way with or without numpy
+            pass
 
-def parse_dsr_file(file_name):
-    '''FROM CARLOS: Returns a record list from the parsed .tsv files'''
-    file_path = Path(file_name)
+    usages.extend([int(value) if value else 0 for value in values])
+    return usages
+
+def _revenues_column(values):
+    '''Converts a column of revenues, where empty values are 0, into Decimal objects. There is no
+    vectorized equivalent: floating point numbers would lose precision'''
+    zero = Decimal(0)
+    return [Decimal(value) if value else zero for value in values]
+
+def _batch_from_lines(lines):
+    '''Parses a list of lines into a DsrBatch, column by column
+
+    All the lines are joined and split at once, and every column is then a slice of the resulting list. If any line
+    does not have exactly one value per column, the lines are parsed one by one instead (see _parse_line).
+    '''
+    columns  = len(dsr_record_fields)
+    text     = ''.join(lines)
+    fields   = (text if text.endswith('\n') else text + '\n').replace('\n', '\t').split('\t')
+
+    if len(fields) != columns * len(lines) + 1:
+        return DsrBatch.from_records(map(_parse_line, lines))
+
+    dsp_ids, titles, artists, isrcs, usages, revenues = (fields[i:-1:columns] for i in range(columns))
+    return DsrBatch.from_columns(dsp_ids, titles, artists, isrcs, _usages_column(usages), _revenues_column(revenues))
+
+def _iter_column_batches(opener, file_path, batch_size, skip=0):
+    '''Columnar version of _iter_records, yielding DsrBatch objects of batch_size lines
+
+    Lines are read batch_size at a time, and the header is only looked for in the first one. Each group of lines is
+    split and converted column by column (see _batch_from_lines), rather than line by line.
+    '''
+    with opener(file_path) as fh:
+        first  = fh.readline()
+        lines  = fh if first.startswith('dsp_id') or not first else chain([first], fh)
+        deque(islice(lines, skip), maxlen=0)
+
+        while True:
+            chunk = list(islice(lines, batch_size))
+            if not chunk:
+                return
 
+            yield _batch_from_lines(chunk)
+
+def batched(iterable, batch_size):
+    '''Groups the elements of iterable in lists of at most batch_size elements'''
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+
+        yield batch
+
+def iter_dsr_records(file_name, batch_size=None, skip=0):
+    '''Lazily parses a compressed/uncompressed DSR file
+
+    Returns a generator yielding DsrRecord objects one by one or, if batch_size is given, DsrBatch objects of at
+    most batch_size records, parsed column by column (see _iter_column_batches). Nothing is read until the generator
+    is consumed, and memory use does not depend on the size of the file. An unknown extension raises a KeyError
+    straight away. The first skip records are left out (used to resume an ingestion).
+    '''
+    file_path  = Path(DATA_DIR) / file_name
+    opener     = _get_file_handler(file_path)
+
+    if batch_size:
+        return _iter_column_batches(opener, file_path, batch_size, skip)
+
+    return _iter_records(opener, file_path, skip)
+
+def parse_into_queue(file_name, batch_size, skip, queue):
+    '''Runs in a worker process (see ingestion.ingest_dsr_files). Parses a file, but its first skip
+    records, and puts its batches in queue, followed by None once the file is exhausted. Errors are sent through the
+    queue too, so that the writer can report them. It lives here, away from the Django apps, so that the worker only
+    has to import this module'''
     try:
-        record_list = _file_handlers[file_path.suffix](Path(DATA_DIR) / file_name)
+        for batch in iter_dsr_records(file_name, batch_size=batch_size, skip=skip):
+            queue.put(batch)
 
-    except KeyError:
-        raise KeyError(f'Cannot handle files of extension {file_path.suffix}')
+    except Exception as e:
+        queue.put(e)
 
     else:
-        return record_list
+        queue.put(None)
+
+def parse_dsr_file(file_name):
+    '''Returns the metadata and a lazy record iterator (see iter_dsr_records) of a .tsv(.gz) file'''
+    data = iter_dsr_records(file_name)
+    return {'meta': parse_dsr_meta(file_name), 'data': data}
 
+def file_sha256(file_name, chunk_size=1 << 20):
+    '''sha256 hex digest of a file as stored (i.e. of the compressed bytes of a .gz file), read in
+    chunks of chunk_size bytes'''
+    digest = hashlib.sha256()
+    with open(Path(DATA_DIR) / file_name, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b''):
+            digest.update(chunk)
 
-def get_conversion_factor(from_currency, to_currency):
-    '''FROM CARLOS: Gets the conversion rates for certain currencies'''
-    conversion_query_string = from_currency + '_' + to_currency
-    conversion = requests.get(f'https://free.currconv.com/api/v7/convert?q={conversion_query_string}&compact=ultra&apiKey=6cd9d6b95b3d077a16dc').text
-    return ast.literal_eval(conversion).get(conversion_query_string, 0)
+    return digest.hexdigest()
@@ -1,38 +1,117 @@
 from rest_framework             import viewsets
+from rest_framework.exceptions  import ValidationError
+from rest_framework.response    import Response
 
+from django.conf                import settings
 from django.core                import serializers as core_serializers
-from django.db                  import IntegrityError
-from django.db.models           import Case, DecimalField, F, Sum, When
-from django.http.response       import HttpResponse, HttpResponseBadRequest
+from django.db                  import connection
+from django.db.models           import Count, DecimalField, F, FloatField, RowRange, Sum, Window
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http.response       import HttpResponse, HttpResponseBadRequest, StreamingHttpResponse
 from django.views.generic       import TemplateView
 from django.views.generic.edit  import FormView
-from django.shortcuts           import render
+from django.shortcuts           import redirect, render
 
-from .                          import models, serializers, utils
+from .                          import caching, export, ingestion, instrumentation, jobs, models, revenue_index, serializers
 from .forms                     import SelectDsrsFileForm
+from .pagination                import PrimaryKeyCursorPagination
 
 import datetime
+import json
 import logging
+from collections import namedtuple
+from decimal import MAX_PREC, Context, Decimal
 
 import pycountry
 
 logger = logging.getLogger(__name__)
 
-class DSRViewSet(viewsets.ModelViewSet):
-    queryset = models.DSR.objects.all()
+class SparseFieldsetMixin:
+    '''Adds the ?fields=a,b,c option to a ViewSet, to read only some of its serializer fields
+
+    The serializer must accept a fields argument (see serializers.SparseFieldsMixin). Unknown fields are a bad
+    request. Writes always use all the fields.
+    '''
+
+    def get_requested_fields(self):
+        fields = self.request.query_params.get('fields')
+        if self.request.method != 'GET' or not fields:
+            return None
+
+        fields   = [name.strip() for name in fields.split(',') if name.strip()]
+        unknown  = set(fields) - set(self.get_serializer_class()().fields)
+        if unknown:
+            raise ValidationError({'fields': f'Unknown field(s): {", ".join(sorted(unknown))}'})
+
+        return fields
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault('fields', self.get_requested_fields())
+        return super().get_serializer(*args, **kwargs)
+
+class ValuesListMixin:
+    '''Lists a ViewSet with its values_serializer_class, a plain-dict serializer reading .values() rows
+    (see serializers.DSRValuesSerializer), instead of its DRF serializer. Setting it to None brings these back.
+    Only the list action is affected: single records, and writes, still go through the DRF serializer'''
+    values_serializer_class = None
+
+    def list(self, request, *args, **kwargs):
+        if self.values_serializer_class is None:
+            return super().list(request, *args, **kwargs)
+
+        serializer  = self.values_serializer_class(fields=self.get_requested_fields())
+        queryset    = self.filter_queryset(self.get_queryset()).values('id', *serializer.values_fields)
+
+        page  = self.paginate_queryset(queryset)
+        rows  = serializer.serialize(page if page is not None else queryset)
+        instrumentation.add_rows(len(rows))
+
+        return self.get_paginated_response(rows) if page is not None else Response(rows)
+
+class DSRViewSet(SparseFieldsetMixin, ValuesListMixin, viewsets.ModelViewSet):
+    queryset = models.DSR.objects.select_related('territory', 'currency')
     serializer_class = serializers.DSRSerializer
+    values_serializer_class = serializers.DSRValuesSerializer
 
-class DSPViewSet(viewsets.ModelViewSet):
-    queryset = models.DSP.objects.all()
+class DSPViewSet(SparseFieldsetMixin, ValuesListMixin, viewsets.ModelViewSet):
+    '''DSPs are listed in pages (see pagination.PrimaryKeyCursorPagination) by the plain-dict
+    serializer, which reads the DSRs of every page with one single extra query. Single DSPs are read with their DSR,
+    territory and currency in the same query. When ?fields= leaves the DSR out, only the requested columns are read'''
+    queryset = models.DSP.objects.select_related('dsr_id__territory', 'dsr_id__currency')
     serializer_class = serializers.DSPSerializer
+    values_serializer_class = serializers.DSPValuesSerializer
+    pagination_class = PrimaryKeyCursorPagination
+
+    def get_queryset(self):
+        queryset  = super().get_queryset()
+        fields    = self.get_requested_fields()
+
+        if fields is not None and 'dsr_id' not in fields:
+            queryset = queryset.select_related(None).only(*fields)
+
+        return queryset
+
+class IngestionJobViewSet(viewsets.ReadOnlyModelViewSet):
+    '''Exposes the progress of the background ingestion jobs under /dsrs/jobs/'''
+    queryset = models.IngestionJob.objects.all()
+    serializer_class = serializers.IngestionJobSerializer
+
+    def get_queryset(self):
+        jobs.fail_orphaned_jobs()
+        return super().get_queryset()
 
 class UploadDsrFilesForm(FormView):
     '''FROM CARLOS: This class is used to dump a form to select compressed/uncompressed DSR files to upload their data into the DB
 
     The class extends FormView and overwrites the get and post methods. The get method will be executed on the form's first load
     by the user. The post will be executed when the user submits the form. The form allows multiple .gz and or .tsv files to be 
-    uploaded at once. The function utils.parse_dsr_file parses each file and returns a dictionary containing its records.
-    I have used the dependency pycountry to get the missing data on the Territory and Currency models from the DSR file names.
+    uploaded at once. A background job is submitted, which creates a DSR row for each new file (see
+    ingestion.register_dsr_file), parses the files in parallel worker processes and writes their records in bulk into the DSP
+    table (committing every few batches, see ingestion.ingest_dsr_batches). The
+    user is redirected to /dsrs/jobs/<id>/ straight away, where the progress of the job can be followed.
+    I have used the dependency pycountry to get the missing data on the Territory and Currency models from the DSR file names
+    (see refdata, which caches both tables so that known codes cost no query). Files uploaded again are recognized by
+    their content, and skipped or, if their ingestion failed, resumed.
     
     Some static files (html and css) have also been added in their simplest forms, just to show that the form could be stylized
     as much as it is desired to'''
@@ -52,66 +131,10 @@ class UploadDsrFilesForm(FormView):
         files       = request.FILES.getlist('dsr_files')
 
         if form.is_valid():
-            for f in files:
-                dsr_records = utils.parse_dsr_file(f.name)
-
-                md = dsr_records['meta']
-
-                currency = pycountry.currencies.get(alpha_3=md.currency)
-
-                if not currency: 
-                    '''FROM CARLOS: This is just to show that some action could be taken in case the file names are wrong
-                    and the currency is not identified'''
-                    pass 
-
-                curr = models.Currency(name=currency.name, symbol=currency.numeric, code=md.currency)
-                try:
-                    curr.save()
-
-                except IntegrityError as e:
-                    '''FROM CARLOS: The Currency model implements a unique constraint to prevent the same currency to be inserted more than once. 
-                    The IntegrityError constraint, that could be triggered when trying to insert duplicated records in this table,
-                    is catched here and logged (among others). I decided not to re-raise the exception in this case not to prevent
-                    the file records to be inserted'''
-                    logger.error(str(e))
-
-                country = pycountry.countries.get(alpha_2=md.territory)
-                if not country: 
-                    '''FROM CARLOS: This is just to show that some action could be taken in case the file names are wrong
-                    and the country is not identified'''
-                    pass 
-
-                terr = models.Territory(name=country.name, code_2=md.territory, code_3=country.alpha_3, local_currency=curr)
-                try:
-                    terr.save()
-
-                except IntegrityError as e:
-                    '''FROM CARLOS: The Territory model implements a unique constraint to prevent the same territory to be inserted more than once. 
-                    The IntegrityError constraint, that could be triggered when trying to insert duplicated records in this table,
-                    is catched here and logged (among others). I decided not to re-raise the exception in this case not to prevent
-                    the file records to be inserted'''
-                    logger.error(str(e))
-
-                dsr_meta = models.DSR(path=md.path, period_start=md.period_start, period_end=md.period_end, status="INGESTED", territory=terr, currency=curr)
-                
-                try:
-                    dsr_meta.save()
-
-                except IntegrityError as e:
-                    '''FROM CARLOS: The DSR model implements a unique constraint to prevent the same DSR file meta data to be inserted more than once. 
-                    The IntegrityError constraint, that could be triggered when trying to insert duplicated records in this table,
-                    is catched here and logged (among others). I decided not to re-raise the exception in this case not to prevent
-                    the file records to be inserted'''
-                    logger.error(str(e))
-
-                data = dsr_records['data']
-                for record in data: 
-                    dsp = models.DSP(dsp_id=record.dsp_id, title=record.title, artists=record.artists, isrc=record.isrc, usages=record.usages, revenue=record.revenue, dsr_id=dsr_meta)
-                    dsp.save()
-
-
-            # Redirects to success URL
-            return self.form_valid(form)
+            job = jobs.submit_ingestion_job([f.name for f in files])
+
+            # Redirects to the job's progress
+            return redirect('ingestionjob-detail', pk=job.pk)
 
         else:
             return self.form_invalid(form)
@@ -154,28 +177,152 @@ def _validate_date(a_date):
 
     return msg
 
-def percentile(request, percentile_value):
-    '''FROM CARLOS: Implements the /dsrs/resources/<percentile> open API endpoint
+# DSPs sorted by revenue in EUR. The primary key breaks ties, so that the result is deterministic
+_percentile_ordering = (F('revenue_eur').desc(), F('pk').asc())
 
-    First, the request is validated, and a bad request returned if parameters are not correct. 
-    Correct parameters are added into a dictionary that is later on used to filter the QuerySet records from the DSP table. 
-    All different currencies from these records are retrieved, in order to get the respective conversion factors into EUR. 
-    The exchange rates and the revenue in EUR are calculated and added to the QuerySet, in order not to load this 
-    to memory. 
+def _with_running_revenue(qs_with_revenue_eur):
+    '''Sorts the records by revenue and annotates the running and total revenue with window functions'''
+    # Django casts decimal aggregates to NUMERIC on SQLite, which is not valid SQL in front of OVER. The sums are
+    # declared as floats, which skips the cast, and turned back into decimals by the window's output field. Floats
+    # add up differently in another order, so the total is summed over the same ordered frame as the running sum:
+    # the last running sum is then the total itself
+    running_sum = Sum('revenue_eur', output_field=FloatField())
+    return qs_with_revenue_eur.annotate(
+        running_revenue=Window(running_sum, order_by=list(_percentile_ordering), frame=RowRange(start=None, end=0), output_field=DecimalField()),
+        total_revenue=Window(running_sum, order_by=list(_percentile_ordering), frame=RowRange(start=None, end=None), output_field=DecimalField()),
+    ).order_by(*_percentile_ordering)
+
+# Relative error of the sums read back from SQLite, which are floats rounded to 15 significant digits
+_window_tolerance = Decimal('1e-14')
+
+# Fields of the DSPs sent by the streaming modes of /resources/percentile/
+_streamed_fields = ('id', 'dsp_id', 'title', 'artists', 'isrc', 'usages', 'revenue', 'revenue_eur', 'dsr_id')
+
+def _record_getter(fields):
+    '''Model instances are read by attribute, rows of a .values() queryset by key'''
+    return (lambda record, name: record[name]) if fields else getattr
 
-    Finally, the appropriate records are selected and returned in JSON format. 
+def _iter_percentile_with_window(qs_with_revenue_eur, percentile_value, fields=None):
+    '''Yields the records making up the top percentile_value % of the revenue, with one single query
+
+    The database computes, next to every record, the running sum of the revenue (window function over the records
+    sorted by revenue, descending) and the total revenue. A record belongs to the percentile when the revenue of the
+    records before it does not exceed the target, give or take the rounding of the sums (_window_tolerance). Since the records come sorted, iteration stops at the first one
+    that does not belong, and the rest of the table never leaves the database.
+
+    Records are model instances or, if fields is given, dictionaries with those fields only.
     '''
-    err_msg = ''
+    qs = _with_running_revenue(qs_with_revenue_eur)
+    if fields:
+        qs = qs.values(*fields, 'running_revenue', 'total_revenue')
+
+    get = _record_getter(fields)
+    for record in qs.iterator():
+        total   = get(record, 'total_revenue')
+        target  = Decimal(percentile_value) / 100 * total + total * _window_tolerance
+        if get(record, 'running_revenue') - get(record, 'revenue_eur') > target:
+            return
+
+        if fields:
+            del record['running_revenue'], record['total_revenue']
+
+        yield record
+
+def _iter_percentile_in_python(qs_with_revenue_eur, percentile_value, fields=None):
+    '''Same as _iter_percentile_with_window, for databases without window functions. The total is
+    added up here first, from the same revenues the running sum is then computed with while iterating the sorted
+    records, so that both use the same (exact) arithmetic. Aggregating the total in the database would not: SQLite
+    sums decimals as floats, and the last records of a 100 percentile would be left out'''
+    total = sum(qs_with_revenue_eur.values_list('revenue_eur', flat=True).iterator(), Decimal(0))
+
+    target = Decimal(percentile_value) / 100 * total
+    amount_so_far = 0
+
+    qs = qs_with_revenue_eur.order_by(*_percentile_ordering)
+    if fields:
+        qs = qs.values(*fields)
+
+    get = _record_getter(fields)
+    for record in qs.iterator():
+        if amount_so_far > target:
+            return
+
+        yield record
+        amount_so_far += get(record, 'revenue_eur')
+
+def _percentile_cutoff(dsr_filter, percentile_value):
+    '''Finds the cut-off (revenue, number of DSPs) of a percentile with the revenue indexes of the
+    selected DSRs (see revenue_index.percentile_cutoff), building the missing ones. Returns None if the indexes are
+    disabled (settings.DSRS_REVENUE_INDEX) or cannot be used'''
+    if not settings.DSRS_REVENUE_INDEX:
+        return None
+
+    dsrs = models.DSR.objects.filter(checkpoint_rows=0, summary__isnull=False, **dsr_filter).select_related('summary').only('pk', 'content_hash', 'summary__row_count', 'summary__total_revenue_eur')
+
+    try:
+        revenue_index.ensure(dsrs)
+        with revenue_index.open_indexes([dsr.pk for dsr in dsrs]) as indexes:
+            return revenue_index.percentile_cutoff(indexes, percentile_value) if indexes is not None else None
+
+    except OSError as e:
+        logger.warning(f'Revenue indexes not available, falling back to a scan: {e}')
+        return None
+
+def _iter_percentile_with_index(qs_with_revenue_eur, cutoff, fields=None):
+    '''Yields the records of a percentile whose cut-off is known (see _percentile_cutoff): the first n
+    records, all of them with a revenue of at least v, so that the database only reads those from its revenue index.
+    The lower bound is loosened a bit, since v went through double precision (records below v sort last anyway)'''
+    revenue, count = cutoff
+    if not count:
+        return iter(())
+
+    qs = qs_with_revenue_eur.filter(revenue_eur__gte=Decimal(revenue) * (1 - Decimal('1e-9'))).order_by(*_percentile_ordering)
+    if fields:
+        qs = qs.values(*fields)
+
+    return qs[:count].iterator()
+
+def _counted(records):
+    '''Yields the records, adding them to the rows processed by the current request'''
+    for record in records:
+        instrumentation.add_rows(1)
+        yield record
+
+def _stream_json(rows):
+    '''Encodes rows as a JSON array, one chunk per row'''
+    separator = '['
+    for row in rows:
+        yield separator + json.dumps(row, cls=DjangoJSONEncoder)
+        separator = ',\n'
+
+    yield '[]' if separator == '[' else ']'
+
+def _stream_ndjson(rows):
+    '''Encodes rows as newline delimited JSON, one row per line'''
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+
+
+# Streaming mode -> (encoder, content type)
+_stream_encoders = {
+    'json'   : (_stream_json, 'application/json'),
+    'ndjson' : (_stream_ndjson, 'application/x-ndjson'),
+}
 
-    if percentile_value < 1 or percentile_value > 100:
-        err_msg = f'Percentile value {percentile_value} is not allowed! Values should be within (1-100) range'
-        return HttpResponseBadRequest(err_msg)
+
+def _get_dsr_filter(params):
+    '''Validates the optional territory, currency, period_start and period_end parameters
+
+    Returns a dictionary of lookups on the DSR model built from the correct parameters, and an error message that is
+    empty if they are all correct. Every filter applies to whole DSRs: prefix the lookups with 'dsr_id__' to filter DSPs.
+    '''
+    err_msg = ''
 
     # Extract parameters from URL
-    territory     = request.GET.get('territory', '')
-    currency      = request.GET.get('currency', '')
-    period_start  = request.GET.get('period_start', '')
-    period_end    = request.GET.get('period_end', '')
+    territory     = params.get('territory', '')
+    currency      = params.get('currency', '')
+    period_start  = params.get('period_start', '')
+    period_end    = params.get('period_end', '')
 
     filter_dict = dict()
     
@@ -184,70 +331,266 @@ def percentile(request, percentile_value):
         err_msg = _validate_territory(territory)
 
         if err_msg: 
-            return HttpResponseBadRequest(err_msg)
+            return filter_dict, err_msg
 
-        filter_dict.update({'dsr_id__territory__code_2':territory})
+        filter_dict.update({'territory__code_2':territory})
 
     # Validate currency
     if currency:
         err_msg = _validate_currency(currency)
         if err_msg:
-            return HttpResponseBadRequest(err_msg)
+            return filter_dict, err_msg
 
-        filter_dict.update({'dsr_id__currency__code':currency})
+        filter_dict.update({'currency__code':currency})
 
     # Validate dates are in correct formats
     if period_start:
         err_msg = _validate_date(period_start)
 
         if err_msg:
-            return HttpResponseBadRequest(err_msg)
+            return filter_dict, err_msg
 
-        filter_dict.update({'dsr_id__period_start__gte':period_start})
+        filter_dict.update({'period_start__gte':period_start})
 
     if period_end:
         err_msg = _validate_date(period_end)
 
         if err_msg:
-            return HttpResponseBadRequest(err_msg)
+            return filter_dict, err_msg
 
-        filter_dict.update({'dsr_id__period_end__lte':period_end})    
+        filter_dict.update({'period_end__lte':period_end})    
 
-    # Make a copy of the filtered queryset
-    dsps_query_set     = models.DSP.objects.filter(**filter_dict).all()
-    unique_currencies  = dsps_query_set.values('dsr_id__currency__code').distinct().all()
-    
-    # Get the conversion factors we need
-    conversion_factors = dict()
-    conversion_factors.update({'EUR':1})
+    return filter_dict, err_msg
 
-    for unique_c in unique_currencies:
-        from_currency, to_currency = unique_c['dsr_id__currency__code'], 'EUR'
-        conversion_factors.update({from_currency : utils.get_conversion_factor(from_currency, to_currency)})
+def _dsp_filter(dsr_filter):
+    '''Turns lookups on the DSR model into lookups on the DSP model. The DSPs of DSRs whose ingestion
+    has not finished (see ingestion.ingest_dsr_batches) are left out
 
-    # Add exchange rate to queryset
-    whens = [When(dsr_id__currency__code=k, then=v) for k, v in conversion_factors.items()]
-    qs_with_exchange_rate = dsps_query_set.annotate(exchange_rate=Case(*whens, default=0, output_field=DecimalField()))
+    The period bounds are also applied to the period_start of the DSPs themselves (a DSR period cannot end before it
+    starts), so that only the partitions of the period are read (see partitions)'''
+    dsp_filter = {'dsr_id__checkpoint_rows': 0, **{f'dsr_id__{lookup}': value for lookup, value in dsr_filter.items()}}
 
-    # Add revenue in EUR
-    qs_with_revenue_eur = qs_with_exchange_rate.annotate(revenue_eur=F('revenue') * F('exchange_rate')).order_by('-revenue_eur')
+    if 'period_start__gte' in dsr_filter:
+        dsp_filter['period_start__gte'] = dsr_filter['period_start__gte']
 
-    # Calculate total revenue EUR
-    target_percentile = (percentile_value/100) * float(qs_with_revenue_eur.aggregate(Sum('revenue_eur'))['revenue_eur__sum'])
-    amount_so_far = 0
+    if 'period_end__lte' in dsr_filter:
+        dsp_filter['period_start__lte'] = dsr_filter['period_end__lte']
 
-    count = 0
-    for record in qs_with_revenue_eur:
-        if amount_so_far <= target_percentile:
-            count += 1
-            amount_so_far += float(record.revenue_eur)
+    return dsp_filter
 
-        else:
-            break
+def percentile(request, percentile_value):
+    '''FROM CARLOS: Implements the /dsrs/resources/<percentile> open API endpoint
+
+    First, the request is validated, and a bad request returned if parameters are not correct. 
+    Correct parameters are added into a dictionary that is later on used to filter the QuerySet records from the DSP table. 
+    The revenue in EUR of every DSP is computed at ingestion time and stored along with it. DSRs ingested without a
+    known exchange rate are completed first, once (see ingestion.summarize_dsrs).
+
+    Finally, the cut-off of the percentile is found in the revenue indexes of the DSRs (see revenue_index), without
+    reading any DSP, and the records above it are selected with an ORDER BY ... LIMIT query. Without indexes, the
+    records are selected in one single query using a window function to compute the running revenue in the database
+    (see _iter_percentile_with_window). They are returned in JSON format. With ?stream=json or
+    ?stream=ndjson, the records are streamed as they are read from the database instead, with their main fields only,
+    so that large percentiles are never held in memory. Non-streamed responses are cached (see caching) until the
+    DSPs change.
+    '''
+    err_msg = ''
+
+    if percentile_value < 1 or percentile_value > 100:
+        err_msg = f'Percentile value {percentile_value} is not allowed! Values should be within (1-100) range'
+        return HttpResponseBadRequest(err_msg)
+
+    dsr_filter, err_msg = _get_dsr_filter(request.GET)
+    if err_msg:
+        return HttpResponseBadRequest(err_msg)
+
+    stream = request.GET.get('stream', '')
+    if stream and stream not in _stream_encoders:
+        return HttpResponseBadRequest(f'Streaming mode {stream} not supported. Use one of: {", ".join(_stream_encoders)}')
+
+    def compute(fields=None):
+        ingestion.summarize_dsrs(models.DSR.objects.filter(**dsr_filter))
+
+        # DSPs whose currency has still no known rate are left out
+        qs_with_revenue_eur = models.DSP.objects.filter(revenue_eur__isnull=False, **_dsp_filter(dsr_filter))
+
+        # Select the records making up the percentile, straight away if the revenue indexes give the cut-off
+        cutoff = _percentile_cutoff(dsr_filter, percentile_value)
+        if cutoff is not None:
+            return _iter_percentile_with_index(qs_with_revenue_eur, cutoff, fields)
+
+        select = _iter_percentile_with_window if connection.features.supports_over_clause else _iter_percentile_in_python
+        return select(qs_with_revenue_eur, percentile_value, fields)
 
-    data = core_serializers.serialize('json', qs_with_revenue_eur[0:count])
+    if stream:
+        encode, content_type = _stream_encoders[stream]
+        return StreamingHttpResponse(encode(compute(_streamed_fields)), content_type=content_type)
+
+    data = caching.cached_result('percentile', {'percentile': percentile_value, **dsr_filter},
+                                 lambda: core_serializers.serialize('json', _counted(compute())))
+    return HttpResponse(data, content_type='application/json')
+
+def _summary_filter(dsr_filter):
+    '''Turns lookups on the DSR model into lookups on the DSRSummary model'''
+    return {f'dsr__{lookup}': value for lookup, value in dsr_filter.items()}
+
+Rollup = namedtuple('Rollup', ['queryset', 'group', 'totals'])
+
+# The dimensions of /resources/rollups/.
+#
+# queryset(dsr_filter) returns the rows to aggregate, group maps the keys of the output to the lookups the rows are
+# grouped by, and totals maps 'revenue_eur', 'usages' and 'dsps' to aggregates of these rows. ISRCs and artists are
+# grouped from the DSPs (those without one are left out, since they have nothing in common), while territories and
+# periods, which are attributes of whole DSRs, add up their summaries instead (see models.DSRSummary), so that no DSP
+# is read for them
+_rollups = {
+    'isrc'      : Rollup(lambda dsr_filter: models.DSP.objects.filter(revenue_eur__isnull=False, **_dsp_filter(dsr_filter)).exclude(isrc=''),
+                         {'isrc': 'isrc'},
+                         {'revenue_eur': Sum('revenue_eur'), 'usages': Sum('usages'), 'dsps': Count('id')}),
+    'artist'    : Rollup(lambda dsr_filter: models.DSP.objects.filter(revenue_eur__isnull=False, **_dsp_filter(dsr_filter)).exclude(artists=''),
+                         {'artists': 'artists'},
+                         {'revenue_eur': Sum('revenue_eur'), 'usages': Sum('usages'), 'dsps': Count('id')}),
+    'territory' : Rollup(lambda dsr_filter: models.DSRSummary.objects.filter(dsr__checkpoint_rows=0, **_summary_filter(dsr_filter)),
+                         {'territory': 'dsr__territory__code_2'},
+                         {'revenue_eur': Sum('total_revenue_eur'), 'usages': Sum('total_usages'), 'dsps': Sum('row_count')}),
+    'period'    : Rollup(lambda dsr_filter: models.DSRSummary.objects.filter(dsr__checkpoint_rows=0, **_summary_filter(dsr_filter)),
+                         {'period_start': 'dsr__period_start', 'period_end': 'dsr__period_end'},
+                         {'revenue_eur': Sum('total_revenue_eur'), 'usages': Sum('total_usages'), 'dsps': Sum('row_count')}),
+}
+
+def _get_limit(params):
+    '''Validates the optional limit parameter. Returns the limit (settings.DSRS_ROLLUP_LIMIT if it is
+    missing), and an error message that is empty if it is correct'''
+    limit = params.get('limit', '')
+    if not limit:
+        return settings.DSRS_ROLLUP_LIMIT, ''
+
+    if not limit.isdigit() or not 1 <= int(limit) <= settings.DSRS_ROLLUP_MAX_LIMIT:
+        return None, f'Limit {limit} is not allowed! Values should be within (1-{settings.DSRS_ROLLUP_MAX_LIMIT}) range'
+
+    return int(limit), ''
+
+# Decimal places of DSP.revenue_eur
+_revenue_eur_places = Decimal(1).scaleb(-models.DSP._meta.get_field('revenue_eur').decimal_places)
+
+def _as_revenue_eur(total):
+    '''A sum of revenues in EUR with the decimal places of DSP.revenue_eur, so that it is rendered the
+    same way whatever computed it: SQLite sums decimals as floats, which would be rendered as 5.12295727289813E+16.
+    Sums may have more digits than the field, hence the context'''
+    return total.quantize(_revenue_eur_places, context=Context(prec=MAX_PREC))
+
+def _compute_rollup(dimension, dsr_filter, limit):
+    '''Returns the limit groups of a dimension with the highest revenue in EUR, computed by the database
+    with one single GROUP BY query'''
+    rollup  = _rollups[dimension]
+    names   = {f'rollup_{name}': name for name in rollup.totals}
+    lookups = list(rollup.group.values())
+
+    rows = (rollup.queryset(dsr_filter)
+            .values(*lookups)
+            .annotate(**{alias: rollup.totals[name] for alias, name in names.items()})
+            .order_by('-rollup_revenue_eur', *lookups)[:limit])
+
+    result = [{**{key: row[lookup] for key, lookup in rollup.group.items()}, **{name: row[alias] for alias, name in names.items()}}
+              for row in rows]
+    for group in result:
+        group['revenue_eur'] = _as_revenue_eur(group['revenue_eur'])
+
+    instrumentation.add_rows(len(result))
+    return result
+
+def rollup(request, dimension):
+    '''Handles the /resources/rollups/{dimension}/ endpoint: total revenue in EUR, usages and number of DSPs
+    by ISRC, artist, territory or period (start and end of the DSRs), highest revenue first.
+
+    DSPs are selected with the same optional parameters as /resources/percentile/, and ?limit= caps the number of
+    groups returned. Results are cached (see caching) until the DSPs change.
+    '''
+    if dimension not in _rollups:
+        return HttpResponseBadRequest(f'Dimension {dimension} not supported. Use one of: {", ".join(_rollups)}')
+
+    dsr_filter, err_msg = _get_dsr_filter(request.GET)
+    if err_msg:
+        return HttpResponseBadRequest(err_msg)
+
+    limit, err_msg = _get_limit(request.GET)
+    if err_msg:
+        return HttpResponseBadRequest(err_msg)
+
+    def compute():
+        ingestion.summarize_dsrs(models.DSR.objects.filter(**dsr_filter))
+        return json.dumps(_compute_rollup(dimension, dsr_filter, limit), cls=DjangoJSONEncoder)
+
+    data = caching.cached_result(f'rollup-{dimension}', {'limit': limit, **dsr_filter}, compute)
+    return HttpResponse(data, content_type='application/json')
+
+def _top_dsps(dsr_filter, k):
+    '''The k DSPs with the highest revenue in EUR, read with an ORDER BY ... LIMIT query that walks the
+    revenue indexes of the DSP table (see models.DSP)'''
+    dsps     = models.DSP.objects.filter(revenue_eur__isnull=False, **_dsp_filter(dsr_filter))
+    records  = list(dsps.order_by(*_percentile_ordering)[:k])
+    instrumentation.add_rows(len(records))
+    return core_serializers.serialize('json', records)
+
+def _top_groups(dimension, dsr_filter, k):
+    # The same GROUP BY ... ORDER BY SUM(revenue_eur) DESC LIMIT k query as the rollups, so both always agree
+    return json.dumps(_compute_rollup(dimension, dsr_filter, k), cls=DjangoJSONEncoder)
+
+# What /resources/top/ ranks. Every entry returns the JSON of the top k of the DSPs selected by a DSR filter
+_top_rankings = {
+    'dsp'     : _top_dsps,
+    'isrc'    : lambda dsr_filter, k: _top_groups('isrc', dsr_filter, k),
+    'artist'  : lambda dsr_filter, k: _top_groups('artist', dsr_filter, k),
+}
+
+def top(request, k):
+    '''Handles the /resources/top/{k}/ endpoint: the k DSPs (?by=dsp, the default), ISRCs (?by=isrc) or
+    artists (?by=artist) with the highest revenue in EUR, among the DSPs selected by the same optional parameters as
+    /resources/percentile/. DSPs are returned as in /resources/percentile/, ISRCs and artists as in /resources/rollups/.
+    Results are cached (see caching) until the DSPs change.
+    '''
+    if k < 1 or k > settings.DSRS_TOP_MAX_K:
+        return HttpResponseBadRequest(f'K value {k} is not allowed! Values should be within (1-{settings.DSRS_TOP_MAX_K}) range')
+
+    dsr_filter, err_msg = _get_dsr_filter(request.GET)
+    if err_msg:
+        return HttpResponseBadRequest(err_msg)
+
+    by = request.GET.get('by', 'dsp')
+    if by not in _top_rankings:
+        return HttpResponseBadRequest(f'Ranking by {by} not supported. Use one of: {", ".join(_top_rankings)}')
+
+    def compute():
+        ingestion.summarize_dsrs(models.DSR.objects.filter(**dsr_filter))
+        return _top_rankings[by](dsr_filter, k)
+
+    data = caching.cached_result(f'top-{by}', {'k': k, **dsr_filter}, compute)
     return HttpResponse(data, content_type='application/json')
 
+def export_dsps(request):
+    '''Handles the /resources/export/ endpoint: downloads the DSPs selected by the same optional
+    parameters as /resources/percentile/ as a Parquet file, or as an Arrow IPC file with ?format=arrow. The file is
+    streamed as it is written (see dsrs.export)'''
+    if not export.is_available():
+        return HttpResponse('Exporting DSPs needs pyarrow, which is not installed', status=501)
+
+    dsr_filter, err_msg = _get_dsr_filter(request.GET)
+    if err_msg:
+        return HttpResponseBadRequest(err_msg)
+
+    file_format = request.GET.get('format', 'parquet')
+    if file_format not in export.FORMATS:
+        return HttpResponseBadRequest(f'Format {file_format} not supported. Use one of: {", ".join(export.FORMATS)}')
+
+    content_type, extension = export.FORMATS[file_format].content_type, export.FORMATS[file_format].extension
+    response = StreamingHttpResponse(export.iter_export(_dsp_filter(dsr_filter), file_format), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="dsps{extension}"'
+    return response
+
+def metrics(request):
+    '''Request counters of this process, in the Prometheus text format (see dsrs.instrumentation)'''
+    return HttpResponse(instrumentation.render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 def success(request):
     '''FROM CARLOS: Simple redirect after the form's post'''
     return HttpResponse('DSR file(s) successfully uploaded')